@@ -0,0 +1,151 @@
+"""
+Benchmark: exemplar IVF index recall and latency vs. brute force.
+
+Builds a synthetic exemplar set from the masterdoc: base messages mix a few
+keywords of one row with filler words (labelled with the row's category),
+and exemplars are edited near-duplicates of them. It indexes the set and
+for each nprobe reports, over --queries held-out texts:
+
+- recall@1 / recall@10 against exact search in the same projected space
+  (by id, so exact duplicates with equal similarity can count as misses);
+- how often the top-1 label equals exact search over the full embeddings;
+- single-query and batched latency, next to brute force over all vectors.
+
+Also times training, save, mmap load and incremental inserts.
+
+    python benchmarks/bench_ann.py [--sizes 10000 100000] [--queries 500]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hybrid_moderation.ann import IVFIndex, embed_exemplars
+from hybrid_moderation.config import CSV_FILE_PATH
+from hybrid_moderation.embedding import HashedNgramEmbedder
+from hybrid_moderation.loader import CSVLoader
+
+FILLER = ("the of and to in a is that for it was on with as this at by from they we say her she or an will my "
+          "one all would there their what so up out if about who get which go me when make can like time no just "
+          "him know take people into year your good some could them see other than then now look only come its "
+          "over think also back after use two how our work first well way even new want because any these give "
+          "day most us video post photo comment friend school game today really").split()
+
+
+def templates(categories, n, seed):
+    """Base messages: filler words mixed with a few keywords of one masterdoc row."""
+    rng = random.Random(seed)
+    rows = [c for c in categories if c.category_keywords or c.subcategory_keywords]
+    result = []
+    for _ in range(n):
+        row = rng.choice(rows)
+        words = rng.sample(FILLER, rng.randint(6, 16)) + rng.choices(
+            row.category_keywords + row.subcategory_keywords, k=rng.randint(1, 3))
+        rng.shuffle(words)
+        result.append((words, row.category))
+    return result
+
+
+def variants(bases, n, seed):
+    """Exemplars as reported in practice: near-duplicates of a base message with edits and typos."""
+    rng = random.Random(seed)
+    texts, labels = [], []
+    for _ in range(n):
+        words, label = rng.choice(bases)
+        words = [w for w in words if rng.random() > 0.15]
+        words += rng.sample(FILLER, rng.randint(0, 3))
+        if words and rng.random() < 0.5:
+            i = rng.randrange(len(words))
+            w = words[i]
+            if len(w) > 3:
+                j = rng.randrange(len(w) - 1)
+                words[i] = w[:j] + w[j + 1] + w[j] + w[j + 2:]
+        texts.append(" ".join(words))
+        labels.append(label)
+    return texts, labels
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def recall(found, exact):
+    return np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, exact)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--csv", default=CSV_FILE_PATH)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--nprobes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    categories = CSVLoader(args.csv).load_data()
+    embedder = HashedNgramEmbedder()
+    bases = templates(categories, max(args.sizes) // 20, seed=0)
+    query_texts, _ = variants(bases[:min(args.sizes) // 20], args.queries, seed=1)
+    full_queries = embedder.embed_batch(query_texts, use_idf=False)
+
+    for size in args.sizes:
+        texts, labels = variants(bases[:size // 20], size, seed=0)
+        index = IVFIndex(embedder.dim, embedder_version=embedder.feature_version)
+        vectors, embed_s = timed(embed_exemplars, index, embedder, texts)
+        _, train_s = timed(index.train, vectors, projected=True)
+        _, add_s = timed(index.add, vectors, labels, projected=True)
+        print(f"{size} exemplars: embed {embed_s:.1f} s, train {train_s * 1000:.0f} ms ({index.nlist} lists), "
+              f"add {add_s * 1000:.0f} ms, vectors {vectors.nbytes / 1024 / 1024:.1f} MB")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "exemplars.ivf")
+            _, save_s = timed(index.save, path)
+            loaded, load_s = timed(IVFIndex.load, path)
+            print(f"  save {save_s * 1000:.0f} ms, mmap load {load_s * 1000:.1f} ms")
+
+            queries = loaded.project(full_queries)
+            (exact_sims, exact_ids), brute_s = timed(loaded.brute_force, queries, k=10, projected=True)
+            # Exact top-1 label over the unprojected embeddings (chunked to bound memory).
+            best_sim = np.full(len(queries), -np.inf)
+            best_label = [None] * len(queries)
+            for i in range(0, len(texts), 4096):
+                sims = full_queries @ embedder.embed_batch(texts[i:i + 4096], use_idf=False).T
+                top = np.argmax(sims, axis=1)
+                for q, (j, s) in enumerate(zip(top, sims[np.arange(len(queries)), top])):
+                    if s > best_sim[q]:
+                        best_sim[q], best_label[q] = s, labels[i + j]
+
+            stored = np.asarray(loaded.vectors)
+            single_brute = timed(lambda: [np.argpartition(-(stored @ q), 10)[:10] for q in queries[:100]])[1]
+            print(f"  {'nprobe':>6} {'recall@1':>9} {'recall@10':>10} {'label=full':>11} "
+                  f"{'us/query':>9} {'us/q batch':>11}")
+            print(f"  {'brute':>6} {1:9.3f} {1:10.3f} {'':>11} {single_brute / 100 * 1e6:9.0f} "
+                  f"{brute_s / len(queries) * 1e6:11.1f}")
+            for nprobe in args.nprobes:
+                if nprobe > loaded.nlist:
+                    break
+                (sims, ids, label_ids), batch_s = timed(loaded.search, queries, k=10, nprobe=nprobe, projected=True)
+                single_s = timed(lambda: [loaded.search(q[None], k=10, nprobe=nprobe, projected=True)
+                                          for q in queries[:100]])[1]
+                same_label = np.mean([loaded.labels[l] == best for l, best in zip(label_ids[:, 0], best_label)])
+                print(f"  {nprobe:6d} {recall(ids[:, :1], exact_ids[:, :1]):9.3f} {recall(ids, exact_ids):10.3f} "
+                      f"{same_label:11.3f} {single_s / 100 * 1e6:9.0f} {batch_s / len(queries) * 1e6:11.1f}")
+
+            extra_texts, extra_labels = variants(bases, 1000, seed=2)
+            extra = embedder.embed_batch(extra_texts, use_idf=False)
+            _, insert_s = timed(lambda: [loaded.add(extra[i:i + 1], extra_labels[i:i + 1]) for i in range(len(extra))])
+            _, search_s = timed(loaded.search, full_queries, k=10)
+            print(f"  incremental insert {insert_s / len(extra) * 1e6:.0f} us/exemplar; "
+                  f"search after {len(extra)} inserts {search_s / len(queries) * 1e6:.1f} us/query (batch, nprobe "
+                  f"{loaded.nprobe})")
+
+
+if __name__ == "__main__":
+    main()
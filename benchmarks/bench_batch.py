@@ -0,0 +1,93 @@
+"""
+Benchmark: analyze_batch vs. one analyze call per item.
+
+Measures throughput (items/s) for a corpus with a realistic share of
+duplicate texts, both in-process and through the FastAPI app
+(N x POST /analyze vs. POST /analyze/batch), and checks that batch
+decisions match the single-item path.
+
+    python benchmarks/bench_batch.py [--items 2000] [--duplicates 0.3] 2>/dev/null
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from hybrid_moderation.core import ContentModerationSystem
+
+TEMPLATES = [
+    "Had a great time at the {w} with my family today, the weather was lovely.",
+    "This {w} video is brutal, there was blood everywhere after the fight.",
+    "Our health class covered {w} and consent, very informative lesson.",
+    "Check out this {w}, gamble your savings and win big on every bet!",
+    "lol {w}",
+    "Can anyone recommend a good {w} for beginners? Thanks in advance.",
+]
+WORDS = ["park", "street fight", "puberty", "betting app", "recipe", "guitar", "vape", "gore", "bikini", "lesson"]
+AGE_GROUPS = ["<10", "10-13", "13-16", "16+"]
+
+
+def build_items(count, duplicate_share, rng):
+    items, seen = [], []
+    for i in range(count):
+        if seen and rng.random() < duplicate_share:
+            text = rng.choice(seen)
+        else:
+            text = rng.choice(TEMPLATES).format(w=rng.choice(WORDS)) + f" #{i}"
+            seen.append(text)
+        items.append((f"c{i}", text, rng.choice(AGE_GROUPS)))
+    return items
+
+
+def throughput(label, count, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {elapsed:8.3f} s  {count / elapsed:10.0f} items/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--duplicates", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=3)
+    parser.add_argument("--skip-http", action="store_true")
+    args = parser.parse_args()
+
+    items = build_items(args.items, args.duplicates, random.Random(args.seed))
+    # Caching would let the second run reuse the first run's work.
+    cms = ContentModerationSystem(enable_cache=False)
+    cms.initialize()
+
+    singles = []
+    single_s = throughput("in-process: N x analyze", len(items),
+                          lambda: singles.extend(cms.analyze(*item) for item in items))
+    batched = []
+    batch_s = throughput("in-process: analyze_batch", len(items),
+                         lambda: batched.extend(cms.analyze_batch(items)))
+    print(f"{'':<34} speedup {single_s / batch_s:.1f}x")
+    assert [r.final_decision for r in singles] == [r.final_decision for r in batched]
+
+    if args.skip_http:
+        return
+    from fastapi.testclient import TestClient
+    import main as api
+
+    api.cms.result_cache = api.cms.analysis_cache = None
+    client = TestClient(api.app)
+    payload = [{"content_id": c, "text": t, "age_group": a} for c, t, a in items]
+    single_s = throughput("http: N x POST /analyze", len(items),
+                          lambda: [client.post("/analyze", json=p).raise_for_status() for p in payload])
+    batch_s = throughput("http: POST /analyze/batch", len(items),
+                         lambda: client.post("/analyze/batch", json={"items": payload}).raise_for_status())
+    print(f"{'':<34} speedup {single_s / batch_s:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark: cascade mode vs. the full pipeline.
+
+Runs a reference corpus (the bench_batch.py templates plus clean chat
+messages, texts with several keywords and safe-context texts) through two
+systems, cascade off and on, for every age group, and checks per item:
+
+- the final decision, action and reasoning are identical;
+- the CSV analysis (category, subcategory, confidence, keywords, age rule)
+  is identical;
+- weighted score and vector analysis are identical unless the cascade
+  skipped the vector stage.
+
+Then reports how often each stage was skipped, and the analyze and
+analyze_batch throughput of both modes, and checks that result cache hits
+keep the cascade metadata.
+
+    python benchmarks/bench_cascade.py [--items 2000] [--clean 0.6] 2>/dev/null
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from bench_batch import AGE_GROUPS, TEMPLATES, WORDS
+from hybrid_moderation.core import ContentModerationSystem
+
+CLEAN = [
+    "see you at practice tomorrow, don't forget your water bottle",
+    "what did everyone get for question 4 on the math homework?",
+    "happy birthday!! hope you have the best day",
+    "just finished my painting, going to post it later",
+    "anyone want to play minecraft after dinner?",
+]
+LOADED = [
+    "gore video of a street fight with blood and a knife, graphic violence",
+    "betting app casino gamble win big, vape and alcohol giveaway",
+    "our biology lesson covered puberty and reproductive health in health class",
+    "news report about the shooting, the journalist described the injury",
+]
+
+
+def build_corpus(count, clean_share, rng):
+    texts = []
+    for i in range(count):
+        roll = rng.random()
+        if roll < clean_share:
+            text = rng.choice(CLEAN)
+        elif roll < clean_share + (1 - clean_share) / 2:
+            text = rng.choice(TEMPLATES).format(w=rng.choice(WORDS))
+        else:
+            text = rng.choice(LOADED)
+        texts.append(f"{text} #{i}")
+    return texts
+
+
+def csv_view(result):
+    c = result.csv_analysis
+    return c.primary_category, c.subcategory, c.confidence, sorted(c.matched_keywords), c.age_restriction
+
+
+def decision_view(result):
+    d = result.final_decision
+    return d.decision, d.action_required, d.reasoning
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--clean", type=float, default=0.6, help="share of texts without any keyword")
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    texts = build_corpus(args.items, args.clean, random.Random(args.seed))
+    items = [(f"c{i}", text, age) for i, text in enumerate(texts) for age in AGE_GROUPS]
+    systems = {}
+    for cascade in (False, True):
+        cms = systems[cascade] = ContentModerationSystem(enable_cache=False, cascade=cascade)
+        cms.initialize()
+
+    runs = {}
+    for cascade, cms in systems.items():
+        singles, single_s = timed(lambda: [cms.analyze(*item) for item in items])
+        batch, batch_s = timed(lambda: cms.analyze_batch(items))
+        runs[cascade] = singles, batch
+        print(f"cascade {'on ' if cascade else 'off'}  analyze {len(items) / single_s:8.0f} items/s   "
+              f"analyze_batch {len(items) / batch_s:8.0f} items/s")
+
+    skips = Counter()
+    decisions = Counter()
+    for path in (0, 1):
+        for full, fast in zip(runs[False][path], runs[True][path]):
+            assert decision_view(full) == decision_view(fast), (full, fast)
+            assert csv_view(full) == csv_view(fast), (full, fast)
+            cascade = fast.metadata["cascade"]
+            if "vector" not in cascade["skipped_stages"]:
+                assert full.final_decision.weighted_score == fast.final_decision.weighted_score, (full, fast)
+                assert full.vector_analysis == fast.vector_analysis, (full, fast)
+            if path == 0:
+                decisions[full.final_decision.decision] += 1
+                skips[cascade["vector_skip_reason"] or "vector run"] += 1
+                skips["context rows skipped"] += cascade["rows_skipped"]
+    print(f"{len(items)} items ({len(texts)} texts x {len(AGE_GROUPS)} age groups): decisions identical "
+          f"({dict(decisions)}) in analyze and analyze_batch")
+    print("cascade: " + ", ".join(f"{name} {count}" for name, count in skips.most_common()))
+
+    cached = ContentModerationSystem(cascade=True)
+    cached.initialize()
+    for content_id, text, age in items[:200]:
+        first = cached.analyze(content_id, text, age)
+        again = cached.analyze(content_id, text, age)
+        assert again.metadata["cache"] == "hit", again.metadata
+        assert again.metadata["cascade"] == first.metadata["cascade"], (first.metadata, again.metadata)
+    print("result cache hits keep the cascade metadata")
+
+
+if __name__ == "__main__":
+    main()
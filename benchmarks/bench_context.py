@@ -0,0 +1,96 @@
+"""
+Equivalence check and benchmark: safe-context lookups (see context.py).
+
+ContextScan must decide exactly like the original per-occurrence check,
+which tokenized each occurrence's cut context window on its own, so a word
+cut by the window's edge counts as the part inside it ("healthy" cut to
+"health", "unsafe" cut to "safe"). Checked on:
+
+1. corpus.py texts, for every masterdoc keyword they contain;
+2. random texts of safe words, their longer forms and keywords, where the
+   window edges often fall inside words.
+
+Then times the original check against one scan per text.
+
+    python benchmarks/bench_context.py [--per-cell 5] [--random 20000] 2>/dev/null
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from corpus import CorpusGenerator
+from hybrid_moderation.config import CSV_FILE_PATH
+from hybrid_moderation.context import ContextValidator
+from hybrid_moderation.index import KeywordIndex
+from hybrid_moderation.loader import CSVLoader
+
+EDGE_WORDS = ("healthy unhealthy unsafe safely helpful hospitals history consent xhealth medicalx reports "
+              "the a of and porn gun drug fight").split()
+
+
+def reference_is_safe(validator, text, keyword):
+    """The original check: every occurrence's cut window holds a safe token."""
+    matches = list(re.finditer(re.escape(keyword), text, re.IGNORECASE))
+    if not matches:
+        return False
+    window = validator.context_window
+    for match in matches:
+        snippet = text[max(0, match.start() - window):min(len(text), match.end() + window)].lower()
+        if not set(re.findall(r'\w+', snippet)) & validator.ALL_SAFE_TERMS:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--per-cell", type=int, default=5)
+    parser.add_argument("--random", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    validator = ContextValidator()
+    index = KeywordIndex(CSVLoader(CSV_FILE_PATH).load_data())
+    samples = CorpusGenerator(seed=args.seed).generate(lengths=(20, 200, 2000), per_cell=args.per_cell)
+    pairs = []
+    for sample in samples:
+        lower = sample.text.lower()
+        pairs += [(sample.text, kw) for kw in index.keywords if kw in lower]
+    rng = random.Random(args.seed)
+    for _ in range(args.random):
+        text = " ".join(rng.choice(EDGE_WORDS) for _ in range(rng.randint(1, 80)))
+        pairs += [(text, kw) for kw in ("porn", "gun", "drug", "fight") if kw in text]
+
+    safe = 0
+    for text, keyword in pairs:
+        expected = reference_is_safe(validator, text, keyword)
+        assert validator.is_safe_context(text, keyword) == expected, (text, keyword, expected)
+        safe += expected
+    print(f"{len(pairs)} (text, keyword) pairs: ContextScan matches the original check ({safe} safe)")
+
+    by_text = {}
+    for text, keyword in pairs[:20000]:
+        by_text.setdefault(text, []).append(keyword)
+    start = time.perf_counter()
+    for text, keywords in by_text.items():
+        for keyword in keywords:
+            reference_is_safe(validator, text, keyword)
+    reference_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for text, keywords in by_text.items():
+        scan = validator.scan(text)
+        for keyword in keywords:
+            scan.is_safe(keyword)
+    scan_s = time.perf_counter() - start
+    print(f"{len(by_text)} texts: original check {reference_s * 1000:.1f} ms, one scan per text "
+          f"{scan_s * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
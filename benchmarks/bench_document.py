@@ -0,0 +1,168 @@
+"""
+Benchmark and equivalence check: long-document mode (see document.py).
+
+1. Equivalence: every corpus.py text from 2 KB to 50 KB, for every age group,
+   fed in random chunk sizes with small windows and stop_on_block off, gives
+   the same CSV analysis as analyze() on the whole text. With stop_on_block
+   on, a document read to the end gives the same too, and one that stopped
+   early is blocked by the age rule of a row the whole text matches.
+2. Scaling: transcripts of --sizes characters (corpus texts joined) are
+   analyzed with analyze() on the full string and with analyze_document()
+   streaming 64 KB chunks from a file. Reports time, time per KB and the
+   tracemalloc peak of each.
+3. Early stop: a transcript with a blocked passage near the start, for <10,
+   with stop_on_block on and off; and the policy's deliberate difference: a
+   blocked passage followed, a window later, by a tie on an earlier row
+   that analyze() picks, for 13-16.
+
+    python benchmarks/bench_document.py [--sizes 50000 200000 800000] 2>/dev/null
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from corpus import CorpusGenerator
+from hybrid_moderation.core import ContentModerationSystem
+
+AGE_GROUPS = ("<10", "10-13", "13-16", "16+")
+CHUNK_BYTES = 64 * 1024
+
+
+def csv_view(result):
+    c = result.csv_analysis
+    return c.primary_category, c.subcategory, c.confidence, sorted(c.matched_keywords), c.age_restriction
+
+
+def random_chunks(text, rng):
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 5000)
+        yield text[i:i + size]
+        i += size
+
+
+def file_chunks(path):
+    with open(path, encoding="utf-8") as f:
+        while True:
+            chunk = f.read(CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+
+
+def measured(fn):
+    """(result, seconds, peak traced MB) of fn(); timed and traced in separate runs."""
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+
+def transcript(samples, size, rng):
+    parts, length = [], 0
+    while length < size:
+        text = rng.choice(samples).text
+        parts.append(text)
+        length += len(text) + 1
+    return " ".join(parts)[:size]
+
+
+def analyze_in_windows(cms, text, age_group, stop_on_block, rng):
+    session = cms.document_session("doc", age_group, stop_on_block=stop_on_block)
+    # Small windows put many keyword occurrences near window edges.
+    session.window = max(rng.choice([2000, 8000]), 4 * (session.left + session.right))
+    for chunk in random_chunks(text, rng):
+        session.feed(chunk)
+        if session.stopped:
+            break
+    return session.finish()
+
+
+def check_equivalence(cms, samples, rng):
+    checked = stopped = 0
+    for sample in samples:
+        for age_group in AGE_GROUPS:
+            full = cms.analyze("full", sample.text, age_group)
+            expected = csv_view(full)
+            result = analyze_in_windows(cms, sample.text, age_group, False, rng)
+            assert csv_view(result) == expected, (sample.id, age_group, csv_view(result), expected)
+
+            result = analyze_in_windows(cms, sample.text, age_group, True, rng)
+            if result.metadata["document"]["stopped_early"]:
+                stopped += 1
+                assert result.final_decision.action_required == "Blocked by Age Rule", (sample.id, age_group)
+                assert result.csv_analysis.age_restriction == "Block", (sample.id, age_group)
+                matched_rows = {(cms.categories[row].category, cms.categories[row].subcategory)
+                                for row in cms.state.keyword_index.match(sample.text)}
+                assert (result.csv_analysis.primary_category, result.csv_analysis.subcategory) in matched_rows
+            else:
+                assert csv_view(result) == expected, (sample.id, age_group, "stop_on_block", csv_view(result), expected)
+            checked += 1
+    print(f"equivalence: {checked} documents x age groups, CSV analysis identical to analyze(); with stop_on_block "
+          f"identical when read to the end, {stopped} stopped early on an age-rule Block")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50000, 100000, 200000, 400000, 800000])
+    parser.add_argument("--per-cell", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=2)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    cms = ContentModerationSystem(enable_cache=False)
+    cms.initialize()
+    samples = CorpusGenerator(seed=args.seed).generate(lengths=[2000, 20000, 50000], per_cell=args.per_cell)
+    check_equivalence(cms, samples, rng)
+
+    print(f"{'chars':>8} {'analyze ms':>11} {'us/KB':>7} {'peak MB':>8} {'document ms':>12} {'us/KB':>7} "
+          f"{'peak MB':>8} {'windows':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            text = transcript(samples, size, rng)
+            path = os.path.join(tmp, f"transcript_{size}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            full, full_s, full_mb = measured(lambda: cms.analyze("full", text, "16+"))
+            doc, doc_s, doc_mb = measured(
+                lambda: cms.analyze_document("doc", file_chunks(path), "16+", stop_on_block=False))
+            assert csv_view(full) == csv_view(doc)
+            print(f"{size:>8} {full_s * 1000:11.1f} {full_s / size * 1024 * 1e6:7.0f} {full_mb:8.1f} "
+                  f"{doc_s * 1000:12.1f} {doc_s / size * 1024 * 1e6:7.0f} {doc_mb:8.1f} "
+                  f"{doc.metadata['document']['windows']:>8}")
+
+    clean = [s for s in samples if s.kind == "clean"]
+    blocked = "we watched a gore video of a street fight with blood everywhere. " + transcript(clean, max(args.sizes), rng)
+    for stop in (False, True):
+        result, elapsed, _ = measured(lambda: cms.analyze_document("doc", blocked, "<10", stop_on_block=stop))
+        print(f"early stop {'on ' if stop else 'off'}: {len(blocked)} chars, {elapsed * 1000:8.1f} ms, "
+              f"{result.metadata['document']['windows']} windows, decision {result.final_decision.decision} "
+              f"({result.final_decision.action_required})")
+
+    # Both rows score 1.0 and the later passage's row comes first in the
+    # masterdoc, so read to the end it wins the tie, as in analyze().
+    overridden = "watching porn tonight " + "and then we went home " * 4300 + " then boxing on tv"
+    full = cms.analyze("full", overridden, "13-16")
+    off = cms.analyze_document("doc", overridden, "13-16")
+    on = cms.analyze_document("doc", overridden, "13-16", stop_on_block=True)
+    assert csv_view(off) == csv_view(full) and off.final_decision.decision == full.final_decision.decision
+    assert on.metadata["document"]["stopped_early"] and on.csv_analysis.age_restriction == "Block"
+    print(f"policy override: analyze() and stop_on_block off {full.csv_analysis.subcategory} -> "
+          f"{full.final_decision.decision}; stop_on_block on {on.csv_analysis.subcategory} -> "
+          f"{on.final_decision.decision} after {on.metadata['document']['windows']} window(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: local embedding engine latency and memory.
+
+Builds EmbeddingSearchClient from the masterdoc with float32 and int8
+category vectors and reports:
+
+- single-text semantic_analyze latency for short, medium and long texts;
+- semantic_analyze_batch latency for 1k texts;
+- memory of the category vectors and peak traced allocation of a 1k batch;
+- how often int8 picks the same category as float32, and the largest
+  similarity difference between them.
+
+The vector_mock client is timed as a baseline.
+
+    python benchmarks/bench_embedding.py [--repeat 200] [--batch 1000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hybrid_moderation.config import CSV_FILE_PATH
+from hybrid_moderation.embedding import EmbeddingSearchClient
+from hybrid_moderation.loader import CSVLoader
+from hybrid_moderation.vector_mock import VectorSearchClient
+
+SENTENCES = [
+    "Had a great time at the park with my family today, the weather was lovely.",
+    "This street fight video is brutal, there was blood everywhere after the brawl.",
+    "Our health class covered consent and sex education, very informative lesson.",
+    "Check out this betting app, gamble your savings and win big on every bet!",
+    "The violnet assualt was shown in the news report, a graphic injury was visible.",
+    "Can anyone recommend a good book about the history of the Roman empire?",
+]
+
+
+def corpus(n, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(SENTENCES) for _ in range(rng.randint(1, 4))) for _ in range(n)]
+
+
+def per_call_us(fn, arg, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(arg)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--csv", default=CSV_FILE_PATH)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    categories = CSVLoader(args.csv).load_data()
+    names = [c.category for c in categories]
+    texts = {
+        "short (75 B)": SENTENCES[1],
+        "medium (1 KB)": " ".join(SENTENCES * 3),
+        "long (50 KB)": " ".join(SENTENCES * 110),
+    }
+    batch = corpus(args.batch)
+
+    mock = VectorSearchClient()
+    print(f"{'client':<10} {'text':<14} {'us/call':>10}")
+    for label, text in texts.items():
+        print(f"{'mock':<10} {label:<14} {per_call_us(lambda t: mock.semantic_analyze(t, names), text, args.repeat):10.1f}")
+
+    clients = {}
+    for dtype in ("float32", "int8"):
+        client = clients[dtype] = EmbeddingSearchClient(dtype=dtype)
+        start = time.perf_counter()
+        client.build(categories)
+        build_ms = (time.perf_counter() - start) * 1000
+        for label, text in texts.items():
+            repeat = args.repeat if len(text) < 10000 else max(1, args.repeat // 20)
+            print(f"{dtype:<10} {label:<14} {per_call_us(lambda t: client.semantic_analyze(t, names), text, repeat):10.1f}")
+
+        start = time.perf_counter()
+        client.semantic_analyze_batch(batch, names)
+        batch_ms = (time.perf_counter() - start) * 1000
+        tracemalloc.start()
+        client.semantic_analyze_batch(batch, names)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{dtype:<10} batch of {len(batch)}: {batch_ms:.1f} ms ({batch_ms * 1000 / len(batch):.1f} us/text), "
+              f"peak alloc {peak / 1024 / 1024:.1f} MB; build {build_ms:.1f} ms, "
+              f"category vectors {client.nbytes / 1024:.0f} KB ({len(categories)} rows x {client.embedder.dim})")
+
+    full, quantized = clients["float32"], clients["int8"]
+    queries = full.embedder.embed_batch(batch)
+    exact, approx = full.similarities(queries), quantized.similarities(queries)
+    same = (exact.argmax(axis=1) == approx.argmax(axis=1)).mean()
+    print(f"int8 vs float32: same top category {same:.1%}, max |similarity diff| {abs(exact - approx).max():.5f}")
+
+
+if __name__ == "__main__":
+    main()
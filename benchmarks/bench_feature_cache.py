@@ -0,0 +1,153 @@
+"""
+Benchmark and checks: persistent feature cache (see feature_cache.py).
+
+1. Equivalence: term frequencies served from the cache (on the first and
+   the second lookup) equal HashedNgramEmbedder.term_frequencies exactly,
+   and semantic_analyze_batch gives identical results with and without it.
+2. Speed, per text length: hashing the features vs a cold cache (hash and
+   store) vs a warm cache, for single texts and for batches.
+3. Processes: --processes workers analyze overlapping texts against one
+   cache file at the same time; no errors, and every text is stored once.
+4. Size cap: with a small cap the stored bytes stay under it, and the byte
+   total kept in the meta table matches the rows.
+5. Restart: a reopened cache serves the texts stored before.
+
+    python benchmarks/bench_feature_cache.py [--processes 4] 2>/dev/null
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import numpy as np
+
+from corpus import KINDS, CorpusGenerator
+from hybrid_moderation.core import ContentModerationSystem
+from hybrid_moderation.feature_cache import FeatureCache
+
+
+def per_text(fn, texts, batch):
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch):
+        fn(texts[i:i + batch])
+    return (time.perf_counter() - start) / len(texts) * 1e6
+
+
+def check_equivalence(client, texts, path):
+    embedder = client.embedder
+    cache = FeatureCache(path, min_chars=0)
+    expected = embedder.term_frequencies(texts)
+    for attempt in ("cold", "warm"):
+        assert np.array_equal(cache.term_frequencies(embedder, texts), expected), attempt
+    names = client.names
+    plain = client.semantic_analyze_batch(texts, names)
+    client.feature_cache = cache
+    cached = client.semantic_analyze_batch(texts, names)
+    client.feature_cache = None
+    assert plain == cached
+    print(f"equivalence: {len(texts)} texts, cached term frequencies identical cold and warm, "
+          f"semantic results identical; {cache.stats()['hit_rate']} hit rate")
+    cache.close()
+
+
+def worker(path, texts, seed, rounds, queue):
+    cms = ContentModerationSystem(enable_cache=False)
+    cms.initialize()
+    client = cms.vector_client
+    client.feature_cache = FeatureCache(path)
+    rng = random.Random(seed)
+    for _ in range(rounds):
+        batch = rng.sample(texts, rng.randint(1, 16))
+        client.semantic_analyze_batch(batch, cms.state.category_names)
+    queue.put(client.feature_cache.stats())
+
+
+def check_processes(embedder, texts, path, processes, rounds):
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=worker, args=(path, texts, seed, rounds, queue))
+               for seed in range(processes)]
+    start = time.perf_counter()
+    for p in workers:
+        p.start()
+    stats = [queue.get() for _ in workers]
+    for p in workers:
+        p.join()
+        assert p.exitcode == 0
+    elapsed = time.perf_counter() - start
+    cache = FeatureCache(path)
+    distinct = {cache.key(embedder.feature_version, n) for n in map(embedder.normalize, texts)
+                if len(n) >= cache.min_chars}
+    final = cache.stats()
+    hits, misses = sum(s["hits"] for s in stats), sum(s["misses"] for s in stats)
+    assert final["entries"] <= len(distinct)
+    print(f"processes: {processes} x {rounds} batches in {elapsed:.1f} s, {final['entries']} entries "
+          f"(of {len(distinct)} distinct texts), hit rate {hits / max(hits + misses, 1):.3f} across processes")
+    cache.close()
+
+
+def check_cap(client, texts, path):
+    cache = FeatureCache(path, max_bytes=200 * 1024, min_chars=0)
+    for i in range(0, len(texts), 32):
+        cache.term_frequencies(client.embedder, texts[i:i + 32])
+    stats = cache.stats()
+    rows = cache._conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM features").fetchone()[0]
+    assert stats["bytes"] == rows <= cache.max_bytes, (stats, rows)
+    print(f"size cap: {cache.max_bytes // 1024} KB cap, {stats['bytes'] // 1024} KB in {stats['entries']} entries "
+          f"after {len(texts)} texts, {stats['evictions']} evicted")
+    cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[200, 2000, 20000])
+    parser.add_argument("--texts", type=int, default=200, help="texts per length")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=6)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    cms = ContentModerationSystem(enable_cache=False)
+    cms.initialize()
+    client = cms.vector_client
+    generator = CorpusGenerator(seed=args.seed)
+    samples = generator.generate(lengths=[20, 200, 2000, 20000], per_cell=3)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        check_equivalence(client, [s.text for s in samples], os.path.join(tmp, "equivalence.db"))
+
+        print(f"{'chars':>6} {'batch':>6} {'hash us':>9} {'cold us':>9} {'warm us':>9} {'speedup':>8} "
+              f"{'bytes/entry':>12}")
+        embedder = client.embedder
+        for length in args.lengths:
+            texts = [generator.text(rng.choice(KINDS), length, rng) for _ in range(args.texts)]
+            for batch in (1, 64):
+                cache = FeatureCache(os.path.join(tmp, f"speed-{length}-{batch}.db"))
+                hashed = per_text(embedder.term_frequencies, texts, batch)
+                cold = per_text(lambda chunk: cache.term_frequencies(embedder, chunk), texts, batch)
+                warm = per_text(lambda chunk: cache.term_frequencies(embedder, chunk), texts, batch)
+                stats = cache.stats()
+                print(f"{length:>6} {batch:>6} {hashed:9.0f} {cold:9.0f} {warm:9.0f} {hashed / warm:7.1f}x "
+                      f"{stats['bytes'] // max(stats['entries'], 1):>12}")
+                cache.close()
+
+        texts = [generator.text(rng.choice(KINDS), rng.choice([300, 2000]), rng) for _ in range(300)]
+        path = os.path.join(tmp, "shared.db")
+        check_processes(embedder, texts, path, args.processes, args.rounds)
+        check_cap(client, texts, os.path.join(tmp, "capped.db"))
+
+        reopened = FeatureCache(path)
+        reopened.term_frequencies(embedder, texts)
+        print(f"restart: reopened cache, hit rate {reopened.stats()['hit_rate']} on the same texts")
+        reopened.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark and equivalence check: FuzzyIndex vs. SequenceMatcher over every
+token x keyword pair.
+
+Builds a deterministic typo corpus from the masterdoc's single-word keywords
+(deletions, insertions, substitutions, transpositions, doubled letters) mixed
+with ordinary words, asserts that the index returns exactly the keywords the
+brute-force ratio > 0.85 rule accepts for every token, then times both.
+
+    python benchmarks/bench_fuzzy_index.py [--seed 7] [--tokens 5000]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hybrid_moderation.config import CSV_FILE_PATH
+from hybrid_moderation.index import KeywordIndex
+from hybrid_moderation.loader import CSVLoader
+
+FILLER_WORDS = (
+    "the a and of to in is it you that he was for on are with as his they be at one have this from "
+    "or had by hot word but what some we can out other were all there when up use your how said an "
+    "each she which do their time if will way about many then them write would like so these her long "
+    "make thing see him two has look more day could go come did number sound no most people my over "
+    "know water than call first who may down side been now find any new work part take get place made "
+    "live where after back little only round man year came show every good me give our under name very "
+    "through just form sentence great think say help low line differ turn cause much mean before move "
+    "right boy old too same tell does set three want air well also play small end put home read hand"
+).split()
+
+ALPHABET = string.ascii_lowercase + string.digits
+
+
+def typo_variants(word, rng):
+    variants = []
+    if len(word) > 1:
+        i = rng.randrange(len(word))
+        variants.append(word[:i] + word[i + 1:])
+    i = rng.randrange(len(word) + 1)
+    variants.append(word[:i] + rng.choice(ALPHABET) + word[i:])
+    i = rng.randrange(len(word))
+    variants.append(word[:i] + rng.choice(ALPHABET) + word[i + 1:])
+    if len(word) > 2:
+        i = rng.randrange(len(word) - 1)
+        variants.append(word[:i] + word[i + 1] + word[i] + word[i + 2:])
+    i = rng.randrange(len(word))
+    variants.append(word[:i] + word[i] + word[i:])
+    # Two edits, mostly just outside the threshold.
+    if len(word) > 4:
+        i, j = sorted(rng.sample(range(len(word)), 2))
+        variants.append(word[:i] + rng.choice(ALPHABET) + word[i + 1:j] + rng.choice(ALPHABET) + word[j + 1:])
+    return variants
+
+
+def build_corpus(keywords, rng, size):
+    corpus = set()
+    for kw in keywords:
+        corpus.add(kw)
+        corpus.update(typo_variants(kw, rng))
+    corpus.update(FILLER_WORDS)
+    while len(corpus) < size:
+        length = rng.randint(1, 18)
+        corpus.add("".join(rng.choice(ALPHABET) for _ in range(length)))
+    return sorted(corpus)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--csv", default=CSV_FILE_PATH)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--tokens", type=int, default=5000)
+    args = parser.parse_args()
+
+    index = KeywordIndex(CSVLoader(args.csv).load_data())
+    fuzzy = index.fuzzy_index
+    rng = random.Random(args.seed)
+    corpus = build_corpus(fuzzy.keywords, rng, args.tokens)
+
+    start = time.perf_counter()
+    expected = [
+        {kid for kid, kw in enumerate(fuzzy.keywords) if index.matcher.is_fuzzy_match(kw, token)}
+        for token in corpus
+    ]
+    brute_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [fuzzy.lookup(token) for token in corpus]
+    index_s = time.perf_counter() - start
+
+    mismatches = [(token, e, a) for token, e, a in zip(corpus, expected, actual) if e != a]
+    for token, e, a in mismatches[:10]:
+        print(f"MISMATCH {token!r}: expected {sorted(fuzzy.keywords[k] for k in e)} "
+              f"got {sorted(fuzzy.keywords[k] for k in a)}")
+    matched = sum(1 for e in expected if e)
+    print(f"tokens={len(corpus)} keywords={len(fuzzy.keywords)} tokens_with_fuzzy_hits={matched} "
+          f"mismatches={len(mismatches)}")
+    print(f"brute force: {brute_s / len(corpus) * 1e6:9.1f} us/token")
+    print(f"fuzzy index: {index_s / len(corpus) * 1e6:9.1f} us/token  ({brute_s / index_s:.0f}x)")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark and equivalence check: incremental re-moderation (see incremental.py).
+
+1. Equivalence: corpus.py texts go through chains of random edits
+   (insertions and deletions of words, keywords and safe terms, typos,
+   punctuation, case and non-ASCII changes, joins across the edit). After
+   every edit the updated state must equal one built from scratch, and
+   analyze() with a memory content store must give the same result as
+   analyze() without one.
+2. Speed: for each text length, one small edit at a random position; the
+   keyword and context stages from scratch vs updated from the previous
+   version, then analyze() end to end (cache off) without a store, with
+   the memory store and with the SQLite store.
+3. Persistence: a reopened SQLite store still holds the states.
+
+    python benchmarks/bench_incremental.py [--edits 30] [--lengths 2000 20000 50000] 2>/dev/null
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from corpus import CorpusGenerator
+from hybrid_moderation.core import ContentModerationSystem
+from hybrid_moderation.incremental import MemoryContentStore, SQLiteContentStore, build, update
+
+AGE_GROUPS = ("<10", "10-13", "13-16", "16+")
+ODD_PIECES = ["İstanbul", "ΟΔΟΣ", "Σ", "straße", "...", "-", "'", "\n", "  ", "health class", "health, class",
+              "ﬁght", "x_y", "12", "é"]
+
+
+def edit(text, generator, rng):
+    """One random edit of text."""
+    pos = rng.randint(0, len(text))
+    kind = rng.randrange(6)
+    if kind == 0:  # insert a word, keyword or safe term
+        piece = rng.choice([rng.choice(generator.filler), rng.choice(rng.choice(generator.rows)),
+                            rng.choice(generator.safe_terms), rng.choice(ODD_PIECES)])
+        return text[:pos] + rng.choice(["", " "]) + piece + rng.choice(["", " "]) + text[pos:]
+    if kind == 1:  # delete a span, possibly joining words
+        return text[:pos] + text[pos + rng.randint(1, 40):]
+    if kind == 2:  # replace a span
+        return text[:pos] + rng.choice(ODD_PIECES + generator.filler) + text[pos + rng.randint(1, 10):]
+    if kind == 3:  # typo inside a word
+        return text[:pos] + rng.choice("aeiouxyz") + text[pos + 1:]
+    if kind == 4:  # case change of a span
+        return text[:pos] + text[pos:pos + 20].upper() + text[pos + 20:]
+    return text[:pos] + rng.choice(".,!?-' ") + text[pos:]  # punctuation or space
+
+
+def comparable(state):
+    return (state.occurrences, state.spans, state.tokens, state.token_hits)
+
+
+def view(result):
+    c, d = result.csv_analysis, result.final_decision
+    return (c.primary_category, c.subcategory, c.confidence, sorted(c.matched_keywords), c.age_restriction,
+            d.decision, d.weighted_score, d.action_required)
+
+
+def check_equivalence(fresh, incremental, generator, samples, edits, rng):
+    index, validator = fresh.keyword_index, fresh.context_validator
+    checked = 0
+    for sample in samples:
+        text = sample.text
+        state = build(index, validator, fresh.version, text)
+        for step in range(edits):
+            text = edit(text, generator, rng)
+            state, _ = update(index, validator, state, text)
+            assert comparable(state) == comparable(build(index, validator, fresh.version, text)), (sample.id, step)
+            age_group = AGE_GROUPS[step % len(AGE_GROUPS)]
+            expected = view(fresh.analyze(sample.id, text, age_group))
+            assert view(incremental.analyze(sample.id, text, age_group)) == expected, (sample.id, step)
+            checked += 1
+    stats = incremental.content_store.stats()
+    print(f"equivalence: {len(samples)} texts x {edits} edits = {checked} versions; updated states equal fresh "
+          f"ones and analyze() results are identical (store hit rate {stats['hit_rate']}, "
+          f"changed share {stats['changed_share']})")
+
+
+def per_call(fn, versions):
+    start = time.perf_counter()
+    for args in versions:
+        fn(*args)
+    return (time.perf_counter() - start) / len(versions) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--edits", type=int, default=30, help="edits per text in the equivalence check")
+    parser.add_argument("--per-cell", type=int, default=2)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[2000, 5000, 20000, 50000])
+    parser.add_argument("--versions", type=int, default=30, help="edited versions timed per length")
+    parser.add_argument("--seed", type=int, default=4)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    fresh = ContentModerationSystem(enable_cache=False)
+    fresh.initialize()
+    incremental = ContentModerationSystem(enable_cache=False)
+    incremental.initialize()
+    incremental.content_store = MemoryContentStore()
+    generator = CorpusGenerator(seed=args.seed)
+    samples = generator.generate(lengths=[1000, 2000, 20000], per_cell=args.per_cell)
+    check_equivalence(fresh, incremental, generator, samples, args.edits, rng)
+
+    index, validator, version = fresh.keyword_index, fresh.context_validator, fresh.version
+    state_of = fresh.state
+    print(f"{'chars':>6} {'stages fresh us':>16} {'updated us':>11} {'speedup':>8} | analyze us: {'no store':>9} "
+          f"{'memory':>9} {'sqlite':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite = ContentModerationSystem(enable_cache=False)
+        sqlite.initialize()
+        sqlite.content_store = SQLiteContentStore(os.path.join(tmp, "content.db"))
+        for length in args.lengths:
+            base = generator.text("many_hits", length, rng)
+            versions = [base]
+            for _ in range(args.versions):
+                versions.append(edit(versions[-1], generator, rng))
+            previous = [build(index, validator, version, text) for text in versions[:-1]]
+
+            fresh_us = per_call(lambda text: fresh._keyword_stage(state_of, text), [(t,) for t in versions[1:]])
+            updated_us = per_call(lambda prev, text: incremental_stage(fresh, prev, text),
+                                  list(zip(previous, versions[1:])))
+
+            timings = []
+            for system in (fresh, incremental, sqlite):
+                content_id = f"post-{length}"
+                system.analyze(content_id, versions[0], "13-16")
+                timings.append(per_call(lambda text: system.analyze(content_id, text, "13-16"),
+                                        [(t,) for t in versions[1:]]))
+            print(f"{length:>6} {fresh_us:16.0f} {updated_us:11.0f} {fresh_us / updated_us:7.1f}x | "
+                  f"{'':>12}{timings[0]:9.0f} {timings[1]:9.0f} {timings[2]:9.0f}")
+
+        path = sqlite.content_store.path
+        sqlite.content_store.close()
+        reopened = SQLiteContentStore(path)
+        content_id = f"post-{args.lengths[-1]}"
+        state = reopened.get(content_id)
+        assert state is not None and state.version == version
+        print(f"sqlite: reopened store holds {reopened.stats()['entries']} states; {content_id} resumes at "
+              f"{len(state.text)} chars")
+        reopened.close()
+
+
+def incremental_stage(system, previous, text):
+    """_keyword_stage's work with the state updated from `previous` (no store)."""
+    index, validator = system.keyword_index, system.context_validator
+    content, _ = update(index, validator, previous, text)
+    row_matches = index.row_scores(*content.hits())
+    if row_matches:
+        system._best_match(system.state, row_matches, content.scan(validator, index.keywords))
+
+
+if __name__ == "__main__":
+    main()
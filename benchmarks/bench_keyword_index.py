@@ -0,0 +1,118 @@
+"""
+Benchmark: compiled keyword index vs. the per-category matcher loop.
+
+Scales the loaded masterdoc to 1x/10x/100x its size by cloning every row with
+renamed keywords, checks that both paths agree on every row, then times the
+exact-containment scan and the whole keyword stage (including the fuzzy typo
+pass) of a request. The legacy keyword stage is only timed up to
+--full-max-scale because its fuzzy pass takes tens of seconds per request at
+100x.
+
+    python benchmarks/bench_keyword_index.py [--scales 1 10 100] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+from dataclasses import replace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hybrid_moderation.config import CSV_FILE_PATH
+from hybrid_moderation.index import KeywordIndex
+from hybrid_moderation.loader import CSVLoader
+from hybrid_moderation.matcher import KeywordMatcher
+
+SAMPLE_TEXTS = [
+    "Had a great time at the park with my family today, the weather was lovely.",
+    "This street fight video is brutal, there was blood everywhere after the brawl.",
+    "Our health class covered consent and sex education, very informative lesson.",
+    "Check out this betting app, gamble your savings and win big on every bet!",
+    "The violnet assualt was shown in the news report, a graphic injury was visible.",
+]
+
+
+def scale_categories(categories, factor):
+    scaled = list(categories)
+    for copy in range(1, factor):
+        suffix = f"x{copy}"
+        for cat in categories:
+            scaled.append(replace(
+                cat,
+                category=f"{cat.category} {suffix}",
+                category_keywords=[kw + suffix for kw in cat.category_keywords],
+                subcategory_keywords=[kw + suffix for kw in cat.subcategory_keywords],
+            ))
+    return scaled
+
+
+def legacy_scan(matcher, categories, text):
+    results = {}
+    for row, cat in enumerate(categories):
+        cat_result = matcher.calculate_match_confidence(text, cat.category_keywords)
+        sub_result = matcher.calculate_match_confidence(text, cat.subcategory_keywords)
+        if cat_result[0] > 0 or sub_result[0] > 0:
+            results[row] = (cat_result, sub_result)
+    return results
+
+
+def legacy_exact(categories, text):
+    text_lower = text.lower()
+    return [[kw for kw in cat.category_keywords + cat.subcategory_keywords if kw in text_lower]
+            for cat in categories]
+
+
+def normalize(results):
+    return {
+        row: tuple((score, sorted(matches)) for score, matches in entry)
+        for row, entry in results.items()
+    }
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in SAMPLE_TEXTS:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(SAMPLE_TEXTS) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--csv", default=CSV_FILE_PATH)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--full-max-scale", type=int, default=10)
+    args = parser.parse_args()
+
+    matcher = KeywordMatcher()
+    base = CSVLoader(args.csv).load_data()
+
+    print(f"{'scale':>6} {'rows':>6} {'keywords':>9} {'build ms':>9} | {'exact: legacy':>13} {'index':>8} {'speedup':>8} "
+          f"| {'stage: legacy':>13} {'index':>8} {'speedup':>8}   (ms/request)")
+    for factor in args.scales:
+        categories = scale_categories(base, factor)
+        start = time.perf_counter()
+        index = KeywordIndex(categories, matcher)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        exact_legacy = timed(lambda t: legacy_exact(categories, t), args.repeat)
+        exact_index = timed(index.exact_hits, args.repeat)
+        stage_index = timed(index.match, args.repeat)
+        if factor <= args.full_max_scale:
+            for text in SAMPLE_TEXTS:
+                expected = normalize(legacy_scan(matcher, categories, text))
+                actual = normalize(index.match(text))
+                assert expected == actual, f"index disagrees with matcher at {factor}x on {text!r}"
+            stage_legacy = timed(lambda t: legacy_scan(matcher, categories, t), args.repeat)
+            stage = f"{stage_legacy:>13.2f} {stage_index:>8.2f} {stage_legacy / stage_index:>7.1f}x"
+        else:
+            stage = f"{'-':>13} {stage_index:>8.2f} {'-':>8}"
+        print(f"{factor:>5}x {len(categories):>6} {len(index.keywords):>9} {build_ms:>9.1f} | "
+              f"{exact_legacy:>13.3f} {exact_index:>8.3f} {exact_legacy / exact_index:>7.1f}x | {stage}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark: cost of recording metrics, single-threaded and from many threads.
+
+    python benchmarks/bench_metrics.py [--samples 1000000] [--threads 8]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hybrid_moderation.metrics import Registry
+
+
+def record(histogram, counter, samples):
+    for i in range(samples):
+        histogram.observe(1000 + (i & 0xFFFF) * 37, "keyword")
+        counter.inc("PASS")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--samples", type=int, default=1_000_000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    registry = Registry()
+    histogram = registry.histogram("bench_seconds", "bench", ("stage",))
+    counter = registry.counter("bench_total", "bench", ("decision",))
+
+    start = time.perf_counter_ns()
+    record(histogram, counter, args.samples)
+    single = (time.perf_counter_ns() - start) / args.samples
+    print(f"1 thread : {single:6.0f} ns per observe+inc")
+
+    per_thread = args.samples // args.threads
+    threads = [threading.Thread(target=record, args=(histogram, counter, per_thread)) for _ in range(args.threads)]
+    start = time.perf_counter_ns()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    multi = (time.perf_counter_ns() - start) / (per_thread * args.threads)
+    print(f"{args.threads} threads: {multi:6.0f} ns per observe+inc (wall time / samples)")
+
+    start = time.perf_counter_ns()
+    text = registry.render()
+    print(f"render   : {(time.perf_counter_ns() - start) / 1e6:6.2f} ms for {len(text.splitlines())} lines")
+    assert counter.values()[("PASS",)] == args.samples + per_thread * args.threads
+
+
+if __name__ == "__main__":
+    main()
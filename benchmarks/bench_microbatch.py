@@ -0,0 +1,129 @@
+"""
+Load test: micro-batching on vs off (see MicroBatcher in serving.py).
+
+Closed-loop clients call /analyze's dispatch path directly from asyncio (no
+HTTP), each sending its next request as soon as the previous one returns,
+with unique texts so the result cache does not help. For every concurrency
+level the thread dispatcher is driven alone and behind a MicroBatcher;
+reports throughput, p50/p99 request latency and the mean batch size, and
+asserts that both give the same decisions. Then checks that, behind the
+batcher, requests use the result cache and the content store as analyze()
+does, and report their own processing time.
+
+    python benchmarks/bench_microbatch.py [--requests 3000] [--concurrency 1 8 32 128] [--max-wait 0.002] 2>/dev/null
+"""
+import argparse
+import asyncio
+import math
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from bench_serving import TEMPLATES
+from hybrid_moderation.core import ContentModerationSystem
+from hybrid_moderation.incremental import MemoryContentStore
+from hybrid_moderation.serving import MICROBATCH_SIZE, MicroBatcher, ThreadDispatcher
+
+AGE_GROUPS = ("<10", "10-13", "13-16", "16+")
+
+
+def percentile(ordered, q):
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+async def drive(target, requests, concurrency):
+    counter = iter(range(requests))
+    latencies = []
+    decisions = {}
+
+    async def client():
+        for i in counter:
+            start = time.perf_counter()
+            result = await target.analyze(f"c{i}", TEMPLATES[i % len(TEMPLATES)].format(i=i),
+                                          AGE_GROUPS[i % len(AGE_GROUPS)])
+            latencies.append(time.perf_counter() - start)
+            decisions[i] = (result.final_decision.decision, result.final_decision.weighted_score)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, sorted(latencies), decisions
+
+
+def batch_stats():
+    counts = next(iter(MICROBATCH_SIZE.values().values()), None)
+    return (sum(counts[:-1]), counts[-1]) if counts else (0, 0)
+
+
+def check_cache_and_store(max_size, max_wait):
+    cms = ContentModerationSystem()
+    cms.content_store = MemoryContentStore()
+    cms.initialize()
+    reference = ContentModerationSystem(enable_cache=False)
+    reference.initialize()
+    document = " ".join(TEMPLATES[i % len(TEMPLATES)].format(i=i) for i in range(40))
+    items = [(f"c{i}", TEMPLATES[i % len(TEMPLATES)].format(i=i % 20), AGE_GROUPS[i % 4]) for i in range(80)]
+
+    async def run(items):
+        dispatcher = ThreadDispatcher(cms, max_pending=10 ** 6)
+        batcher = MicroBatcher(dispatcher, max_size, max_wait)
+        try:
+            return await asyncio.gather(*(batcher.analyze(*item) for item in items))
+        finally:
+            dispatcher.shutdown(wait=True)
+
+    passes = [items + [("doc", document, "13-16")], items + [("doc", document + " One more line.", "13-16")]]
+    for n, batch in enumerate(passes):
+        results = asyncio.run(run(batch))
+        for item, result in zip(batch, results):
+            expected = reference.analyze(*item)
+            assert (result.final_decision.decision, result.final_decision.weighted_score) == \
+                   (expected.final_decision.decision, expected.final_decision.weighted_score), item[0]
+            assert result.metadata["processing_time_ms"] >= int(result.metadata["queue_wait_ms"]), item[0]
+            if n == 1 and item[0] != "doc":
+                assert result.metadata.get("cache") == "hit", item[0]
+    store = cms.content_store.stats()
+    assert store["hits"] == 1, store
+    print(f"behind the batcher: decisions equal analyze(), repeated requests served from the result cache, "
+          f"the edited document re-scanned incrementally (content store {store['hits']} hit)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--max-size", type=int, default=32)
+    parser.add_argument("--max-wait", type=float, default=0.002)
+    parser.add_argument("--workers", type=int, default=0, help="thread pool size (0 = default)")
+    args = parser.parse_args()
+
+    cms = ContentModerationSystem(enable_cache=False)
+    cms.initialize()
+    dispatcher = ThreadDispatcher(cms, args.workers, max_pending=10 ** 6)
+    batcher = MicroBatcher(dispatcher, args.max_size, args.max_wait)
+    asyncio.run(drive(dispatcher, 200, 8))  # warm-up
+
+    print(f"CPUs: {os.cpu_count()}, {args.requests} requests per run, max batch {args.max_size}, "
+          f"max wait {args.max_wait * 1000:g} ms")
+    print(f"{'concurrency':>11} {'batching':>9} {'items/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'mean batch':>11}")
+    for concurrency in args.concurrency:
+        decisions = {}
+        for label, target in (("off", dispatcher), ("on", batcher)):
+            batches, items = batch_stats()
+            elapsed, latencies, decisions[label] = asyncio.run(drive(target, args.requests, concurrency))
+            batches_after, items_after = batch_stats()
+            mean_batch = (items_after - items) / (batches_after - batches) if batches_after > batches else 1
+            print(f"{concurrency:>11} {label:>9} {args.requests / elapsed:9.0f} "
+                  f"{percentile(latencies, 50) * 1000:8.2f} {percentile(latencies, 99) * 1000:8.2f} "
+                  f"{mean_batch:11.1f}")
+        assert decisions["off"] == decisions["on"], "micro-batching changed decisions"
+    dispatcher.shutdown(wait=True)
+    print("decisions identical with batching on and off")
+    check_cache_and_store(args.max_size, args.max_wait)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Benchmark and equivalence check: typo prefilter (see prefilter.py).
+
+1. Tokens: on the bench_fuzzy_index.py typo corpus, asserts that the
+   prefilter passes every token for which SequenceMatcher accepts some
+   keyword (zero false negatives), and reports its false-positive rate and
+   cost next to the FuzzyIndex lookup.
+2. Texts: on a clean-heavy corpus (--clean share of messages made of words
+   that hit no keyword, the rest bench_batch.py templates), asserts that
+   KeywordIndex.match is unchanged by the prefilter, checks a sample against
+   KeywordMatcher.calculate_match_confidence row by row, then times match
+   and analyze with the prefilter on and off (cascade off and on).
+
+    python benchmarks/bench_prefilter.py [--texts 2000] [--clean 0.9] [--fp-rates 0.1 0.01 0.001] 2>/dev/null
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from bench_batch import AGE_GROUPS, TEMPLATES, WORDS
+from bench_fuzzy_index import FILLER_WORDS, build_corpus
+from hybrid_moderation.core import ContentModerationSystem
+from hybrid_moderation.prefilter import TypoPrefilter
+
+MORE_WORDS = (
+    "tomorrow practice homework question everyone finished painting later dinner castle river fishing "
+    "online weekend holiday birthday morning evening teacher lunch sandwich football soccer basketball "
+    "library museum garden kitchen window yellow purple orange pencil notebook project picture camera "
+    "bicycle skateboard puppy kitten rabbit turtle cookie muffin pancake breakfast summer winter autumn "
+    "spring beach mountain forest island planet rocket science history geography music guitar piano "
+    "violin drawing crayon sticker puzzle board cards chess grandma grandpa cousin sister brother"
+).split()
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def clean_vocabulary(index):
+    """Words that hit no keyword, exactly or fuzzily, on their own."""
+    saved, index.prefilter = index.prefilter, None
+    words = [w for w in dict.fromkeys(FILLER_WORDS + MORE_WORDS) if not index.match(w)]
+    index.prefilter = saved
+    return words
+
+
+def build_texts(count, clean_share, vocabulary, rng):
+    texts = []
+    for i in range(count):
+        if rng.random() < clean_share:
+            text = " ".join(rng.choices(vocabulary, k=rng.randint(4, 30)))
+        else:
+            text = rng.choice(TEMPLATES).format(w=rng.choice(WORDS))
+        texts.append(f"{text} {i}")
+    return texts
+
+
+def reference_match(cms, text):
+    """Per-row scores from KeywordMatcher, in KeywordIndex.match's shape."""
+    result = {}
+    for row, cat in enumerate(cms.categories):
+        cat_match = cms.matcher.calculate_match_confidence(text, cat.category_keywords)
+        sub_match = cms.matcher.calculate_match_confidence(text, cat.subcategory_keywords)
+        if cat_match[0] or sub_match[0]:
+            result[row] = ((cat_match[0], sorted(cat_match[1])), (sub_match[0], sorted(sub_match[1])))
+    return result
+
+
+def comparable(matches):
+    return {row: tuple((score, sorted(kws)) for score, kws in fields) for row, fields in matches.items()}
+
+
+def check_tokens(index, fp_rates, rng):
+    fuzzy = index.fuzzy_index
+    tokens = build_corpus(fuzzy.keywords, rng, 5000)
+    expected = [any(index.matcher.is_fuzzy_match(kw, token) for kw in fuzzy.keywords) for token in tokens]
+    _, lookup_s = timed(lambda: [fuzzy.lookup(token) for token in tokens])
+    print(f"tokens: {len(tokens)}, {sum(expected)} with a fuzzy hit; FuzzyIndex lookup "
+          f"{lookup_s / len(tokens) * 1e6:.1f} us/token")
+    for rate in fp_rates:
+        prefilter, build_s = timed(TypoPrefilter, fuzzy.keywords, rate)
+        passed, filter_s = timed(lambda: [prefilter.may_match(token) for token in tokens])
+        missed = [token for token, hit, ok in zip(tokens, expected, passed) if hit and not ok]
+        assert not missed, f"prefilter rejected fuzzy matches: {missed[:10]}"
+        # Tokens too long to screen always pass; count the rest.
+        negatives = [ok for token, hit, ok in zip(tokens, expected, passed)
+                     if not hit and (len(token) in prefilter.depths or len(token) > prefilter.max_length)]
+        print(f"  fp rate {rate:<6} bloom {prefilter.bloom.nbytes / 1024:6.1f} KB, {prefilter.bloom.probes} probes, "
+              f"{prefilter.bloom.items} variants, build {build_s * 1000:5.0f} ms | 0 false negatives, "
+              f"passed {sum(negatives) / max(len(negatives), 1):.3f} of screened non-matching tokens, "
+              f"{filter_s / len(tokens) * 1e6:.1f} us/token")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--clean", type=float, default=0.9, help="share of texts without any keyword")
+    parser.add_argument("--reference", type=int, default=200, help="texts checked against KeywordMatcher")
+    parser.add_argument("--fp-rates", type=float, nargs="+", default=[0.1, 0.01, 0.001])
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    systems = {}
+    for cascade in (False, True):
+        cms = systems[cascade] = ContentModerationSystem(enable_cache=False, cascade=cascade)
+        cms.initialize()
+    cms = systems[False]
+    index = cms.keyword_index
+    check_tokens(index, args.fp_rates, rng)
+
+    vocabulary = clean_vocabulary(index)
+    texts = build_texts(args.texts, args.clean, vocabulary, rng)
+    prefilter = index.prefilter
+    filtered, on_s = timed(lambda: [index.match(text) for text in texts])
+    index.prefilter = None
+    plain, off_s = timed(lambda: [index.match(text) for text in texts])
+    index.prefilter = prefilter
+    for text, a, b in zip(texts, filtered, plain):
+        assert comparable(a) == comparable(b), text
+    for text, matches in zip(texts[:args.reference], filtered):
+        assert comparable(matches) == reference_match(cms, text), text
+    clean = sum(1 for matches in filtered if not matches)
+    print(f"texts: {len(texts)}, {clean} without any keyword hit; match() identical with and without the "
+          f"prefilter, first {args.reference} equal KeywordMatcher")
+    print(f"  match   prefilter off {off_s / len(texts) * 1e6:8.1f} us/text   on {on_s / len(texts) * 1e6:8.1f} us/text"
+          f"   ({off_s / on_s:.1f}x)")
+
+    items = [(f"p{i}", text, AGE_GROUPS[i % len(AGE_GROUPS)]) for i, text in enumerate(texts)]
+    for cascade, system in systems.items():
+        keyword_index = system.keyword_index
+        prefilter = keyword_index.prefilter
+        rates = {}
+        decisions = {}
+        for enabled in (False, True):
+            keyword_index.prefilter = prefilter if enabled else None
+            results, elapsed = timed(lambda: [system.analyze(*item) for item in items])
+            rates[enabled] = len(items) / elapsed
+            decisions[enabled] = [r.final_decision.decision for r in results]
+        keyword_index.prefilter = prefilter
+        assert decisions[False] == decisions[True]
+        print(f"  analyze cascade {'on ' if cascade else 'off'} prefilter off {rates[False]:8.0f} items/s   "
+              f"on {rates[True]:8.0f} items/s   (decisions identical)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Benchmark: preforking server vs `uvicorn --workers` (see prefork.py).
+
+Starts each server with --workers N on a free port and reports:
+- cold start: launch until every worker logged "Application startup
+  complete";
+- memory per worker after --requests /analyze calls spread over the
+  workers: unique set size (private pages, what one more worker costs), PSS
+  and RSS, and the PSS of all the server's processes together.
+
+Then, for the preforking server only: SIGHUP with the masterdoc unchanged
+must keep the workers, a forced reload (SIGUSR1) under load must restart
+every worker without failing a request, and a stopped worker (SIGSTOP, so
+it misses heartbeats) must be replaced.
+
+    python benchmarks/bench_prefork.py [--workers 4] [--requests 400]
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from bench_serving import TEMPLATES
+
+READY = "Application startup complete"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def memory(pid):
+    """(USS, PSS, RSS) in KiB from /proc/<pid>/smaps_rollup."""
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        fields = dict(re.findall(r"^(\w+):\s+(\d+) kB", f.read(), re.M))
+    uss = int(fields["Private_Clean"]) + int(fields["Private_Dirty"])
+    return uss, int(fields["Pss"]), int(fields["Rss"])
+
+
+def wait_ready(log_path, workers, proc, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with open(log_path) as f:
+            if f.read().count(READY) >= workers:
+                return
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}, see {log_path}")
+        time.sleep(0.01)
+    raise RuntimeError(f"workers not ready after {timeout}s")
+
+
+def post(port, i):
+    body = json.dumps({"content_id": f"c{i}", "text": TEMPLATES[i % len(TEMPLATES)].format(i=i)}).encode()
+    request = urllib.request.Request(f"http://127.0.0.1:{port}/analyze", body,
+                                     {"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())["final_decision"]["decision"]
+
+
+def load(port, requests, concurrency=8):
+    """Sends `requests` /analyze calls from `concurrency` threads; returns the number that failed."""
+    counter = iter(range(requests))
+    lock = threading.Lock()
+    failed = []
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            try:
+                post(port, i)
+            except Exception as e:
+                failed.append(e)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(failed)
+
+
+def start(kind, workers, port, log_path, extra=()):
+    if kind == "prefork":
+        cmd = [sys.executable, "-m", "hybrid_moderation.prefork", "main:app", "--port", str(port),
+               "--workers", str(workers), *extra]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers)]
+    env = dict(os.environ, MODERATION_TRACE_LEVEL="WARNING")
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=open(log_path, "w"), env=env)
+    wait_ready(log_path, workers, proc)
+    return proc, time.perf_counter() - started
+
+
+def worker_pids(kind, master):
+    pids = children(master)
+    if kind == "uvicorn":
+        # Skip multiprocessing's helper processes (e.g. the resource tracker).
+        pids = [p for p in pids if b"spawn_main" in open(f"/proc/{p}/cmdline", "rb").read()]
+    return pids
+
+
+def stop(proc):
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def measure(kind, workers, requests, tmp):
+    port = free_port()
+    proc, cold = start(kind, workers, port, os.path.join(tmp, f"{kind}.log"))
+    try:
+        failed = load(port, requests)
+        assert failed == 0, f"{failed} requests failed"
+        pids = worker_pids(kind, proc.pid)
+        assert len(pids) == workers, pids
+        per_worker = [memory(p) for p in pids]
+        total_pss = sum(m[1] for m in per_worker) + memory(proc.pid)[1]
+    finally:
+        stop(proc)
+    mean = [sum(m[i] for m in per_worker) / len(per_worker) / 1024 for i in range(3)]
+    print(f"{kind:>8} {cold:13.2f} {mean[0]:9.1f} {mean[1]:9.1f} {mean[2]:9.1f} {total_pss / 1024:14.1f}")
+
+
+def check_supervision(workers, requests, tmp):
+    port = free_port()
+    log_path = os.path.join(tmp, "supervision.log")
+    proc, _ = start("prefork", workers, port, log_path, ["--heartbeat-timeout", "2"])
+    try:
+        before = set(worker_pids("prefork", proc.pid))
+        proc.send_signal(signal.SIGHUP)
+        time.sleep(2)
+        assert set(worker_pids("prefork", proc.pid)) == before, "SIGHUP restarted workers of an unchanged masterdoc"
+        print(f"unchanged reload: SIGHUP kept all {workers} workers")
+
+        result = {}
+        loader = threading.Thread(target=lambda: result.update(failed=load(port, requests, 4)))
+        loader.start()
+        time.sleep(0.2)
+        proc.send_signal(signal.SIGUSR1)
+        loader.join()
+        deadline = time.monotonic() + 30
+        while set(worker_pids("prefork", proc.pid)) & before and time.monotonic() < deadline:
+            time.sleep(0.1)
+        after = set(worker_pids("prefork", proc.pid))
+        assert not after & before and len(after) == workers, (before, after)
+        assert result["failed"] == 0, f"{result['failed']} requests failed during the restart"
+        print(f"graceful restart: SIGUSR1 during {requests} requests replaced all {workers} workers, 0 failed")
+
+        # Reloads in quick succession retire workers faster than they drain;
+        # the master must keep serving (adding heartbeat slots if needed).
+        before = after
+        loader = threading.Thread(target=lambda: result.update(failed=load(port, requests, 4)))
+        loader.start()
+        for _ in range(4):
+            time.sleep(0.3)
+            proc.send_signal(signal.SIGUSR1)
+        loader.join()
+        deadline = time.monotonic() + 60
+        while (set(worker_pids("prefork", proc.pid)) & before or len(worker_pids("prefork", proc.pid)) != workers) \
+                and time.monotonic() < deadline:
+            time.sleep(0.1)
+        after = set(worker_pids("prefork", proc.pid))
+        assert proc.poll() is None, "the master exited during repeated reloads"
+        assert not after & before and len(after) == workers, (before, after)
+        assert result["failed"] == 0, f"{result['failed']} requests failed during repeated reloads"
+        grown = "heartbeat slots" in open(log_path).read()
+        print(f"repeated restarts: 4 SIGUSR1 in 1.2s kept serving, 0 failed"
+              f"{' (heartbeat slots added)' if grown else ''}")
+
+        stuck = next(iter(after))
+        os.kill(stuck, signal.SIGSTOP)
+        stopped = time.monotonic()
+        while stuck in worker_pids("prefork", proc.pid) and time.monotonic() < stopped + 30:
+            time.sleep(0.1)
+        while len(worker_pids("prefork", proc.pid)) < workers and time.monotonic() < stopped + 30:
+            time.sleep(0.1)
+        assert stuck not in worker_pids("prefork", proc.pid)
+        assert load(port, 50) == 0
+        print(f"health: a stopped worker was replaced after {time.monotonic() - stopped:.1f}s "
+              f"(heartbeat timeout 2s)")
+    finally:
+        stop(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=400)
+    args = parser.parse_args()
+
+    print(f"CPUs: {os.cpu_count()}, {args.workers} workers, {args.requests} requests before measuring, "
+          f"masterdoc {os.environ.get('MODERATION_MASTERDOC', 'Models_Masterdoc_Test.csv')}")
+    print(f"{'server':>8} {'cold start s':>13} {'USS MiB':>9} {'PSS MiB':>9} {'RSS MiB':>9} "
+          f"{'total PSS MiB':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in ("uvicorn", "prefork"):
+            measure(kind, args.workers, args.requests, tmp)
+        check_supervision(args.workers, args.requests, tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark: cost of the profiling hooks (see profiling.py).
+
+1. Off: with sample rate 0 analyze and analyze_batch are the plain methods
+   (no wrapper on the instance), and profiled calls return the same results.
+2. Per-call latency of analyze (cache off, best of 3 passes) with profiling
+   off, sampled at 1% and 10%, and for every call in each mode.
+3. Export: time to build the admin endpoints' output from a full buffer.
+
+    python benchmarks/bench_profiling.py [--calls 400] 2>/dev/null
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from corpus import KINDS, CorpusGenerator
+from hybrid_moderation.core import ContentModerationSystem
+from hybrid_moderation.profiling import collapsed_cpu, collapsed_memory, pstats_dump, pstats_text
+
+
+def decisions(results):
+    return [(r.final_decision.decision, r.final_decision.weighted_score) for r in results]
+
+
+def per_call(cms, samples, repeat=3):
+    """Best of `repeat` passes, in microseconds per call, and the last pass's results."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [cms.analyze(s.id, s.text, "13-16") for s in samples]
+        best = min(best, time.perf_counter() - start)
+    return best / len(samples) * 1e6, results
+
+
+def timed(fn):
+    start = time.perf_counter()
+    out = fn()
+    return (time.perf_counter() - start) * 1000, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=8)
+    args = parser.parse_args()
+
+    cms = ContentModerationSystem(enable_cache=False)
+    cms.initialize()
+    generator = CorpusGenerator(seed=args.seed)
+    samples = generator.generate(lengths=[200, 2000], per_cell=-(-args.calls // (2 * len(KINDS))))[:args.calls]
+    per_call(cms, samples[:50], 1)  # warm-up
+
+    assert "analyze" not in vars(cms) and "analyze_batch" not in vars(cms)
+    _, baseline = per_call(cms, samples, 1)
+    print(f"off: analyze and analyze_batch are the plain methods; {len(samples)} calls per pass")
+    # Latency drifts on a shared machine: each setting is compared with an
+    # off pass run right before it.
+    print(f"{'profiling':>18} {'off us/call':>12} {'us/call':>9} {'overhead':>9} {'profiles':>9}")
+    for mode, rate in (("cpu", 0.01), ("cpu", 0.1), ("cpu", 1.0), ("memory", 1.0), ("both", 1.0)):
+        cms.configure_profiling(0)
+        assert "analyze" not in vars(cms)
+        off_us, _ = per_call(cms, samples)
+        cms.profiler.clear()
+        cms.configure_profiling(rate, mode)
+        us, results = per_call(cms, samples)
+        assert decisions(results) == decisions(baseline), mode
+        print(f"{f'{mode} at {rate:g}':>18} {off_us:12.0f} {us:9.0f} {us / off_us - 1:8.1%} "
+              f"{len(cms.profiler.profiles()):>9}")
+        if rate == 1.0 and mode == "both":
+            profiles = cms.profiler.profiles()
+    print("profiled results identical to unprofiled ones")
+
+    print(f"export of {len(profiles)} buffered profiles:")
+    for label, fn in (("pstats text", lambda: pstats_text(profiles).encode()), ("pstats file", lambda: pstats_dump(profiles)),
+                      ("collapsed cpu", lambda: collapsed_cpu(profiles).encode()),
+                      ("collapsed memory", lambda: collapsed_memory(profiles).encode())):
+        ms, out = timed(fn)
+        print(f"{label:>18} {ms:8.1f} ms {len(out):9d} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Benchmark: masterdoc hot reload.
+
+For each scale the masterdoc is cloned 1x/10x/... (see bench_snapshot.py)
+and loaded. Then the CSV is edited in place and the system reloaded:
+
+- description: one row's Description changes (keyword index fully reused);
+- age rule: one row's rules_below_10 flips (same);
+- keyword: one keyword is added to one row (automaton and fuzzy tables rebuilt);
+- shared keyword: a keyword other rows have is added to one more row;
+- unchanged: reload without any edit.
+
+For every edit the reload time is reported next to a full initialize(), and
+the reloaded system's results on a corpus are checked against a freshly
+initialized system on the edited file, and the index it replaced is checked
+to match as before (patching must not write to it). Finally --threads analyze in a loop
+while the sheet is reloaded --swaps times, reporting failed requests and the
+slowest request.
+
+    python benchmarks/bench_reload.py [--scales 1 10 50] [--threads 4] [--swaps 20]
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_snapshot import scale_csv
+from hybrid_moderation.config import CSV_FILE_PATH
+from hybrid_moderation.core import ContentModerationSystem
+
+TEXTS = [
+    "Had a great time at the park with my family today.",
+    "This street fight video is brutal, there was blood everywhere after the brawl.",
+    "Our health class covered consent and sex education, very informative.",
+    "Check out this betting app, gamble your savings and win big!",
+    "The violnet assualt was shown in the news report.",
+    "my friend keeps talking about vaping and weed at school",
+    "new recipe: chocolate cake with strawberries",
+]
+AGE_GROUPS = ("<10", "10-13", "13-16", "16+")
+
+
+def edit_csv(path, edit):
+    with open(path, encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        fieldnames, rows = reader.fieldnames, list(reader)
+    row = next(r for r in rows if r["Subcategory"] and r["Tokenized_subcategory_keywords_total"])
+    if edit == "description":
+        row["Description"] += " (revised)"
+    elif edit == "age rule":
+        row["rules_below_10"] = "Allow" if row["rules_below_10"] == "Block" else "Block"
+    elif edit == "keyword":
+        row["Tokenized_subcategory_keywords_total"] += ",streetbrawl"
+    elif edit == "shared keyword":
+        row = next(r for r in rows if r["Subcategory"] and "blood" not in r["Tokenized_subcategory_keywords_total"])
+        row["Tokenized_subcategory_keywords_total"] += ",blood"
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def comparable(result):
+    csv_result, vector = result.csv_analysis, result.vector_analysis
+    return (csv_result.primary_category, csv_result.subcategory, csv_result.confidence,
+            sorted(csv_result.matched_keywords), csv_result.age_restriction,
+            vector.semantic_category, vector.confidence, vector.embedding_similarity,
+            result.final_decision.decision, result.final_decision.weighted_score,
+            result.metadata["masterdoc_version"])
+
+
+def check_equal(reloaded, path):
+    fresh = ContentModerationSystem(path, enable_cache=False)
+    fresh.initialize()
+    for text in TEXTS + ["streetbrawl tonight behind the gym"]:
+        for age_group in AGE_GROUPS:
+            a, b = reloaded.analyze("check", text, age_group), fresh.analyze("check", text, age_group)
+            assert comparable(a) == comparable(b), (text, age_group, comparable(a), comparable(b))
+
+
+def timed_ms(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def under_load(cms, path, threads, swaps):
+    stop = threading.Event()
+    latencies, errors = [], []
+
+    def client(seed):
+        i = seed
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                cms.analyze("load", TEXTS[i % len(TEXTS)] + f" #{i}", AGE_GROUPS[i % 4])
+            except Exception as e:
+                errors.append(e)
+            latencies.append(time.perf_counter() - start)
+            i += threads
+
+    workers = [threading.Thread(target=client, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for swap in range(swaps):
+        edit_csv(path, "age rule" if swap % 2 else "keyword")
+        cms.reload()
+    stop.set()
+    for worker in workers:
+        worker.join()
+    latencies.sort()
+    print(f"  under load: {swaps} reloads, {len(latencies)} requests on {threads} threads, {len(errors)} errors, "
+          f"p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, max {latencies[-1] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--csv", default=os.path.join(ROOT, CSV_FILE_PATH))
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--swaps", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for factor in args.scales:
+            path = os.path.join(tmp, f"masterdoc_{factor}x.csv")
+            scale_csv(args.csv, factor, path)
+            cms = ContentModerationSystem(path, enable_cache=False)
+            _, init_ms = timed_ms(cms.initialize)
+            print(f"{factor}x masterdoc ({len(cms.categories)} rows): initialize {init_ms:.1f} ms")
+            for edit in ("description", "age rule", "keyword", "shared keyword", "unchanged"):
+                edit_csv(path, edit)
+                previous = cms.state.keyword_index
+                before = [previous.match(text) for text in TEXTS]
+                summary, reload_ms = timed_ms(cms.reload)
+                assert [previous.match(text) for text in TEXTS] == before, f"reload changed the previous index ({edit})"
+                check_equal(cms, path)
+                print(f"  reload after {edit:<14} {reload_ms:8.1f} ms  changed rows {summary.get('changed_rows', 0)}"
+                      f"  reloaded {summary['reloaded']}  (results equal a fresh load)")
+            under_load(cms, path, args.threads, args.swaps)
+
+
+if __name__ == "__main__":
+    main()
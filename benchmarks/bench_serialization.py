@@ -0,0 +1,94 @@
+"""
+Benchmark and equivalence check: result serialization (ModerationResult.to_json).
+
+1. Equivalence: for corpus.py texts in every age group (fresh, cached and
+   batched results), to_json("full") is byte-for-byte the body FastAPI's
+   generic path (jsonable_encoder + JSONResponse) produced, and the compact
+   view holds the same content_id, decision and weighted_score.
+2. Speed and size per result: the generic path vs to_json per view.
+3. End to end: /analyze/batch through the app (TestClient), per view.
+
+    python benchmarks/bench_serialization.py [--per-cell 5] 2>/dev/null
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from corpus import CorpusGenerator
+from hybrid_moderation.core import ContentModerationSystem
+
+AGE_GROUPS = ("<10", "10-13", "13-16", "16+")
+
+
+def generic(result) -> bytes:
+    return JSONResponse(jsonable_encoder(result)).body
+
+
+def per_result(fn, results, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for result in results:
+            fn(result)
+    return (time.perf_counter() - start) / (repeat * len(results)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--per-cell", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    cms = ContentModerationSystem()
+    cms.initialize()
+    samples = CorpusGenerator(seed=args.seed).generate(lengths=[20, 200, 2000], per_cell=args.per_cell)
+    results = []
+    for i, sample in enumerate(samples):
+        age_group = AGE_GROUPS[i % len(AGE_GROUPS)]
+        results.append(cms.analyze(sample.id, sample.text, age_group))
+        results.append(cms.analyze(sample.id + "-again", sample.text, age_group))  # result cache hit
+    results += cms.analyze_batch([(s.id, s.text, "13-16") for s in samples])
+
+    for result in results:
+        full = result.to_json("full")
+        assert full.encode() == generic(result), result.content_id
+        compact = json.loads(result.to_json("compact"))
+        decision = result.final_decision
+        assert compact == {"content_id": result.content_id, "final_decision": {
+            "weighted_score": decision.weighted_score, "decision": decision.decision}}
+    print(f"equivalence: {len(results)} results; full view identical to the generic encoder's bytes")
+
+    print(f"{'serializer':>16} {'us/result':>10} {'bytes/result':>13}")
+    rows = [("generic (before)", generic),
+            ("to_json full", lambda r: r.to_json("full").encode()),
+            ("to_json compact", lambda r: r.to_json("compact").encode())]
+    for label, fn in rows:
+        size = sum(len(fn(r)) for r in results) / len(results)
+        print(f"{label:>16} {per_result(fn, results, args.repeat):10.1f} {size:13.0f}")
+
+    from fastapi.testclient import TestClient
+    import main as api
+    items = [{"content_id": s.id, "text": s.text, "age_group": "13-16"} for s in samples[:100]]
+    with TestClient(api.app) as client:
+        print(f"/analyze/batch, {len(items)} items:")
+        for view in ("full", "compact"):
+            client.post(f"/analyze/batch?view={view}", json={"items": items})  # result cache warm
+            start = time.perf_counter()
+            response = client.post(f"/analyze/batch?view={view}", json={"items": items})
+            elapsed = time.perf_counter() - start
+            assert response.status_code == 200 and len(response.json()) == len(items)
+            print(f"{view:>16} {elapsed * 1000:8.1f} ms {len(response.content):8d} bytes")
+        assert client.post("/analyze?view=tiny", json={"text": "hello"}).status_code == 422
+
+
+if __name__ == "__main__":
+    main()
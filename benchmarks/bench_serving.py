@@ -0,0 +1,89 @@
+"""
+Benchmark: async dispatch throughput vs. worker count, and load shedding.
+
+Drives the dispatchers from serving.py directly from asyncio with a fixed
+number of concurrent clients (no HTTP), using unique texts so the result
+cache does not help. Reports items/s for the thread dispatcher and for the
+process dispatcher at 1, 2, 4, ... workers up to the CPU count, then shows
+how many requests are rejected (429) once in-flight work hits max_pending.
+
+    python benchmarks/bench_serving.py [--requests 2000] [--concurrency 64]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from hybrid_moderation.core import ContentModerationSystem
+from hybrid_moderation.serving import Overloaded, ProcessDispatcher, ThreadDispatcher
+
+TEMPLATES = [
+    "Had a great time at the park with my family today, the weather was lovely ({i}).",
+    "This street fight video is brutal, there was blood everywhere after the brawl ({i}).",
+    "Our health class covered consent and puberty, very informative lesson ({i}).",
+    "Check out this betting app, gamble your savings and win big on every bet ({i})!",
+]
+
+
+async def drive(dispatcher, requests, concurrency):
+    counter = iter(range(requests))
+    rejected = 0
+
+    async def client():
+        nonlocal rejected
+        for i in counter:
+            try:
+                await dispatcher.analyze(f"c{i}", TEMPLATES[i % len(TEMPLATES)].format(i=i), "13-16")
+            except Overloaded:
+                rejected += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, rejected
+
+
+def report(label, requests, elapsed, rejected):
+    served = requests - rejected
+    print(f"{label:<24} {served / elapsed:10.0f} items/s   rejected {rejected}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    print(f"CPUs: {cpus}, concurrency: {args.concurrency}")
+
+    cms = ContentModerationSystem(enable_cache=False)
+    cms.initialize()
+    dispatcher = ThreadDispatcher(cms, max_pending=10 ** 6)
+    report("thread pool", args.requests, *asyncio.run(drive(dispatcher, args.requests, args.concurrency)))
+    dispatcher.shutdown(wait=True)
+
+    workers = 1
+    while True:
+        dispatcher = ProcessDispatcher(workers=workers, max_pending=10 ** 6)
+        dispatcher.warm_up()
+        report(f"process pool x{workers}", args.requests,
+               *asyncio.run(drive(dispatcher, args.requests, args.concurrency)))
+        dispatcher.shutdown(wait=True)
+        if workers >= cpus:
+            break
+        workers = min(workers * 2, cpus)
+
+    dispatcher = ProcessDispatcher(workers=cpus, max_pending=max(1, args.concurrency // 4))
+    dispatcher.warm_up()
+    report(f"max_pending={dispatcher.max_pending}", args.requests,
+           *asyncio.run(drive(dispatcher, args.requests, args.concurrency)))
+    dispatcher.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    main()
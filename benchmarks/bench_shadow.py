@@ -0,0 +1,173 @@
+"""
+Benchmark and equivalence check: shadow evaluation of a candidate masterdoc
+(see shadow.py).
+
+The candidate is a copy of the masterdoc with an age rule tightened, new
+keywords (words of corpus.py's filler) and one another row has added to
+one row, and keywords removed from another.
+
+1. Equivalence, for corpus.py texts in every age group, through analyze
+   (cache off and on, so also from cached results) and analyze_batch:
+   KeywordDelta's candidate hits equal the candidate index's own, the
+   shadow's flips (decision and weighted score) are exactly the decisions
+   a system loaded with the candidate disagrees with, and the live results
+   (and the live index's matches) are the same with the shadow on and
+   after it stopped.
+2. Cost per comparison: the shadow (reusing the live work) vs a second full
+   analysis with the candidate system.
+3. Live latency of analyze (cache off) with the shadow off, and running in
+   the background for every text and for 10% of them; each setting is
+   compared with an off pass run right before it.
+
+    python benchmarks/bench_shadow.py [--per-cell 4] 2>/dev/null
+"""
+import argparse
+import csv
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from corpus import CorpusGenerator
+from hybrid_moderation.config import CSV_FILE_PATH
+from hybrid_moderation.core import ContentModerationSystem
+from hybrid_moderation.shadow import AGE_GROUPS, KeywordDelta, TextWork
+
+
+def write_candidate(path: str):
+    with open(CSV_FILE_PATH, encoding="utf-8", errors="replace", newline="") as f:
+        reader = csv.DictReader(f)
+        fields, rows = reader.fieldnames, list(reader)
+    for row in rows:
+        if row["Subcategory"] == "Physical Altercation":
+            row["rules_13_16"] = "Block"
+        elif row["Subcategory"] == "Dangerous Challenges & Stunts":
+            row["Tokenized_subcategory_keywords_total"] += ", skateboard, birthday party, pancake, blood"
+        elif row["Subcategory"] == "Scams & Fraud":
+            keywords = row["Tokenized_subcategory_keywords_total"].split(",")
+            row["Tokenized_subcategory_keywords_total"] = ",".join(keywords[8:])
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def decision(result):
+    return result.final_decision.decision, result.final_decision.weighted_score
+
+
+def check_equivalence(candidate_path, samples):
+    reference = ContentModerationSystem(candidate_path, enable_cache=False)
+    reference.initialize()
+    items = [(f"{s.id}/{age}", s.text, age) for s in samples for age in AGE_GROUPS]
+    expected = None
+    for enable_cache in (False, True):
+        cms = ContentModerationSystem(enable_cache=enable_cache)
+        cms.initialize()
+        plain = [decision(cms.analyze(*item)) for item in items]
+        live_matches = [cms.state.keyword_index.match(s.text) for s in samples]
+        if expected is None:
+            candidate = [decision(reference.analyze(*item)) for item in items]
+            expected = {item[0]: c for item, c, p in zip(items, candidate, plain) if c[0] != p[0]}
+
+            delta = KeywordDelta(cms.state.keyword_index, reference.state.keyword_index)
+            for sample in samples:
+                shadow_hits = delta.hits(TextWork(sample.text))
+                assert shadow_hits == reference.state.keyword_index.hits(sample.text), sample.id
+
+        for mode in ("analyze", "analyze again", "analyze_batch"):
+            cms.start_shadow(candidate_path, background=False)
+            flips = {}
+            cms.shadow.on_flip = lambda flip: flips.__setitem__(
+                flip["content_id"], (flip["candidate"]["decision"], flip["candidate"]["weighted_score"]))
+            if mode == "analyze_batch":
+                live = [decision(r) for r in cms.analyze_batch(items)]
+            else:
+                live = [decision(cms.analyze(*item)) for item in items]
+            report = cms.stop_shadow()
+            assert live == plain, mode
+            assert flips == expected, (mode, set(flips.items()) ^ set(expected.items()))
+            assert report["compared"] == len(items) and report["flipped"] == len(expected)
+            assert [cms.state.keyword_index.match(s.text) for s in samples] == live_matches, mode
+            assert [decision(cms.analyze(*item)) for item in items] == plain, mode
+    print(f"equivalence: {len(items)} comparisons ({len(samples)} texts x {len(AGE_GROUPS)} age groups), "
+          f"{len(expected)} flips; analyze (cache off/on, fresh and cached) and analyze_batch agree with "
+          f"the candidate system, live results unchanged")
+    return report
+
+
+def per_call(cms, items, repeat=3):
+    """Best of `repeat` passes: mean and p99 microseconds per analyze call."""
+    best = None
+    for _ in range(repeat):
+        latencies = []
+        for item in items:
+            start = time.perf_counter()
+            cms.analyze(*item)
+            latencies.append(time.perf_counter() - start)
+        mean = statistics.fmean(latencies)
+        if best is None or mean < best[0]:
+            best = (mean, sorted(latencies)[int(len(latencies) * 0.99)])
+    return best[0] * 1e6, best[1] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--per-cell", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    generator = CorpusGenerator(seed=args.seed)
+    samples = generator.generate(lengths=[20, 200, 2000], per_cell=args.per_cell)
+    with tempfile.TemporaryDirectory() as tmp:
+        candidate_path = os.path.join(tmp, "candidate.csv")
+        write_candidate(candidate_path)
+        report = check_equivalence(candidate_path, samples)
+        print(f"candidate: {report['keywords_added']} keywords added, {report['keywords_removed']} removed; "
+              f"flips {report['transitions']}")
+        for category, ages in report["by_category"].items():
+            print(f"  {category[:40]:40} " + "  ".join(
+                f"{age}: {cell['flipped']}/{cell['compared']}" for age, cell in ages.items()))
+
+        print(f"cost per comparison ({len(samples)} texts, cache off, vector stage for every text):")
+        cms = ContentModerationSystem(enable_cache=False)
+        cms.initialize()
+        reference = ContentModerationSystem(candidate_path, enable_cache=False)
+        reference.initialize()
+        print(f"{'text chars':>10} {'second analysis us':>19} {'shadow us':>10} {'ratio':>7}")
+        for length in (20, 200, 2000):
+            items = [(s.id, s.text, "13-16") for s in samples if s.length == length]
+            start = time.perf_counter()
+            for item in items:
+                reference.analyze(*item)
+            second_us = (time.perf_counter() - start) / len(items) * 1e6
+            cms.start_shadow(candidate_path, background=False)
+            for item in items:
+                cms.analyze(*item)
+            shadow_us = cms.stop_shadow()["shadow_ms_mean"] * 1000
+            print(f"{length:>10} {second_us:19.0f} {shadow_us:10.0f} {shadow_us / second_us:6.1%}")
+
+        items = [(s.id, s.text, age) for s in samples if s.length in (200, 2000) for age in ("<10", "13-16")]
+        per_call(cms, items[:20], 1)  # warm-up
+        print(f"live analyze latency, {len(items)} calls per pass (200 and 2000 chars):")
+        print(f"{'shadow':>18} {'off us':>8} {'us/call':>8} {'overhead':>9} {'off p99':>8} {'p99':>8} "
+              f"{'compared':>9} {'dropped':>8}")
+        for rate in (1.0, 0.1):
+            off, off_p99 = per_call(cms, items)
+            cms.start_shadow(candidate_path, sample_rate=rate)
+            on, on_p99 = per_call(cms, items)
+            # Let the queue drain before stopping, so the counts cover every pass.
+            while cms.shadow.report()["pending"]:
+                time.sleep(0.01)
+            report = cms.stop_shadow()
+            print(f"{f'background {rate:g}':>18} {off:8.0f} {on:8.0f} {on / off - 1:8.1%} {off_p99:8.0f} "
+                  f"{on_p99:8.0f} {report['compared']:>9} {report['dropped']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmark: worker startup and memory, masterdoc CSV vs. compiled snapshot.
+
+For each scale the masterdoc is cloned 1x/10x/... (renamed keywords and all
+free-text columns kept, so the CSV parse cost scales too) and compiled to a
+snapshot. Then --workers fresh processes are started at once per format;
+each one initializes a ContentModerationSystem, analyzes a few texts and
+reports its initialize() time and its memory from /proc/self/smaps_rollup
+while all workers are still alive:
+
+- rss: resident pages, counting shared ones in full;
+- pss: shared pages divided among the processes mapping them;
+- unique: private pages, i.e. what each additional worker really costs.
+
+Finally checks that a snapshot load hashes the source CSV only if its size
+or mtime changed since compiling, and still warns once the CSV is edited.
+
+    python benchmarks/bench_snapshot.py [--scales 1 10] [--workers 4]
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from hybrid_moderation.config import CSV_FILE_PATH
+from hybrid_moderation.snapshot import SnapshotLoader, compile_snapshot
+
+KEYWORD_COLUMNS = ("Tokenized_category_keywords_total", "Tokenized_subcategory_keywords_total")
+
+WORKER = r"""
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+from hybrid_moderation.core import ContentModerationSystem
+imported = time.perf_counter()
+cms = ContentModerationSystem(sys.argv[2], enable_cache=False)
+cms.initialize()
+ready = time.perf_counter()
+for text in ("Had a great time at the park today.", "This street fight video is brutal, blood everywhere.",
+             "Check out this betting app, gamble your savings!"):
+    cms.analyze("bench", text)
+sys.stdout.write(json.dumps({"import_ms": (imported - start) * 1000, "init_ms": (ready - imported) * 1000}) + "\n")
+sys.stdout.flush()
+sys.stdin.readline()
+memory = {}
+with open("/proc/self/smaps_rollup") as f:
+    for line in f:
+        parts = line.split()
+        if len(parts) == 3 and parts[2] == "kB":
+            memory[parts[0].rstrip(":")] = int(parts[1])
+sys.stdout.write(json.dumps({"rss_kb": memory["Rss"], "pss_kb": memory["Pss"],
+                             "unique_kb": memory["Private_Clean"] + memory["Private_Dirty"]}) + "\n")
+"""
+
+
+def scale_csv(source, factor, out_path):
+    with open(source, encoding="utf-8", errors="replace", newline="") as f:
+        reader = csv.DictReader(f)
+        fieldnames, rows = reader.fieldnames, list(reader)
+    with open(out_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames)
+        writer.writeheader()
+        for copy in range(factor):
+            suffix = f"x{copy}" if copy else ""
+            for row in rows:
+                row = dict(row)
+                if copy and row["Category"]:
+                    row["Category"] = f"{row['Category']} {suffix}"
+                for column in KEYWORD_COLUMNS:
+                    if copy and row[column]:
+                        row[column] = ",".join(kw.strip() + suffix for kw in row[column].split(",") if kw.strip())
+                writer.writerow(row)
+
+
+def run_workers(path, workers):
+    procs = [subprocess.Popen([sys.executable, "-c", WORKER, ROOT, path], stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+             for _ in range(workers)]
+    timings = [json.loads(p.stdout.readline()) for p in procs]
+    # Every worker is loaded and idle; now measure while they all share the mappings.
+    for p in procs:
+        p.stdin.write("\n")
+        p.stdin.flush()
+    memory = [json.loads(p.stdout.readline()) for p in procs]
+    for p in procs:
+        p.wait()
+    return [dict(t, **m) for t, m in zip(timings, memory)]
+
+
+def summarize(label, size, results):
+    def mean(key):
+        return sum(r[key] for r in results) / len(results)
+    print(f"  {label:<9} {size / 1024:9.0f} KB  init {mean('init_ms'):8.1f} ms  "
+          f"rss {mean('rss_kb') / 1024:6.1f} MB  pss {mean('pss_kb') / 1024:6.1f} MB  "
+          f"unique {mean('unique_kb') / 1024:6.1f} MB")
+
+
+def check_stale_warning(csv_path, snap_path):
+    """The source CSV is hashed only when its size or mtime changed, and an edit still warns."""
+    def load():
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger("hybrid_moderation.snapshot")
+        logger.addHandler(handler)
+        try:
+            loader = SnapshotLoader(snap_path)
+            start = time.perf_counter()
+            loader.load_data()
+            elapsed = (time.perf_counter() - start) * 1000
+        finally:
+            logger.removeHandler(handler)
+        return [r for r in records if r.levelno == logging.WARNING], elapsed
+
+    warnings, unchanged_ms = load()
+    assert not warnings, warnings
+    stat = os.stat(csv_path)
+    os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    warnings, touched_ms = load()
+    assert not warnings, "a touched but unchanged CSV was reported stale"
+    with open(csv_path, "a") as f:
+        f.write("\n")
+    warnings, _ = load()
+    assert len(warnings) == 1 and "recompile" in warnings[0].getMessage(), warnings
+    print(f"stale check: load {unchanged_ms:.1f} ms with the CSV unchanged, {touched_ms:.1f} ms once touched "
+          f"(hashed); an edit warns")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--csv", default=os.path.join(ROOT, CSV_FILE_PATH))
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for factor in args.scales:
+            csv_path = os.path.join(tmp, f"masterdoc_{factor}x.csv")
+            snap_path = os.path.join(tmp, f"masterdoc_{factor}x.snap")
+            scale_csv(args.csv, factor, csv_path)
+            start = time.perf_counter()
+            compile_snapshot(csv_path, snap_path)
+            compile_ms = (time.perf_counter() - start) * 1000
+            print(f"{factor}x masterdoc, {args.workers} workers (compile {compile_ms:.0f} ms):")
+            summarize("csv", os.path.getsize(csv_path), run_workers(csv_path, args.workers))
+            summarize("snapshot", os.path.getsize(snap_path), run_workers(snap_path, args.workers))
+        check_stale_warning(csv_path, snap_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Benchmark suite: per-component latency on a synthetic corpus (see corpus.py),
+as JSON that can be compared across runs.
+
+Components, each timed per text (one call = one sample):
+
+- keyword_matcher: KeywordMatcher.calculate_match_confidence over every
+  row's keyword lists (the reference matcher; only up to --matcher-max-chars,
+  it is quadratic in tokens x keywords);
+- keyword_index: KeywordIndex.match, what analyze uses;
+- context: ContextValidator.scan plus is_safe for the text's matched keywords;
+- vector_mock: VectorSearchClient.semantic_analyze;
+- vector: the configured vector client (VECTOR_BACKEND);
+- analyze: ContentModerationSystem.analyze end to end (result cache off);
+- http: POST /analyze through the FastAPI app in an in-process TestClient.
+
+For every component x kind x length the JSON holds n, mean, p50/p95/p99 (in
+microseconds), calls/s and MB/s, plus run metadata (git commit, masterdoc
+version, Python, settings). With --compare, p50/p95 ratios against an
+earlier run are added and printed; --max-regression makes the run exit 1 if
+any p95 ratio exceeds it.
+
+    python benchmarks/bench_suite.py [--per-cell 5] [--repeat 3] [--out run.json] [--compare base.json] 2>/dev/null
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from corpus import KINDS, LENGTHS, CorpusGenerator, describe
+from hybrid_moderation import config
+from hybrid_moderation.core import ContentModerationSystem
+from hybrid_moderation.vector_mock import VectorSearchClient
+
+COMPONENTS = ("keyword_matcher", "keyword_index", "context", "vector_mock", "vector", "analyze", "http")
+
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(durations_ns, characters):
+    ordered = sorted(durations_ns)
+    total_s = sum(ordered) / 1e9
+    return {
+        "n": len(ordered),
+        "mean_us": round(total_s / len(ordered) * 1e6, 2),
+        "p50_us": round(percentile(ordered, 50) / 1e3, 2),
+        "p95_us": round(percentile(ordered, 95) / 1e3, 2),
+        "p99_us": round(percentile(ordered, 99) / 1e3, 2),
+        "calls_per_s": round(len(ordered) / total_s, 1) if total_s else None,
+        "mb_per_s": round(characters / total_s / 1e6, 3) if total_s else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Suite:
+    def __init__(self, cms: ContentModerationSystem, matcher_max_chars: int):
+        self.cms = cms
+        self.matcher_max_chars = matcher_max_chars
+        self.mock = VectorSearchClient()
+        self.client = None
+
+    def calls(self, component, samples):
+        """fn(text) running `component` once on a text of `samples`."""
+        cms, state = self.cms, self.cms.state
+        if component == "keyword_matcher":
+            matcher = cms.matcher
+
+            def run(text):
+                for cat in state.categories:
+                    matcher.calculate_match_confidence(text, cat.category_keywords)
+                    matcher.calculate_match_confidence(text, cat.subcategory_keywords)
+            return run
+        if component == "keyword_index":
+            return state.keyword_index.match
+        if component == "context":
+            validator = cms.context_validator
+            # The keywords each text matches are found outside the timed call.
+            matched = {s.text: [kw for fields in state.keyword_index.match(s.text).values()
+                                for _, kws in fields for kw in kws] for s in samples}
+
+            def run(text):
+                scan = validator.scan(text)
+                for kw in matched[text]:
+                    scan.is_safe(kw)
+            return run
+        if component == "vector_mock":
+            return lambda text: self.mock.semantic_analyze(text, state.category_names)
+        if component == "vector":
+            return lambda text: state.vector_client.semantic_analyze(text, state.category_names)
+        if component == "analyze":
+            return lambda text: cms.analyze("bench", text, "13-16")
+        if component == "http":
+            client = self.http_client()
+            return lambda text: client.post("/analyze", json={"text": text, "age_group": "13-16"}).raise_for_status()
+        raise ValueError(component)
+
+    def http_client(self):
+        if self.client is None:
+            from fastapi.testclient import TestClient
+            os.environ.setdefault("MODERATION_MASTERDOC", self.cms.loader.file_path)
+            import main as api
+
+            api.cms.result_cache = api.cms.analysis_cache = None
+            self.client = TestClient(api.app)
+        return self.client
+
+    def skip_reason(self, component, sample):
+        if component == "keyword_matcher" and sample.length > self.matcher_max_chars:
+            return f"longer than --matcher-max-chars {self.matcher_max_chars}"
+        return None
+
+    def run(self, component, samples, repeat, skipped):
+        fn = self.calls(component, samples)
+        cells = defaultdict(list)
+        for sample in samples:
+            reason = self.skip_reason(component, sample)
+            if reason:
+                skipped[(component, sample.kind, sample.length)] = reason
+                continue
+            fn(sample.text)  # warm-up (first-call imports, lazy tables)
+            for _ in range(repeat):
+                start = time.perf_counter_ns()
+                fn(sample.text)
+                cells[(sample.kind, sample.length)].append((time.perf_counter_ns() - start, len(sample.text)))
+        results = []
+        for (kind, length), timings in cells.items():
+            entry = {"component": component, "kind": kind, "length": length}
+            entry.update(summarize([d for d, _ in timings], sum(c for _, c in timings)))
+            results.append(entry)
+        return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["component"], r["kind"], r["length"]): r for r in json.load(f)["results"]}
+    rows = []
+    for r in results:
+        base = baseline.get((r["component"], r["kind"], r["length"]))
+        if base is None:
+            continue
+        rows.append({"component": r["component"], "kind": r["kind"], "length": r["length"],
+                     "p50_ratio": round(r["p50_us"] / base["p50_us"], 3) if base["p50_us"] else None,
+                     "p95_ratio": round(r["p95_us"] / base["p95_us"], 3) if base["p95_us"] else None})
+    return rows
+
+
+def print_table(results, comparison, out):
+    ratios = {(c["component"], c["kind"], c["length"]): c for c in comparison}
+    print(f"{'component':<16} {'kind':<13} {'length':>6} {'n':>4} {'p50 us':>11} {'p95 us':>11} {'p99 us':>11} "
+          f"{'calls/s':>10} {'MB/s':>7}" + ("  p50x   p95x" if comparison else ""), file=out)
+    for r in results:
+        line = (f"{r['component']:<16} {r['kind']:<13} {r['length']:>6} {r['n']:>4} {r['p50_us']:>11.1f} "
+                f"{r['p95_us']:>11.1f} {r['p99_us']:>11.1f} {r['calls_per_s']:>10.1f} {r['mb_per_s']:>7.2f}")
+        ratio = ratios.get((r["component"], r["kind"], r["length"]))
+        if ratio:
+            line += f"  {ratio['p50_ratio']:5.2f}  {ratio['p95_ratio']:5.2f}"
+        print(line, file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--csv", default=config.CSV_FILE_PATH)
+    parser.add_argument("--components", nargs="+", default=list(COMPONENTS), choices=COMPONENTS)
+    parser.add_argument("--kinds", nargs="+", default=list(KINDS), choices=KINDS)
+    parser.add_argument("--lengths", type=int, nargs="+", default=list(LENGTHS))
+    parser.add_argument("--per-cell", type=int, default=5, help="texts per kind x length")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per text")
+    parser.add_argument("--matcher-max-chars", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="-", help="JSON output path ('-' = stdout)")
+    parser.add_argument("--compare", help="earlier run's JSON to compare against")
+    parser.add_argument("--max-regression", type=float, help="exit 1 if any p95 ratio vs --compare exceeds this")
+    args = parser.parse_args()
+
+    samples = CorpusGenerator(args.csv, args.seed).generate(args.kinds, args.lengths, args.per_cell)
+    cms = ContentModerationSystem(args.csv, enable_cache=False)
+    cms.initialize()
+    suite = Suite(cms, args.matcher_max_chars)
+
+    started = time.perf_counter()
+    results = []
+    skipped = {}
+    for component in args.components:
+        results.extend(suite.run(component, samples, args.repeat, skipped))
+    comparison = compare(results, args.compare) if args.compare else []
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "git_commit": git_commit(),
+            "masterdoc": args.csv,
+            "masterdoc_version": cms.version[:12],
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "vector_backend": config.VECTOR_BACKEND,
+            "cascade": cms.cascade,
+            "prefilter": config.PREFILTER_ENABLED,
+            "seed": args.seed,
+            "per_cell": args.per_cell,
+            "repeat": args.repeat,
+            "corpus": describe(samples),
+            "elapsed_s": round(time.perf_counter() - started, 1),
+        },
+        "results": results,
+        "skipped": [{"component": c, "kind": k, "length": n, "reason": reason}
+                    for (c, k, n), reason in skipped.items()],
+    }
+    if comparison:
+        report["compare"] = {"baseline": args.compare, "ratios": comparison}
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    with out:
+        json.dump(report, out, indent=1)
+        out.write("\n")
+    # The human-readable table goes to stderr when the JSON is on stdout.
+    print_table(results, comparison, sys.stderr if args.out == "-" else sys.stdout)
+
+    if args.max_regression is not None:
+        worst = [c for c in comparison if c["p95_ratio"] and c["p95_ratio"] > args.max_regression]
+        if worst:
+            print(f"{len(worst)} cells regressed beyond {args.max_regression}x (p95)", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
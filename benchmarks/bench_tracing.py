@@ -0,0 +1,67 @@
+"""
+Benchmark: per-request analyze() latency with tracing off vs. on.
+
+Runs the same corpus under several tracing configurations, writing trace
+output to os.devnull so only the cost of producing it is measured.
+
+    python benchmarks/bench_tracing.py [--requests 2000]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from hybrid_moderation.core import ContentModerationSystem
+from hybrid_moderation.tracing import configure_tracing, shutdown_tracing
+
+TEXTS = [
+    "Had a great time at the park with my family today, the weather was lovely.",
+    "This street fight video is brutal, there was blood everywhere after the brawl.",
+    "Our health class covered consent and sex education, very informative lesson.",
+    "Check out this betting app, gamble your savings and win big on every bet!",
+    "lol",
+]
+
+CONFIGS = [
+    ("off (WARNING)", "WARNING", 1.0, True),
+    ("INFO, sampled 1%", "INFO", 0.01, True),
+    ("INFO, queue", "INFO", 1.0, True),
+    ("INFO, sync", "INFO", 1.0, False),
+    ("DEBUG, queue", "DEBUG", 1.0, True),
+    ("DEBUG, sync", "DEBUG", 1.0, False),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    cms = ContentModerationSystem()
+    cms.initialize()
+    devnull = open(os.devnull, "w")
+
+    print(f"{'tracing':<20} {'mean us':>9} {'p50 us':>9} {'p99 us':>9}")
+    for label, level, rate, use_queue in CONFIGS:
+        cms.tracer.sample_rate = configure_tracing(level, rate, use_queue, stream=devnull)
+        for text in TEXTS:
+            cms.analyze("warmup", text)
+        samples = []
+        for i in range(args.requests):
+            text = TEXTS[i % len(TEXTS)]
+            start = time.perf_counter_ns()
+            cms.analyze(f"c{i}", text)
+            samples.append((time.perf_counter_ns() - start) / 1000)
+        shutdown_tracing()
+        samples.sort()
+        print(f"{label:<20} {statistics.fmean(samples):9.1f} {samples[len(samples) // 2]:9.1f} "
+              f"{samples[int(len(samples) * 0.99)]:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
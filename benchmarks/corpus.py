@@ -0,0 +1,153 @@
+"""
+Synthetic moderation corpus built from the masterdoc keywords.
+
+Every text has a kind and a target length (characters):
+
+- clean: filler words that hit no keyword, exactly or by typo;
+- single_hit: clean filler with one keyword;
+- many_hits: roughly one keyword every 12 words, from several rows;
+- typos: like many_hits, with one edit per keyword (transposition,
+  deletion, insertion or doubled letter);
+- safe_context: single keyword hits with a safe-context term
+  (ContextValidator.SAFE_CONTEXT_KEYWORDS) a few words away.
+
+The same seed, masterdoc and arguments always give the same corpus.
+
+    python benchmarks/corpus.py [--lengths 20 200 2000 20000 50000] [--per-cell 5] [--out corpus.jsonl]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from typing import Dict, List, NamedTuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from hybrid_moderation.config import CSV_FILE_PATH
+from hybrid_moderation.context import ContextValidator
+from hybrid_moderation.index import KeywordIndex
+from hybrid_moderation.loader import CSVLoader
+
+KINDS = ("clean", "single_hit", "many_hits", "typos", "safe_context")
+LENGTHS = (20, 200, 2000, 20000, 50000)
+
+FILLER = (
+    "the a and of to in is it you that he was for on are with as his they be at one have this from "
+    "or had by hot word but what some we can out other were all there when up use your how said an "
+    "each she which do their time if will way about many then them write would like so these her long "
+    "make thing see him two has look more day could go come did number sound no most people my over "
+    "know water than call first who may down side been now find any new work part take get place made "
+    "live where after back little only round man year came show every good me give our under name very "
+    "through just form sentence great think say help low line differ turn cause much mean before move "
+    "right boy old too same tell does set three want air well also play small end put home read hand "
+    "tomorrow practice homework question everyone finished painting later dinner castle river fishing "
+    "online weekend holiday birthday morning evening teacher lunch sandwich football soccer basketball "
+    "library museum garden kitchen window yellow purple orange pencil notebook project picture camera "
+    "bicycle skateboard puppy kitten rabbit turtle cookie muffin pancake breakfast summer winter autumn "
+    "spring beach mountain forest island planet rocket science history geography music guitar piano "
+    "violin drawing crayon sticker puzzle board cards chess grandma grandpa cousin sister brother"
+).split()
+
+
+class Sample(NamedTuple):
+    id: str
+    kind: str
+    length: int  # target length; texts overshoot it by less than a word (or a safe-context group)
+    text: str
+
+
+def typo(word: str, rng: random.Random) -> str:
+    """One edit that usually stays within the fuzzy-match threshold for longer words."""
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    edit = rng.randrange(4)
+    if edit == 0:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    if edit == 1:
+        return word[:i] + word[i + 1:]
+    if edit == 2:
+        return word[:i] + rng.choice("aeiou") + word[i:]
+    return word[:i] + word[i] + word[i:]
+
+
+class CorpusGenerator:
+    def __init__(self, csv_path: str = CSV_FILE_PATH, seed: int = 0):
+        self.seed = seed
+        categories = CSVLoader(csv_path).load_data()
+        index = KeywordIndex(categories)
+        self.filler = [w for w in dict.fromkeys(FILLER) if not index.match(w)]
+        # Keywords grouped by row, so many_hits can mix several categories.
+        by_row: List[List[str]] = [[] for _ in categories]
+        for kid, postings in enumerate(index.postings):
+            for row, _, _ in postings:
+                by_row[row].append(index.keywords[kid])
+        self.rows = [sorted(set(keywords)) for keywords in by_row if keywords]
+        self.single_words = sorted({kw for keywords in self.rows for kw in keywords if " " not in kw and len(kw) >= 5})
+        self.safe_terms = sorted(ContextValidator.ALL_SAFE_TERMS)
+
+    def text(self, kind: str, length: int, rng: random.Random) -> str:
+        words: List[str] = []
+        size = 0
+        hits = 0
+        while size < length:
+            if kind != "clean" and self._hit_due(kind, len(words), hits):
+                keyword = self._keyword(kind, rng)
+                if kind == "safe_context":
+                    words += [keyword] + rng.sample(self.filler, 2) + [rng.choice(self.safe_terms)]
+                else:
+                    words.append(keyword)
+                hits += 1
+            else:
+                words.append(rng.choice(self.filler))
+            size += len(words[-1]) + 1
+        return " ".join(words)
+
+    @staticmethod
+    def _hit_due(kind: str, position: int, hits: int) -> bool:
+        if kind in ("single_hit", "safe_context"):
+            return hits == 0 and position == 1
+        # many_hits / typos: one keyword about every 12 words, starting early.
+        return position % 12 == 1
+
+    def _keyword(self, kind: str, rng: random.Random) -> str:
+        if kind == "typos":
+            return typo(rng.choice(self.single_words), rng)
+        return rng.choice(rng.choice(self.rows))
+
+    def generate(self, kinds=KINDS, lengths=LENGTHS, per_cell: int = 5) -> List[Sample]:
+        samples = []
+        for kind in kinds:
+            for length in lengths:
+                rng = random.Random(f"{self.seed}:{kind}:{length}")
+                for i in range(per_cell):
+                    samples.append(Sample(f"{kind}-{length}-{i}", kind, length, self.text(kind, length, rng)))
+        return samples
+
+
+def describe(samples: List[Sample]) -> Dict[str, int]:
+    return {"samples": len(samples), "characters": sum(len(s.text) for s in samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--csv", default=os.path.join(ROOT, CSV_FILE_PATH))
+    parser.add_argument("--kinds", nargs="+", default=list(KINDS), choices=KINDS)
+    parser.add_argument("--lengths", type=int, nargs="+", default=list(LENGTHS))
+    parser.add_argument("--per-cell", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="-", help="JSONL output path ('-' = stdout)")
+    args = parser.parse_args()
+
+    samples = CorpusGenerator(args.csv, args.seed).generate(args.kinds, args.lengths, args.per_cell)
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    with out:
+        for sample in samples:
+            out.write(json.dumps(sample._asdict()) + "\n")
+    print(json.dumps(describe(samples)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+Approximate nearest-neighbour search over labelled exemplar texts.
+
+IVFIndex is an inverted-file index in NumPy. Vectors are first mapped
+through a fixed random projection (EXEMPLAR_DIM dimensions, re-normalized),
+then partitioned by spherical k-means into `nlist` lists. A query scans only
+the `nprobe` lists whose centroids are closest, so the work per query grows
+with nprobe * N / nlist instead of N.
+
+The saved index is a directory of .npy files plus meta.json. Vectors are
+stored grouped by list and loaded with mmap_mode, so processes share them
+and only the probed lists are paged in. Vectors inserted after loading are
+kept in memory per list until the next save:
+
+    python -m hybrid_moderation.ann build exemplars.jsonl -o exemplars.ivf
+    python -m hybrid_moderation.ann add exemplars.ivf more.jsonl
+    python -m hybrid_moderation.ann info exemplars.ivf
+
+Input records are JSON lines with "text" and "category" fields. Exemplars
+are embedded without the masterdoc IDF (see HashedNgramEmbedder), so the
+index stays valid when the masterdoc changes.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import EXEMPLAR_DIM, EXEMPLAR_NPROBE
+from .embedding import HashedNgramEmbedder
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+_META_FILE = "meta.json"
+_ARRAYS = ("projection", "centroids", "offsets", "vectors", "ids", "label_ids")
+# Rows per similarity product when assigning vectors to lists.
+_ASSIGN_CHUNK = 8192
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    np.divide(x, norms, out=x, where=norms > 0)
+    return x
+
+
+class IVFIndex:
+    """
+    Inverted-file index with cosine similarity on unit vectors.
+
+    Vectors passed to train/add/search are in the input space (e.g. 4096-dim
+    embeddings) unless `projected=True`.
+    """
+
+    def __init__(self, input_dim: int, dim: int = EXEMPLAR_DIM, nprobe: int = EXEMPLAR_NPROBE,
+                 seed: int = 0, embedder_version: str = ""):
+        self.input_dim = input_dim
+        self.dim = min(dim, input_dim)
+        self.nprobe = nprobe
+        self.embedder_version = embedder_version
+        self.projection: Optional[np.ndarray] = None
+        if self.dim < input_dim:
+            rng = np.random.default_rng(seed)
+            self.projection = rng.standard_normal((input_dim, self.dim), dtype=np.float32)
+        self.centroids = np.zeros((0, self.dim), dtype=np.float32)
+        self.labels: List[str] = []
+        self._label_ids: Dict[str, int] = {}
+        # Saved (possibly memory-mapped) storage: list l holds rows offsets[l]:offsets[l + 1].
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.label_ids = np.zeros(0, dtype=np.int32)
+        # list -> [(vectors, ids, label ids)] inserted since the last save/load
+        self._pending: Dict[int, List[Tuple[np.ndarray, np.ndarray, np.ndarray]]] = {}
+        self._merged: Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.projection is not None:
+            vectors = vectors @ self.projection
+        return _normalize(np.array(vectors, dtype=np.float32))
+
+    def train(self, vectors: np.ndarray, nlist: int = 0, iterations: int = 10, sample: int = 256,
+              projected: bool = False, seed: int = 0):
+        """
+        Spherical k-means on up to `sample * nlist` of the vectors. nlist
+        defaults to sqrt(N), capped by the number of distinct training points.
+        """
+        x = vectors if projected else self.project(vectors)
+        rng = np.random.default_rng(seed)
+        nlist = max(1, min(nlist or int(np.sqrt(len(x))), len(x)))
+        if len(x) > sample * nlist:
+            x = x[rng.choice(len(x), sample * nlist, replace=False)]
+        centroids = x[rng.choice(len(x), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = self._assign(x, centroids)
+            order = np.argsort(assign, kind="stable")
+            counts = np.bincount(assign, minlength=nlist)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            filled = counts > 0
+            sums = np.add.reduceat(x[order], starts[filled], axis=0)
+            centroids[filled] = sums
+            # Re-seed empty lists with random training points.
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                centroids[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+            _normalize(centroids)
+        self.centroids = centroids
+        self.offsets = np.zeros(nlist + 1, dtype=np.int64)
+        self._pending, self._merged = {}, {}
+
+    @staticmethod
+    def _assign(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        return np.concatenate([np.argmax(x[i:i + _ASSIGN_CHUNK] @ centroids.T, axis=1)
+                               for i in range(0, len(x), _ASSIGN_CHUNK)] or [np.zeros(0, dtype=np.intp)])
+
+    def add(self, vectors: np.ndarray, categories: Sequence[str], projected: bool = False) -> np.ndarray:
+        """Inserts labelled vectors into their nearest lists. Returns their ids."""
+        if not self.nlist:
+            raise ValueError("IVFIndex must be trained before vectors are added")
+        x = vectors if projected else self.project(vectors)
+        label_ids = np.fromiter((self._label_id(c) for c in categories), dtype=np.int32, count=len(categories))
+        ids = np.arange(self.size, self.size + len(x), dtype=np.int64)
+        assign = self._assign(x, self.centroids)
+        order = np.argsort(assign, kind="stable")
+        lists, starts = np.unique(assign[order], return_index=True)
+        for lst, rows in zip(lists, np.split(order, starts[1:])):
+            self._pending.setdefault(int(lst), []).append((x[rows], ids[rows], label_ids[rows]))
+            self._merged.pop(int(lst), None)
+        self.size += len(x)
+        return ids
+
+    def _label_id(self, category: str) -> int:
+        label_id = self._label_ids.get(category)
+        if label_id is None:
+            label_id = self._label_ids[category] = len(self.labels)
+            self.labels.append(category)
+        return label_id
+
+    def _list(self, lst: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(vectors, ids, label ids) of one list, including inserted vectors."""
+        start, end = self.offsets[lst], self.offsets[lst + 1]
+        stored = self.vectors[start:end], self.ids[start:end], self.label_ids[start:end]
+        if lst not in self._pending:
+            return stored
+        merged = self._merged.get(lst)
+        if merged is None:
+            # Merge once per insert; later searches of this list reuse it.
+            merged = self._merged[lst] = tuple(np.concatenate(column)
+                                               for column in zip(stored, *self._pending[lst]))
+        return merged
+
+    def search(self, queries: np.ndarray, k: int = 1, nprobe: Optional[int] = None,
+               projected: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Top-k neighbours of each query, best first: (similarities, ids, label
+        ids), each (len(queries), k). Missing neighbours have id -1 and
+        similarity -inf.
+        """
+        q = queries if projected else self.project(queries)
+        n = len(q)
+        if not n or not self.nlist:
+            return (np.full((n, k), -np.inf, dtype=np.float32), np.full((n, k), -1, dtype=np.int64),
+                    np.full((n, k), -1, dtype=np.int32))
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        coarse = q @ self.centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe] if nprobe < self.nlist \
+            else np.broadcast_to(np.arange(self.nlist), (n, self.nlist))
+        if n == 1:
+            return self._search_one(q[0], k, probes[0])
+        # Top-k of every (query, probed list) pair go to their own k slots.
+        cand_sims = np.full((n, nprobe * k), -np.inf, dtype=np.float32)
+        cand_ids = np.full((n, nprobe * k), -1, dtype=np.int64)
+        cand_labels = np.full((n, nprobe * k), -1, dtype=np.int32)
+        # Visit each probed list once, with every query that probes it.
+        flat = probes.ravel()
+        order = np.argsort(flat, kind="stable")
+        query_of, slot_of = np.divmod(order, nprobe)
+        lists, starts = np.unique(flat[order], return_index=True)
+        bounds = np.append(starts, len(order))
+        for lst, start, end in zip(lists.tolist(), bounds[:-1].tolist(), bounds[1:].tolist()):
+            vectors, ids, label_ids = self._list(lst)
+            if not len(ids):
+                continue
+            qids = query_of[start:end, None]
+            sims = q[query_of[start:end]] @ vectors.T
+            top = min(k, len(ids))
+            cols = np.argpartition(-sims, top - 1, axis=1)[:, :top] if top < len(ids) \
+                else np.broadcast_to(np.arange(top), sims.shape)
+            slots = slot_of[start:end, None] * k + np.arange(top)
+            cand_sims[qids, slots] = np.take_along_axis(sims, cols, axis=1)
+            cand_ids[qids, slots] = ids[cols]
+            cand_labels[qids, slots] = label_ids[cols]
+
+        ranked = np.argsort(-cand_sims, axis=1, kind="stable")[:, :k]
+        return (np.take_along_axis(cand_sims, ranked, axis=1), np.take_along_axis(cand_ids, ranked, axis=1),
+                np.take_along_axis(cand_labels, ranked, axis=1))
+
+    def _search_one(self, query: np.ndarray, k: int, probes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Single-query path (the per-request case): one product per probed list, one selection."""
+        parts = [self._list(lst) for lst in probes.tolist()]
+        sims = np.concatenate([vectors @ query for vectors, _, _ in parts])
+        ids = np.concatenate([p[1] for p in parts])
+        label_ids = np.concatenate([p[2] for p in parts])
+        top = np.argpartition(-sims, k - 1)[:k] if k < len(sims) else np.arange(len(sims))
+        top = top[np.argsort(-sims[top], kind="stable")]
+        missing = k - len(top)
+        return (np.pad(sims[top], (0, missing), constant_values=-np.inf)[None],
+                np.pad(ids[top], (0, missing), constant_values=-1)[None],
+                np.pad(label_ids[top], (0, missing), constant_values=-1)[None])
+
+    def brute_force(self, queries: np.ndarray, k: int = 1, projected: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact top-k (similarities, ids) over every stored vector, for measuring recall."""
+        q = queries if projected else self.project(queries)
+        parts = [self._list(lst) for lst in range(self.nlist)]
+        vectors = np.concatenate([p[0] for p in parts])
+        ids = np.concatenate([p[1] for p in parts])
+        sims = q @ vectors.T
+        top = np.argsort(-sims, axis=1)[:, :k]
+        return np.take_along_axis(sims, top, axis=1), ids[top]
+
+    def save(self, path: str):
+        """Writes the index, merging inserted vectors into the list-grouped storage."""
+        vectors, ids, label_ids = [], [], []
+        offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        for lst in range(self.nlist):
+            part = self._list(lst)
+            vectors.append(part[0])
+            ids.append(part[1])
+            label_ids.append(part[2])
+            offsets[lst + 1] = offsets[lst] + len(part[1])
+        arrays = {
+            "projection": self.projection if self.projection is not None else np.zeros((0, 0), dtype=np.float32),
+            "centroids": self.centroids,
+            "offsets": offsets,
+            "vectors": np.concatenate(vectors) if vectors else np.zeros((0, self.dim), dtype=np.float32),
+            "ids": np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64),
+            "label_ids": np.concatenate(label_ids) if label_ids else np.zeros(0, dtype=np.int32),
+        }
+        meta = {
+            "format": FORMAT_VERSION,
+            "input_dim": self.input_dim,
+            "dim": self.dim,
+            "nprobe": self.nprobe,
+            "size": self.size,
+            "nlist": self.nlist,
+            "embedder": self.embedder_version,
+            "labels": self.labels,
+        }
+
+        # Write next to the target and swap directories, so readers never see a partial index.
+        tmp_path, old_path = f"{path}.tmp.{os.getpid()}", f"{path}.old.{os.getpid()}"
+        os.makedirs(tmp_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+        with open(os.path.join(tmp_path, _META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "IVFIndex":
+        with open(os.path.join(path, _META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported exemplar index format {meta.get('format')} in {path}")
+        index = cls(meta["input_dim"], meta["dim"], meta["nprobe"], embedder_version=meta["embedder"])
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+                  for name in _ARRAYS}
+        index.projection = np.asarray(arrays["projection"]) if arrays["projection"].size else None
+        index.centroids = np.asarray(arrays["centroids"])
+        index.offsets = np.array(arrays["offsets"])
+        # Plain ndarray views of the maps: slicing np.memmap objects is much slower.
+        index.vectors, index.ids, index.label_ids = (np.asarray(arrays[name]) for name in ("vectors", "ids", "label_ids"))
+        index.labels = list(meta["labels"])
+        index._label_ids = {label: i for i, label in enumerate(index.labels)}
+        index.size = meta["size"]
+        return index
+
+
+def read_exemplars(path: str, text_field: str = "text", category_field: str = "category") -> Tuple[List[str], List[str]]:
+    texts, categories = [], []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for number, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            text, category = record.get(text_field), record.get(category_field)
+            if not isinstance(text, str) or not text or not category:
+                raise ValueError(f"{path}:{number + 1}: missing '{text_field}' or '{category_field}'")
+            texts.append(text)
+            categories.append(str(category))
+    return texts, categories
+
+
+def embed_exemplars(index: IVFIndex, embedder: HashedNgramEmbedder, texts: Sequence[str],
+                    chunk: int = 4096) -> np.ndarray:
+    """Projected exemplar vectors, embedded chunk by chunk to bound memory."""
+    if not texts:
+        return np.zeros((0, index.dim), dtype=np.float32)
+    return np.concatenate([index.project(embedder.embed_batch(texts[i:i + chunk], use_idf=False))
+                           for i in range(0, len(texts), chunk)])
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m hybrid_moderation.ann",
+                                     description="Build, extend or inspect exemplar indexes.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="build an index from exemplar JSONL")
+    build_parser.add_argument("input")
+    build_parser.add_argument("-o", "--output", required=True)
+    build_parser.add_argument("--nlist", type=int, default=0, help="number of lists (default sqrt(N))")
+    build_parser.add_argument("--dim", type=int, default=EXEMPLAR_DIM)
+    build_parser.add_argument("--nprobe", type=int, default=EXEMPLAR_NPROBE)
+    add_parser = commands.add_parser("add", help="insert exemplar JSONL into an existing index")
+    add_parser.add_argument("index")
+    add_parser.add_argument("input")
+    info_parser = commands.add_parser("info", help="print an index's metadata")
+    info_parser.add_argument("index")
+    for sub in (build_parser, add_parser):
+        sub.add_argument("--text-field", default="text")
+        sub.add_argument("--category-field", default="category")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        with open(os.path.join(args.index, _META_FILE), encoding="utf-8") as f:
+            print(json.dumps(json.load(f), indent=2, ensure_ascii=False))
+        return
+
+    embedder = HashedNgramEmbedder()
+    texts, categories = read_exemplars(args.input, args.text_field, args.category_field)
+    if args.command == "build":
+        index = IVFIndex(embedder.dim, args.dim, args.nprobe, embedder_version=embedder.feature_version)
+        vectors = embed_exemplars(index, embedder, texts)
+        index.train(vectors, args.nlist, projected=True)
+        output = args.output
+    else:
+        index = IVFIndex.load(args.index, mmap=False)
+        if index.embedder_version != embedder.feature_version:
+            raise SystemExit(f"Index was built with {index.embedder_version}, not {embedder.feature_version}; rebuild it")
+        vectors = embed_exemplars(index, embedder, texts)
+        output = args.index
+    index.add(vectors, categories, projected=True)
+    index.save(output)
+    print(f"[HybridMod] {output}: {len(index)} exemplars in {index.nlist} lists, {len(index.labels)} categories",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
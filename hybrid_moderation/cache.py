@@ -0,0 +1,114 @@
+import dataclasses
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+def normalize_text(text: str) -> str:
+    """
+    Canonical form used for cache keys. Only applies transformations the
+    pipeline is already insensitive to (every stage lowercases, and leading or
+    trailing whitespace never holds a keyword or safe term).
+    """
+    return text.strip().lower()
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha256(normalize_text(text).encode("utf-8", "surrogatepass")).digest()
+
+
+def estimate_size(obj: Any, _depth: int = 0) -> int:
+    """Approximate deep size in bytes of strings, containers and dataclasses."""
+    size = sys.getsizeof(obj)
+    if _depth > 6:
+        return size
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        size += sum(estimate_size(getattr(obj, f.name), _depth + 1) for f in dataclasses.fields(obj))
+    elif isinstance(obj, dict):
+        size += sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _depth + 1) for item in obj)
+    return size
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with optional TTL and memory cap.
+
+    Entries are evicted least-recently-used first when either `max_entries`
+    or `max_bytes` (as measured by `size_fn`) is exceeded, and are treated as
+    missing once older than `ttl_seconds`.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: Optional[float] = None, max_bytes: Optional[int] = None,
+                 size_fn: Callable[[Any], int] = estimate_size):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+        # key -> (value, size, expires_at)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        size = self.size_fn(value) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, expires_at)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or (self.max_bytes and self._bytes > self.max_bytes)):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -31,5 +31,146 @@ SUBCATEGORY_CONFIDENCE_THRESHOLD = 0.9
 FINAL_SCORE_FLAG_THRESHOLD = 0.9
 FINAL_SCORE_REVIEW_THRESHOLD = 0.7
 
+# Semantic stage. 'embedding' scores texts against category vectors with the
+# local hashed n-gram embedder (see embedding.py); 'mock' uses the
+# keyword-triggered VectorSearchClient in vector_mock.py.
+VECTOR_BACKEND = "embedding"
+EMBEDDING_DIM = 4096
+EMBEDDING_CHAR_NGRAMS = (3, 4, 5)
+EMBEDDING_DTYPE = "float32"  # or "int8" (per-row quantized category vectors)
+EMBEDDING_BATCH_CHUNK = 256
+# Cosine similarity is mapped linearly from [FLOOR, CEIL] onto
+# [0, VECTOR_MAX_CONFIDENCE]. The cap keeps the vector stage alone below the
+# review threshold (VECTOR_WEIGHT * 0.98 < 0.7), as with the mock.
+EMBEDDING_SIMILARITY_FLOOR = 0.05
+EMBEDDING_SIMILARITY_CEIL = 0.25
+VECTOR_MAX_CONFIDENCE = 0.98
+# Feature cache (see feature_cache.py; MODERATION_FEATURE_CACHE overrides):
+# a SQLite file of the embedder's term frequencies per normalized text and
+# feature version, shared by worker processes and kept across deploys. ''
+# disables it. Shorter texts are hashed again rather than looked up.
+FEATURE_CACHE_PATH = ""
+FEATURE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+FEATURE_CACHE_MIN_CHARS = 256
+
+# Exemplar index (see ann.py): labelled example texts searched with an IVF
+# index. When a path is set (or MODERATION_EXEMPLAR_INDEX), the nearest
+# exemplar's similarity becomes embedding_similarity, and its category wins
+# from EXEMPLAR_MIN_SIMILARITY up.
+EXEMPLAR_INDEX_PATH = None
+EXEMPLAR_DIM = 256
+EXEMPLAR_NPROBE = 8
+EXEMPLAR_MIN_SIMILARITY = 0.6
+
+# Cascade mode (see ContentModerationSystem; MODERATION_CASCADE=1 enables it):
+# the keyword scan checks the highest-scoring rows first and stops once no
+# remaining row can win, and the vector stage is skipped when its result
+# cannot change the decision. The final decision (decision, action,
+# reasoning) and csv_analysis match the full pipeline; when the vector stage
+# is skipped, vector_analysis is empty (semantic_category None, confidence 0)
+# and weighted_score counts the CSV score only. Skipped stages are listed in
+# the result metadata (cascade.skipped_stages).
+CASCADE_ENABLED = False
+
+# Typo prefilter (see prefilter.py): a Bloom filter over the keywords'
+# deletion neighbourhoods rules out fuzzy matches per token before the
+# SequenceMatcher lookup. False positives only cost that lookup; tokens that
+# would need more than PREFILTER_MAX_DELETIONS deletions are always looked up.
+PREFILTER_ENABLED = True
+PREFILTER_FALSE_POSITIVE_RATE = 0.01
+PREFILTER_MAX_DELETIONS = 2
+
+# Long documents (see document.py): analyzed in overlapping windows of this
+# many characters. POST /analyze/document accepts up to DOCUMENT_MAX_BYTES.
+DOCUMENT_WINDOW_CHARS = 16384
+DOCUMENT_MAX_BYTES = 64 * 1024 * 1024
+
+# Incremental re-moderation (see incremental.py; MODERATION_CONTENT_STORE
+# overrides): per-content_id keyword and context state, so an edited text
+# only has its changed region re-scanned. '' disables it, 'memory' keeps the
+# states in an LRU, 'sqlite:<path>' in a database file shared by worker
+# processes that survives restarts. Texts shorter than
+# CONTENT_STORE_MIN_CHARS are always analyzed from scratch.
+CONTENT_STORE = ""
+CONTENT_STORE_MAX_ENTRIES = 10000
+CONTENT_STORE_MAX_BYTES = 256 * 1024 * 1024  # memory store only
+CONTENT_STORE_MIN_CHARS = 512
+
+# Batch API
+MAX_BATCH_SIZE = 10000
+
+# Result cache (see cache.py). Entries are keyed by normalized text hash,
+# age group and masterdoc content hash.
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_MAX_ENTRIES = 100000
+RESULT_CACHE_TTL_SECONDS = 3600
+RESULT_CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+# Tracing (see tracing.py). At WARNING the analyze hot path does no trace work.
+TRACE_LEVEL = "WARNING"
+TRACE_SAMPLE_RATE = 1.0
+TRACE_QUEUE_HANDLER = True
+TRACE_QUEUE_SIZE = 10000
+
+# Profiling (see profiling.py), off by default: PROFILE_SAMPLE_RATE of the
+# analyze calls run under cProfile and/or tracemalloc (PROFILE_MODE 'cpu',
+# 'memory' or 'both'); admins can also profile single /analyze requests with
+# the x-moderation-profile header. The last PROFILE_BUFFER_SIZE profiles are
+# kept for /admin/profile. Memory profiles record PROFILE_TRACEMALLOC_FRAMES
+# frames per allocation (tracing slows a call down about 5x per 2 frames) and
+# keep the PROFILE_TOP_ALLOCATIONS largest sites.
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_MODE = "cpu"
+PROFILE_BUFFER_SIZE = 64
+PROFILE_TRACEMALLOC_FRAMES = 8
+PROFILE_TOP_ALLOCATIONS = 100
+
+# Shadow evaluation (see shadow.py; MODERATION_SHADOW_MASTERDOC starts one
+# at startup): a candidate masterdoc decides SHADOW_SAMPLE_RATE of the
+# analyzed texts as well, off the request path, and decision flips are
+# counted per category and age group. Comparisons wait in a queue of
+# SHADOW_QUEUE_SIZE and are dropped when it is full. The last
+# SHADOW_RECENT_FLIPS flips are kept for the report. POST /admin/shadow only
+# loads candidates from SHADOW_CANDIDATE_DIR (MODERATION_SHADOW_DIR overrides;
+# None = the live masterdoc's directory).
+SHADOW_SAMPLE_RATE = 1.0
+SHADOW_QUEUE_SIZE = 1000
+SHADOW_RECENT_FLIPS = 100
+SHADOW_CANDIDATE_DIR = None
+
+# Serving (see serving.py): 'thread' runs analysis on a thread pool in the
+# API process, 'process' on a pool of worker processes. 0 workers = CPU count.
+SERVING_MODE = "thread"
+SERVING_WORKERS = 0
+SERVING_MAX_PENDING = 256
+SERVING_TIMEOUT_SECONDS = 5.0
+SERVING_BATCH_TIMEOUT_SECONDS = 120.0
+
+# Micro-batching (see MicroBatcher in serving.py; MODERATION_MICROBATCH=1
+# enables it): concurrent /analyze requests are gathered for up to
+# MICROBATCH_MAX_WAIT_SECONDS, or until MICROBATCH_MAX_SIZE are waiting, and
+# analyzed together as one batch. The result cache and the content store
+# apply per request as without batching.
+MICROBATCH_ENABLED = False
+MICROBATCH_MAX_SIZE = 32
+MICROBATCH_MAX_WAIT_SECONDS = 0.002
+
+# Masterdoc hot reload (see reload.py): poll the masterdoc file every N
+# seconds and reload it when it changes. 0 disables the watcher; reloads are
+# then only triggered through POST /admin/reload.
+RELOAD_WATCH_INTERVAL_SECONDS = 0.0
+
+# Preforking server (see prefork.py): the master loads the masterdoc once and
+# forks PREFORK_WORKERS uvicorn workers (0 = CPU count). A worker that misses
+# heartbeats for PREFORK_HEARTBEAT_TIMEOUT_SECONDS, or is not serving within
+# PREFORK_STARTUP_TIMEOUT_SECONDS, is killed and replaced; a retiring worker
+# gets PREFORK_GRACEFUL_TIMEOUT_SECONDS to finish its requests.
+PREFORK_WORKERS = 0
+PREFORK_HEARTBEAT_INTERVAL_SECONDS = 1.0
+PREFORK_HEARTBEAT_TIMEOUT_SECONDS = 30.0
+PREFORK_STARTUP_TIMEOUT_SECONDS = 60.0
+PREFORK_GRACEFUL_TIMEOUT_SECONDS = 30.0
+PREFORK_RESPAWN_DELAY_SECONDS = 1.0
+
 # File Paths
 CSV_FILE_PATH = "Models_Masterdoc_Test.csv"
@@ -1,5 +1,9 @@
 import re
-from typing import List
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+_WORD_RE = re.compile(r'\w+')
+_LAST_WORD_RE = re.compile(r'\w+\Z')
 
 class ContextValidator:
     """
@@ -33,72 +37,46 @@ class ContextValidator:
         term for category in SAFE_CONTEXT_KEYWORDS.values() for term in category
     )
 
+    # Safe terms keyed by their first token; multi-word terms ("health class")
+    # are matched as consecutive tokens.
+    SAFE_TERM_TOKENS: Dict[str, List[Tuple[str, ...]]] = {}
+    for _term in ALL_SAFE_TERMS:
+        _tokens = tuple(_WORD_RE.findall(_term))
+        SAFE_TERM_TOKENS.setdefault(_tokens[0], []).append(_tokens[1:])
+    del _term, _tokens
+    # Single-word terms, which a word cut by the context window's edge can match.
+    SAFE_WORDS = frozenset(term for term in ALL_SAFE_TERMS if _WORD_RE.fullmatch(term))
+    LONGEST_SAFE_WORD = max(len(term) for term in SAFE_WORDS)
+
     def __init__(self, context_window: int = 150):
         self.context_window = context_window
 
+    def scan(self, text: str) -> 'ContextScan':
+        """Tokenizes the text once and returns a per-request context engine."""
+        return ContextScan(self, text)
+
+    def safe_term_spans(self, text: str, start: int = 0, end: Optional[int] = None) -> List[Tuple[int, int]]:
+        """
+        Sorted character spans of the safe terms in the lowercased `text`,
+        tokenized as if it ended at `end` and started at `start` (so both
+        should fall between tokens).
+        """
+        tokens = [(m.group(), m.start(), m.end())
+                  for m in _WORD_RE.finditer(text, start, len(text) if end is None else end)]
+        spans = []
+        for i, (token, token_start, token_end) in enumerate(tokens):
+            for rest in self.SAFE_TERM_TOKENS.get(token, ()):
+                following = tokens[i + 1:i + 1 + len(rest)]
+                if tuple(t for t, _, _ in following) == rest:
+                    spans.append((token_start, following[-1][2] if rest else token_end))
+        spans.sort()
+        return spans
+
     def is_safe_context(self, text: str, keyword: str) -> bool:
         """
         Checks if the keyword appears in a safe context within the text.
         """
-        if not text or not keyword:
-            return False
-
-        # Find all occurrences of the keyword
-        # Note: This simple regex match might mismatch if fuzzy matching was used originally,
-        # but for context validation we need to find the anchors.
-        
-        # Escape keyword for regex
-        escaped_kw = re.escape(keyword)
-        # Match whole word to avoid identifying 'class' inside 'classification' if that's not desired,
-        # but keywords often need flexibility. Let's use boundary if possible.
-        pattern = re.compile(rf'{escaped_kw}', re.IGNORECASE)
-        
-        matches = list(pattern.finditer(text))
-        
-        if not matches:
-            # Keyword not found exactly (maybe fuzzy matched). 
-            # Fallback: Check if the WHOLE text is overwhelmingly safe?
-            # For now, just return False (not safe override).
-            return False
-
-        # Check ANY occurrence for safe context. 
-        # Strategy: If ANY occurrence is unsafe, does it poison the whole? 
-        # Or if ANY occurrence is safe, is it safe?
-        # Usually moderation is "Any Unsafe = Flag". 
-        # But here we want to see if the usage is educational.
-        # If the text is "Sex education is good but look at this porn", it's UNSAFE.
-        # If the text is "Sex education is important", it's SAFE.
-        
-        # We need to ensure ALL occurrences are in safe context, or that the unsafe usage is absent.
-        # Let's count "Safe Contexts" vs "Matches".
-        
-        safe_count = 0
-        total_matches = len(matches)
-
-        for match in matches:
-            start_idx = max(0, match.start() - self.context_window)
-            end_idx = min(len(text), match.end() + self.context_window)
-            
-            context_snippet = text[start_idx:end_idx].lower()
-            
-            # Check for safe keywords in this snippet
-            if self._contains_safe_terms(context_snippet):
-                safe_count += 1
-        
-        # If all matches are in safe context, or we have a high ratio?
-        # Let's say if > 50% are safe, or if it's short text and it's safe.
-        # User said "if the context justifies... take it".
-        
-        if total_matches > 0 and safe_count == total_matches:
-            return True
-            
-        return False
-
-    def _contains_safe_terms(self, snippet: str) -> bool:
-        tokens = set(re.findall(r'\w+', snippet))
-        # Check intersection
-        common = tokens.intersection(self.ALL_SAFE_TERMS)
-        return len(common) > 0
+        return self.scan(text).is_safe(keyword)
 
     def get_context_snippet(self, text: str, keyword: str) -> str:
         escaped_kw = re.escape(keyword)
@@ -108,3 +86,114 @@ class ContextValidator:
              end_idx = min(len(text), match.end() + 50)
              return text[start_idx:end_idx].replace('\n', ' ')
         return ""
+
+
+class ContextScan:
+    """
+    Safe-context lookups for one text.
+
+    The text is lowercased and tokenized once; every occurrence of a safe term
+    (single- or multi-word) is recorded as a character span. A keyword is in a
+    safe context when every occurrence of it has a complete safe-term span
+    inside its `context_window` on either side, or a word cut by the window's
+    edge is a safe term as cut (e.g. "healthy" cut to "health"), as when the
+    cut window was tokenized on its own. Results are memoized per keyword, so
+    repeated checks across categories cost a dict lookup.
+    """
+
+    def __init__(self, validator: ContextValidator, text: str, spans: Optional[List[Tuple[int, int]]] = None):
+        self.context_window = validator.context_window
+        self.safe_words = validator.SAFE_WORDS
+        self.longest_safe_word = validator.LONGEST_SAFE_WORD
+        self.text = text.lower() if text else ""
+        self._cache: Dict[str, bool] = {}
+
+        # Precomputed spans (see incremental.py) must be safe_term_spans(self.text).
+        if spans is None:
+            spans = validator.safe_term_spans(self.text)
+        self.spans = spans
+
+        # Safe-term starts, and the smallest end among spans from index i onwards.
+        self._starts = [start for start, _ in spans]
+        self._min_end_from = [end for _, end in spans]
+        for i in range(len(spans) - 2, -1, -1):
+            if self._min_end_from[i + 1] < self._min_end_from[i]:
+                self._min_end_from[i] = self._min_end_from[i + 1]
+
+    def is_safe(self, keyword: str) -> bool:
+        if not keyword:
+            return False
+        keyword = keyword.lower()
+        safe = self._cache.get(keyword)
+        if safe is None:
+            safe = self._all_occurrences_safe(keyword)
+            self._cache[keyword] = safe
+        return safe
+
+    def _all_occurrences_safe(self, keyword: str) -> bool:
+        found, safe, _ = self.occurrences_safe(keyword)
+        return found and safe
+
+    def occurrences_safe(self, keyword: str, start: int = 0, end: Optional[int] = None) -> Tuple[bool, bool, int]:
+        """
+        For the (non-overlapping, left to right) occurrences of the lowercased
+        `keyword` that start in [start, end): (any found, all safe, where the
+        scan would continue). Lets a long text be checked window by window,
+        see document.py.
+        """
+        text, window = self.text, self.context_window
+        if end is None:
+            end = len(text)
+        found = False
+        pos = text.find(keyword, start)
+        while pos != -1 and pos < end:
+            found = True
+            kw_end = pos + len(keyword)
+            if not self._has_safe_term(max(0, pos - window), min(len(text), kw_end + window)):
+                return True, False, kw_end
+            pos = text.find(keyword, kw_end)
+        if pos == -1:
+            # The next occurrence, if any, runs past the end of this text.
+            pos = max(end, len(text) - len(keyword) + 1)
+        return found, True, pos
+
+    def positions_safe(self, keyword: str, positions: Sequence[int]) -> bool:
+        """
+        _all_occurrences_safe(keyword) given the ascending start positions of
+        every (possibly overlapping) occurrence of the lowercased keyword, so
+        the text is not searched again.
+        """
+        window, length = self.context_window, len(keyword)
+        next_start = 0
+        found = False
+        for pos in positions:
+            if pos < next_start:
+                continue  # overlaps the occurrence before, which find() would have skipped
+            found = True
+            kw_end = pos + length
+            if not self._has_safe_term(max(0, pos - window), min(len(self.text), kw_end + window)):
+                return False
+            next_start = kw_end
+        return found
+
+    def _has_safe_term(self, start: int, end: int) -> bool:
+        i = bisect_left(self._starts, start)
+        if i < len(self._starts) and self._min_end_from[i] <= end:
+            return True
+        return self._cut_word_is_safe(start, end)
+
+    def _cut_word_is_safe(self, start: int, end: int) -> bool:
+        """Whether the part inside [start, end) of a word crossing either edge is a safe word."""
+        text = self.text
+        if start >= end:
+            return False
+        if start > 0 and _WORD_RE.match(text, start - 1, start + 1) and _WORD_RE.match(text, start, start + 1):
+            if _WORD_RE.match(text, start, end).group() in self.safe_words:
+                return True
+        if end < len(text) and _WORD_RE.match(text, end - 1, end) and _WORD_RE.match(text, end, end + 1):
+            low = max(start, end - self.longest_safe_word)
+            cut = _LAST_WORD_RE.search(text, low, end)
+            if cut.start() == low and low > start and _WORD_RE.match(text, low - 1, low):
+                return False  # the cut word is longer than any safe word
+            return cut.group() in self.safe_words
+        return False
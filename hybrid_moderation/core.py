@@ -1,71 +1,623 @@
 
+import os
+import threading
 import time
 import datetime
-import sys
-from typing import List, Optional
-from .loader import CSVLoader
-from .models import ModerationResult, CSVAnalysisResult, VectorAnalysisResult, FinalDecision
+from dataclasses import replace
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Union
+from .snapshot import SnapshotLoader, open_loader, source_version
+from .models import ModerationResult, CSVAnalysisResult, VectorAnalysisResult, FinalDecision, ModerationCategory
 from .vector_mock import VectorSearchClient
+from .embedding import EmbeddingSearchClient
+from .feature_cache import FeatureCache
 from .matcher import KeywordMatcher
+from .index import KeywordIndex
 from .context import ContextValidator
+from .document import DocumentSession
+from .incremental import create_content_store
+from .tracing import NULL_TRACE, Trace, Tracer
+from .profiling import PROFILE_MODES, Profiler
+from .shadow import ShadowEvaluator, TextWork
+from .metrics import CACHE_LOOKUPS, DECISIONS, MASTERDOC_RELOADS, MATCHED_CATEGORIES, STAGE_SECONDS
+from .cache import LRUCache, estimate_size, text_key
 from .config import (
-    CSV_FILE_PATH, CSV_WEIGHT, VECTOR_WEIGHT,
-    PRIMARY_CATEGORY_CONFIDENCE_THRESHOLD
+    CSV_FILE_PATH, CSV_WEIGHT, VECTOR_WEIGHT, VECTOR_MAX_CONFIDENCE,
+    PRIMARY_CATEGORY_CONFIDENCE_THRESHOLD, FINAL_SCORE_FLAG_THRESHOLD, FINAL_SCORE_REVIEW_THRESHOLD,
+    CASCADE_ENABLED, CONTENT_STORE, CONTENT_STORE_MIN_CHARS,
+    RESULT_CACHE_ENABLED, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_BYTES,
+    VECTOR_BACKEND, EXEMPLAR_INDEX_PATH, FEATURE_CACHE_PATH, PROFILE_MODE, PROFILE_SAMPLE_RATE, SHADOW_SAMPLE_RATE
 )
 
+class ModelState(NamedTuple):
+    """
+    Everything analysis reads from the masterdoc. reload() builds a new state
+    and swaps this one reference, so a request that started on the old state
+    finishes on it.
+    """
+    version: str  # masterdoc content hash
+    categories: List[ModerationCategory]
+    category_names: List[str]
+    keyword_index: Optional[KeywordIndex]
+    vector_client: object  # EmbeddingSearchClient or VectorSearchClient
+
+
+class TextAnalysis(NamedTuple):
+    """Age-independent part of an analysis, shared by every age group."""
+    csv_result: CSVAnalysisResult  # without age_restriction
+    category: Optional[ModerationCategory]
+    vector_result: Optional[VectorAnalysisResult]  # None if the cascade skipped it so far
+    rows_skipped: int = 0  # matched rows the cascade did not need to check
+
+
+# An age-rule Block only overrides the score above this keyword confidence.
+AGE_BLOCK_MIN_CONFIDENCE = 0.4
+
+
 class ContentModerationSystem:
-    def __init__(self, csv_path: str = CSV_FILE_PATH):
-        self.loader = CSVLoader(csv_path)
+    def __init__(self, csv_path: str = CSV_FILE_PATH, enable_cache: bool = RESULT_CACHE_ENABLED,
+                 cascade: Optional[bool] = None):
+        # csv_path may also point at a compiled snapshot (see snapshot.py)
+        self.loader = open_loader(csv_path)
+        if cascade is None:
+            cascade = os.environ.get("MODERATION_CASCADE", "1" if CASCADE_ENABLED else "0") == "1"
+        self.cascade = cascade
         self.matcher = KeywordMatcher()
-        self.vector_client = VectorSearchClient()
+        if VECTOR_BACKEND == "embedding":
+            vector_client = EmbeddingSearchClient(
+                exemplar_path=os.environ.get("MODERATION_EXEMPLAR_INDEX", EXEMPLAR_INDEX_PATH))
+            feature_cache_path = os.environ.get("MODERATION_FEATURE_CACHE", FEATURE_CACHE_PATH)
+            if feature_cache_path:
+                vector_client.feature_cache = FeatureCache(feature_cache_path)
+        else:
+            vector_client = VectorSearchClient()
+        self.state = ModelState("", [], [], None, vector_client)
+        self._reload_lock = threading.Lock()
         self.context_validator = ContextValidator()
-        self.categories = []
+        self.tracer = Tracer()
+        # Sampled cProfile/tracemalloc capture (see profiling.py), off by default
+        self.profiler = Profiler(mode=os.environ.get("MODERATION_PROFILE_MODE", PROFILE_MODE))
+        self.configure_profiling(float(os.environ.get("MODERATION_PROFILE_SAMPLE_RATE", PROFILE_SAMPLE_RATE)))
+        self.result_cache = None
+        self.analysis_cache = None
+        if enable_cache:
+            self.result_cache = LRUCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_BYTES)
+            # The matched category row is shared with self.categories, so it is not counted.
+            self.analysis_cache = LRUCache(
+                RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_BYTES,
+                size_fn=lambda a: estimate_size(a.csv_result) + estimate_size(a.vector_result))
+        # Per-content_id state for incremental re-moderation (see incremental.py)
+        self.content_store = create_content_store(os.environ.get("MODERATION_CONTENT_STORE", CONTENT_STORE))
+        # Candidate masterdoc evaluated next to this one (see shadow.py)
+        self.shadow: Optional[ShadowEvaluator] = None
+
+    @property
+    def categories(self) -> List[ModerationCategory]:
+        return self.state.categories
+
+    @property
+    def keyword_index(self) -> Optional[KeywordIndex]:
+        return self.state.keyword_index
+
+    @property
+    def vector_client(self):
+        return self.state.vector_client
+
+    @property
+    def version(self) -> str:
+        return self.state.version
 
     def initialize(self):
         """Loads data and prepares the system."""
-        self.categories = self.loader.load_data()
+        self.reload(force=True)
+        # MODERATION_SHADOW_MASTERDOC: a candidate masterdoc to shadow from the start
+        shadow_path = os.environ.get("MODERATION_SHADOW_MASTERDOC")
+        if shadow_path:
+            self.start_shadow(shadow_path)
+
+    def reload(self, force: bool = False) -> dict:
+        """
+        Re-reads the masterdoc and, if its content changed (or `force`),
+        builds new categories and indexes in the calling thread and swaps them
+        in. Index structures whose inputs did not change are reused, see
+        KeywordIndex and EmbeddingSearchClient.build. On error the current
+        state keeps serving. Returns a summary of what was done.
+        """
+        with self._reload_lock:
+            start = time.perf_counter()
+            previous = self.state
+            try:
+                if not force and source_version(self.loader.file_path) == previous.version:
+                    MASTERDOC_RELOADS.inc("unchanged")
+                    return {"reloaded": False, "version": previous.version[:12]}
+                # The first load uses the loader opened by __init__.
+                loader = self.loader if previous.keyword_index is None else open_loader(self.loader.file_path)
+                state = self._build_state(loader, previous)
+            except Exception:
+                MASTERDOC_RELOADS.inc("failed")
+                raise
+            self.loader = loader
+            self.state = state
+            categories = state.categories
+            if loader.content_hash != previous.version:
+                # Cached results were computed against another masterdoc.
+                for cache in (self.result_cache, self.analysis_cache):
+                    if cache is not None:
+                        cache.clear()
+            MASTERDOC_RELOADS.inc("reloaded")
+
+            summary = {
+                "reloaded": True,
+                "version": loader.content_hash[:12],
+                "previous_version": previous.version[:12],
+                "rows": len(categories),
+                # Rows that differ from the previous row at the same position.
+                "changed_rows": sum(1 for row, cat in enumerate(categories)
+                                    if row >= len(previous.categories) or previous.categories[row] != cat),
+                "reload_ms": round((time.perf_counter() - start) * 1000, 1),
+            }
+            return summary
+
+    def _build_state(self, loader, previous: ModelState, reuse: bool = True) -> ModelState:
+        """
+        Loads `loader`'s masterdoc into a new state, reusing (unless `reuse`
+        is False) what did not change of `previous`'s keyword index.
+        """
+        categories = loader.load_data()
+        prebuilt = loader.prebuilt if isinstance(loader, SnapshotLoader) else None
+        keyword_index = KeywordIndex(categories, self.matcher, prebuilt,
+                                     previous=previous.keyword_index if reuse else None)
+        # A rebuilt client must not disturb requests still using the current one.
+        vector_client = previous.vector_client.clone() if previous.keyword_index is not None \
+            else previous.vector_client
+        vector_client.build(categories)
+        return ModelState(loader.content_hash, categories, [c.category for c in categories],
+                          keyword_index, vector_client)
+
+    def start_shadow(self, candidate_path: str, sample_rate: Optional[float] = None,
+                     background: bool = True) -> dict:
+        """
+        Starts deciding analyzed texts with a candidate masterdoc as well and
+        counting the decisions that flip (see shadow.py), in place of any
+        shadow already running. Returns the new shadow's report.
+        """
+        shadow = ShadowEvaluator(self, candidate_path, SHADOW_SAMPLE_RATE if sample_rate is None else sample_rate,
+                                 background=background)
+        previous, self.shadow = self.shadow, shadow
+        if previous is not None:
+            previous.stop()
+        return shadow.report()
+
+    def stop_shadow(self) -> Optional[dict]:
+        """Stops the shadow evaluation, if any, and returns its final report."""
+        shadow, self.shadow = self.shadow, None
+        if shadow is None:
+            return None
+        shadow.stop()
+        return shadow.report()
+
+    def configure_profiling(self, sample_rate: Optional[float] = None, mode: Optional[str] = None):
+        """
+        Profiles sample_rate of the analyze and analyze_batch calls in `mode`
+        (see profiling.py). At rate 0 the sampling wrappers are removed, so
+        the calls run without any profiling code.
+        """
+        if mode is not None:
+            if mode not in PROFILE_MODES:
+                raise ValueError(f"Unknown profile mode: {mode!r}")
+            self.profiler.mode = mode
+        if sample_rate is not None:
+            self.profiler.sample_rate = sample_rate
+        for name in ("analyze", "analyze_batch"):
+            if self.profiler.sample_rate > 0:
+                setattr(self, name, self.profiler.sampled(getattr(type(self), name).__get__(self)))
+            else:
+                self.__dict__.pop(name, None)
+
+    def analyze_profiled(self, content_id: str, text: str, age_group: str = '13-16',
+                         mode: str = PROFILE_MODE) -> ModerationResult:
+        """analyze() under the profiler whatever its sample rate; the result's metadata has the profile_id."""
+        return self.profiler.profile(mode, type(self).analyze, self, content_id, text, age_group)
 
     def analyze(self, content_id: str, text: str, age_group: str = '13-16') -> ModerationResult:
-        print(f"\n[HybridMod] 🚀 Starting analysis for Content ID: {content_id} | Age Group: {age_group}", file=sys.stderr)
+        trace = self.tracer.start(content_id)
         start_time = time.time()
-        
+        start_ns = time.perf_counter_ns()
+        # Read once: a concurrent reload() does not affect this request.
+        state = self.state
+        shadow = self.shadow
+        # Masterdoc-independent work the shadow's candidate can reuse
+        work = TextWork(text) if shadow is not None and shadow.sampled() else None
+
+        key = analysis = None
+        if self.result_cache is not None:
+            key = text_key(text)
+            cached = self.result_cache.get((state.version, key, age_group))
+            if cached is not None:
+                CACHE_LOOKUPS.inc("result", "hit")
+                result = self._from_cache(cached, content_id, start_time)
+                STAGE_SECONDS.observe(time.perf_counter_ns() - start_ns, "total")
+                if work is not None:
+                    shadow.submit(state, work, age_group, result)
+                return result
+            CACHE_LOOKUPS.inc("result", "miss")
+            analysis = self.analysis_cache.get((state.version, key))
+            CACHE_LOOKUPS.inc("analysis", "miss" if analysis is None else "hit")
+
+        cache_status = "miss"
+        if analysis is None:
+            analysis = self._analyze_text(state, text, age_group, trace, content_id, work)
+            if key is not None:
+                self.analysis_cache.put((state.version, key), analysis)
+        else:
+            cache_status = "analysis_hit"
+            if analysis.vector_result is None and self._vector_skip(analysis, age_group) is None:
+                # Cached by a request whose age group did not need the vector stage.
+                analysis = analysis._replace(vector_result=self._vector_stage(state, text, trace, work))
+                if key is not None:
+                    self.analysis_cache.put((state.version, key), analysis)
+
+        best_csv_result = self._with_age_restriction(analysis.csv_result, analysis.category, age_group)
+        result = self._decide(state, content_id, best_csv_result, analysis.vector_result or VectorAnalysisResult(),
+                              age_group, start_time, trace)
+        if self.cascade:
+            result.metadata["cascade"] = self._cascade_metadata(analysis, age_group)
+        if key is not None:
+            result.metadata["cache"] = cache_status
+            self.result_cache.put((state.version, key, age_group), result)
+        STAGE_SECONDS.observe(time.perf_counter_ns() - start_ns, "total")
+        if work is not None:
+            shadow.submit(state, work, age_group, result)
+        return result
+
+    def analyze_batch(self, items: List[Tuple[str, str, str]]) -> List[ModerationResult]:
+        """
+        Analyzes a batch of (content_id, text, age_group) items and returns the
+        results in input order.
+
+        Identical texts are analyzed once: the keyword, context and vector
+        stages only depend on the text, so just the age rule is applied per
+        item. Token -> fuzzy-hit lookups are shared across the whole batch.
+        In cascade mode only the texts that need it go through the vector stage.
+        """
+        start_time = time.time()
+        state = self.state
+        shadow = self.shadow
+        unique_texts = list(dict.fromkeys(text for _, text, _ in items))
+        works = {text: TextWork(text) for text in unique_texts} if shadow is not None else {}
+
+        by_text = {}
+        if self.analysis_cache is not None:
+            for text in unique_texts:
+                analysis = self.analysis_cache.get((state.version, text_key(text)))
+                CACHE_LOOKUPS.inc("analysis", "miss" if analysis is None else "hit")
+                if analysis is not None:
+                    by_text[text] = analysis
+        pending = [text for text in unique_texts if text not in by_text]
+
+        fuzzy_cache = {}
+        for text in pending:
+            csv_result, category, rows_skipped = self._keyword_stage(state, text, fuzzy_cache, work=works.get(text))
+            by_text[text] = TextAnalysis(csv_result, category, None, rows_skipped)
+        needs_vector = list(dict.fromkeys(
+            text for _, text, age_group in items
+            if by_text[text].vector_result is None and self._vector_skip(by_text[text], age_group) is None))
+        if needs_vector:
+            vector_start = time.perf_counter_ns()
+            vector_results = state.vector_client.semantic_analyze_batch(needs_vector, state.category_names)
+            STAGE_SECONDS.observe(time.perf_counter_ns() - vector_start, "vector_batch")
+            for text, vector_result in zip(needs_vector, vector_results):
+                by_text[text] = by_text[text]._replace(vector_result=vector_result)
+        if self.analysis_cache is not None:
+            for text in dict.fromkeys(pending + needs_vector):
+                self.analysis_cache.put((state.version, text_key(text)), by_text[text])
+
+        results = []
+        for content_id, text, age_group in items:
+            analysis = by_text[text]
+            csv_result = self._with_age_restriction(analysis.csv_result, analysis.category, age_group)
+            result = self._decide(state, content_id, csv_result, analysis.vector_result or VectorAnalysisResult(),
+                                  age_group, start_time)
+            if self.cascade:
+                result.metadata["cascade"] = self._cascade_metadata(analysis, age_group)
+            results.append(result)
+
+        elapsed_ms = int((time.time() - start_time) * 1000)
+        for result in results:
+            result.metadata["processing_time_ms"] = elapsed_ms
+            result.metadata["batch_size"] = len(items)
+        if shadow is not None:
+            for (_, text, age_group), result in zip(items, results):
+                if shadow.sampled():
+                    shadow.submit(state, works[text], age_group, result)
+        trace = self.tracer.start(items[0][0] if items else "")
+        if trace:
+            trace.info("batch.complete", items=len(items), unique_texts=len(unique_texts),
+                       analyzed=len(pending), elapsed_ms=elapsed_ms)
+        return results
+
+    def analyze_requests(self, items: List[Tuple[str, str, str]]) -> List[ModerationResult]:
+        """
+        analyze() for each of several concurrent requests (see MicroBatcher):
+        result cache hits are served from it, texts for the incremental
+        content store go through analyze(), and the rest share one
+        analyze_batch() whose results are cached like analyze()'s.
+        """
+        start_time = time.time()
+        state = self.state
+        shadow = self.shadow
+        results: List[Optional[ModerationResult]] = [None] * len(items)
+        batched = []
+        for i, (content_id, text, age_group) in enumerate(items):
+            if self.content_store is not None and len(text) >= CONTENT_STORE_MIN_CHARS:
+                results[i] = self.analyze(content_id, text, age_group)
+                continue
+            if self.result_cache is not None:
+                cached = self.result_cache.get((state.version, text_key(text), age_group))
+                CACHE_LOOKUPS.inc("result", "miss" if cached is None else "hit")
+                if cached is not None:
+                    results[i] = self._from_cache(cached, content_id, start_time)
+                    if shadow is not None and shadow.sampled():
+                        shadow.submit(state, TextWork(text), age_group, results[i])
+                    continue
+            batched.append(i)
+        if batched:
+            batch_results = self.analyze_batch([items[i] for i in batched])
+            # Not cached if a reload may have given the batch another state.
+            cache = self.result_cache if self.state is state else None
+            for i, result in zip(batched, batch_results):
+                results[i] = result
+                if cache is not None:
+                    _, text, age_group = items[i]
+                    cache.put((state.version, text_key(text), age_group), result)
+        return results
+
+    def document_session(self, content_id: str, age_group: str = '13-16', stop_on_block: bool = False) -> DocumentSession:
+        """Starts a long-document analysis that is fed in chunks, see document.py."""
+        return DocumentSession(self, content_id, age_group, stop_on_block)
+
+    def analyze_document(self, content_id: str, chunks: Union[str, Iterable[str]], age_group: str = '13-16',
+                         stop_on_block: bool = False) -> ModerationResult:
+        """
+        Analyzes a long text, or an iterable of its chunks, in overlapping
+        windows; the CSV analysis equals analyze()'s. With `stop_on_block`
+        (a policy override, see document.py) the rest is skipped once the
+        text read so far gives an age-rule Block, and the document is
+        blocked even where analyze() on the whole text would not block it.
+        """
+        session = self.document_session(content_id, age_group, stop_on_block)
+        for chunk in [chunks] if isinstance(chunks, str) else chunks:
+            session.feed(chunk)
+            if session.stopped:
+                break
+        return session.finish()
+
+    def cache_stats(self) -> dict:
+        if self.result_cache is None:
+            stats = {"enabled": False}
+        else:
+            stats = {
+                "enabled": True,
+                "version": self.version,
+                "result": self.result_cache.stats(),
+                "analysis": self.analysis_cache.stats(),
+            }
+        if self.content_store is not None:
+            stats["content_store"] = self.content_store.stats()
+        feature_cache = getattr(self.vector_client, "feature_cache", None)
+        if feature_cache is not None:
+            stats["features"] = feature_cache.stats()
+        return stats
+
+    def before_fork(self):
+        """
+        Closes the content store's and feature cache's database connections,
+        which a forked process must not inherit; see prefork.py. after_fork
+        reopens them in each child.
+        """
+        feature_cache = getattr(self.vector_client, "feature_cache", None)
+        for storage in (self.content_store, feature_cache):
+            if storage is not None:
+                storage.close()
+
+    def after_fork(self):
+        feature_cache = getattr(self.vector_client, "feature_cache", None)
+        for storage in (self.content_store, feature_cache):
+            if storage is not None:
+                storage.reopen()
+
+    def _analyze_text(self, state: ModelState, text: str, age_group: str, trace: Trace = NULL_TRACE,
+                      content_id: Optional[str] = None, work: Optional[TextWork] = None) -> TextAnalysis:
+        """
+        Runs the age-independent stages: keyword matching, context and vector
+        analysis. In cascade mode the vector stage is left out (None) when it
+        cannot change the decision for `age_group`. With a content store, the
+        keyword and context stages are updated from `content_id`'s previous
+        version. The stages keep their masterdoc-independent work in `work`,
+        if given, for the shadow.
+        """
         # 1. CSV Processing & Confidence-Based Cascading Logic
-        print("[HybridMod] Step 1: Running CSV Keyword Matching...", file=sys.stderr)
+        if content_id is not None and self.content_store is not None and len(text) >= CONTENT_STORE_MIN_CHARS:
+            csv_result, best_category_obj, rows_skipped = self._incremental_keyword_stage(state, content_id, text,
+                                                                                         trace, work)
+        else:
+            csv_result, best_category_obj, rows_skipped = self._keyword_stage(state, text, trace=trace, work=work)
+        if trace.verbose:
+            trace.debug("csv.complete", category=csv_result.primary_category,
+                        subcategory=csv_result.subcategory, confidence=csv_result.confidence,
+                        matched_keywords=csv_result.matched_keywords)
+        analysis = TextAnalysis(csv_result, best_category_obj, None, rows_skipped)
+        skip = self._vector_skip(analysis, age_group)
+        if skip is not None:
+            if trace.verbose:
+                trace.debug("vector.skipped", reason=skip)
+            return analysis
+
+        # 2. Vector Semantic Validation
+        return analysis._replace(vector_result=self._vector_stage(state, text, trace, work))
+
+    def _vector_stage(self, state: ModelState, text: str, trace: Trace = NULL_TRACE,
+                      work: Optional[TextWork] = None) -> VectorAnalysisResult:
+        vector_start = time.perf_counter_ns()
+        if work is not None and isinstance(state.vector_client, EmbeddingSearchClient):
+            vector_result = state.vector_client.analyze_frequencies(work.frequencies(state.vector_client),
+                                                                    state.category_names)[0]
+        else:
+            vector_result = state.vector_client.semantic_analyze(
+                text, 
+                state.category_names # Pass distinct categories
+            )
+        STAGE_SECONDS.observe(time.perf_counter_ns() - vector_start, "vector")
+        if trace.verbose:
+            trace.debug("vector.complete", category=vector_result.semantic_category,
+                        confidence=vector_result.confidence)
+        return vector_result
+
+    def _vector_skip(self, analysis: TextAnalysis, age_group: str) -> Optional[str]:
+        """
+        In cascade mode, why the vector stage cannot change this text's
+        decision for `age_group` (None if it can, or without cascade):
+
+        - age_block: the age-rule Block override applies whatever the score;
+        - below_review: even the highest vector confidence any client returns
+          (VECTOR_MAX_CONFIDENCE) keeps the weighted score below review.
+
+        A skipped stage leaves the result's vector_analysis empty and its
+        weighted_score without the vector part; only the decision and the
+        CSV analysis are those of the full pipeline.
+        """
+        if not self.cascade:
+            return None
+        csv_result, category = analysis.csv_result, analysis.category
+        if category is not None and self._age_blocks(category, csv_result.confidence, age_group):
+            return "age_block"
+        if csv_result.confidence * CSV_WEIGHT + VECTOR_MAX_CONFIDENCE * VECTOR_WEIGHT < FINAL_SCORE_REVIEW_THRESHOLD:
+            return "below_review"
+        return None
+
+    def _age_blocks(self, category: ModerationCategory, confidence: float, age_group: str) -> bool:
+        """Whether the age-rule Block override decides a best match on `category`."""
+        return confidence > AGE_BLOCK_MIN_CONFIDENCE and self._get_age_action(category.age_rules, age_group) == "Block"
+
+    def _cascade_metadata(self, analysis: TextAnalysis, age_group: str) -> dict:
+        skipped = []
+        if analysis.rows_skipped:
+            skipped.append("context")
+        reason = self._vector_skip(analysis, age_group) if analysis.vector_result is None else None
+        if reason is not None:
+            skipped.append("vector")
+        return {"skipped_stages": skipped, "vector_skip_reason": reason, "rows_skipped": analysis.rows_skipped}
+
+    def _from_cache(self, cached: ModerationResult, content_id: str, start_time: float) -> ModerationResult:
+        """Re-addresses a cached result to a new request. Cached sub-results are shared, not copied."""
+        DECISIONS.inc(cached.final_decision.decision)
+        if cached.csv_analysis.primary_category:
+            MATCHED_CATEGORIES.inc(cached.csv_analysis.primary_category)
+        metadata = {
+            "processing_time_ms": int((time.time() - start_time) * 1000),
+            "timestamp": datetime.datetime.now().isoformat(),
+            "masterdoc_version": cached.metadata["masterdoc_version"],
+            "cache": "hit",
+        }
+        if "cascade" in cached.metadata:
+            metadata["cascade"] = cached.metadata["cascade"]
+        return replace(cached, content_id=content_id, metadata=metadata)
+
+    def _keyword_stage(self, state: ModelState, text: str, fuzzy_cache: Optional[dict] = None,
+                       trace: Trace = NULL_TRACE, work: Optional[TextWork] = None
+                       ) -> Tuple[CSVAnalysisResult, Optional[ModerationCategory], int]:
+        """
+        Keyword matching with context awareness. Returns the best CSV match
+        (without age restriction, which depends on the age group), its row and
+        how many matched rows the cascade skipped.
+
+        The best row is the first one in masterdoc order with the highest
+        combined score. Safe-context checks can only lower a row's score, so
+        in cascade mode rows are checked by descending keyword score and the
+        scan stops once no remaining row can beat (or tie earlier than) the
+        best one.
+        """
+        # One pass of the keyword index yields the match scores of every row;
+        # rows without any keyword hit can never become the best match.
+        keyword_start = time.perf_counter_ns()
+        if work is None:
+            row_matches = state.keyword_index.match(text, fuzzy_cache)
+        else:
+            row_matches = state.keyword_index.row_scores(*work.hits(state.keyword_index, fuzzy_cache))
+        context_start = time.perf_counter_ns()
+        STAGE_SECONDS.observe(context_start - keyword_start, "keyword")
+        if not row_matches:
+            # Nothing matched (typically proven by the prefilter): no context to check.
+            return CSVAnalysisResult(), None, 0
+        context = self.context_validator.scan(text) if work is None else work.context(self.context_validator)
+        result = self._best_match(state, row_matches, context, trace)
+        STAGE_SECONDS.observe(time.perf_counter_ns() - context_start, "context")
+        return result
+
+    def _incremental_keyword_stage(self, state: ModelState, content_id: str, text: str, trace: Trace = NULL_TRACE,
+                                   work: Optional[TextWork] = None
+                                   ) -> Tuple[CSVAnalysisResult, Optional[ModerationCategory], int]:
+        """_keyword_stage's result, from the stored state of the content's previous version."""
+        keyword_start = time.perf_counter_ns()
+        index = state.keyword_index
+        content = self.content_store.refresh(content_id, text, state.version, index, self.context_validator)
+        hits = content.hits()
+        if work is not None:
+            work.set_hits(index, hits)
+        row_matches = index.row_scores(*hits)
+        context_start = time.perf_counter_ns()
+        STAGE_SECONDS.observe(context_start - keyword_start, "keyword")
+        if not row_matches:
+            return CSVAnalysisResult(), None, 0
+        result = self._best_match(state, row_matches, content.scan(self.context_validator, index.keywords), trace)
+        STAGE_SECONDS.observe(time.perf_counter_ns() - context_start, "context")
+        return result
+
+    def _best_match(self, state: ModelState, row_matches: dict, context,
+                    trace: Trace = NULL_TRACE) -> Tuple[CSVAnalysisResult, Optional[ModerationCategory], int]:
+        """
+        Picks the best row of KeywordIndex.match's `row_matches`, applying the
+        safe-context penalties; `context` answers is_safe(keyword) (a
+        ContextScan, or the merged checks of a long document).
+        """
         best_csv_result = CSVAnalysisResult()
         best_category_obj = None
+        best_row = len(state.categories)
+        if self.cascade:
+            bounds = {row: max(cat[0], sub[0]) for row, (cat, sub) in row_matches.items()}
+            rows = sorted(row_matches, key=lambda r: (-bounds[r], r))
+        else:
+            rows = sorted(row_matches)
+        rows_skipped = 0
+        for checked, row in enumerate(rows):
+            if self.cascade and (bounds[row], best_row) <= (best_csv_result.confidence, row):
+                # Rows are in (-bound, row) order, so no later one can win either.
+                rows_skipped = len(rows) - checked
+                break
+            cat = state.categories[row]
+            (cat_score, cat_matches), (sub_score, sub_matches) = row_matches[row]
 
-        # Iterate all categories to find best match
-        # In a real system with huge CSV, you'd use an inverted index or Aho-Corasick
-        # Iterate all categories to find best match
-        # In a real system with huge CSV, you'd use an inverted index or Aho-Corasick
-        for cat in self.categories:
             # Stage 1: Category Match
-            cat_score, cat_matches = self.matcher.calculate_match_confidence(text, cat.category_keywords)
-            
             # --- CONTEXT AWARENESS CHECK (Category) ---
             if cat_score > 0.0:
                  # Check if this primary match is in a safe context
                 is_safe = False
                 for kw in cat_matches:
-                    if self.context_validator.is_safe_context(text, kw):
-                        print(f"[HybridMod]   🛡️ Safe Context Detected for '{kw}' in {cat.category}. Downgrading score.", file=sys.stderr)
+                    if context.is_safe(kw):
+                        if trace.verbose: trace.debug("csv.safe_context", keyword=kw, category=cat.category)
                         is_safe = True
                         break
                 
                 if is_safe:
                     cat_score = cat_score * 0.1 # Heavily penalize the score
-                    print(f"[HybridMod]   -> Adjusted Score (Safe Context): {cat_score:.2f}", file=sys.stderr)
-                else:
-                    print(f"[HybridMod]   -> Candidate: {cat.category} | Keyword Match Score: {cat_score:.2f}", file=sys.stderr)
+                if trace.verbose:
+                    trace.debug("csv.candidate", category=cat.category, score=cat_score, safe_context=is_safe)
 
             # Stage 2: Subcategory Match (Check ALWAYS, not just if cat_score > best)
-            sub_score, sub_matches = self.matcher.calculate_match_confidence(text, cat.subcategory_keywords)
-            
             # --- CONTEXT AWARENESS CHECK (Subcategory) ---
             if sub_score > 0.0:
                 is_sub_safe = False
                 for kw in sub_matches:
-                        if self.context_validator.is_safe_context(text, kw):
+                        if context.is_safe(kw):
                             is_sub_safe = True
                 
                 if is_sub_safe:
@@ -73,15 +625,15 @@ class ContentModerationSystem:
                     # If the category IS educational, we should actually Keep the score high or even Boost it.
                     is_compatible_context = any(term in cat.subcategory.lower() for term in ['education', 'medical', 'health', 'recovery', 'news', 'study'])
                     
-                    if is_compatible_context:
-                        # Context aligns with category (e.g. sex ed in ed context)
-                        # Keep score as is (or potential boost?)
-                        print(f"[HybridMod]      -> Subcategory Safe Context aligns with category '{cat.subcategory}'. Keeping score high.", file=sys.stderr)
-                    else:
+                    # If the context aligns with the category (e.g. sex ed in ed context),
+                    # keep the score as is (or potential boost?)
+                    if not is_compatible_context:
                         sub_score = sub_score * 0.1
-                        print(f"[HybridMod]      -> Subcategory Safe Context for {cat.subcategory}. Adjusted Sub-score: {sub_score:.2f}", file=sys.stderr)
-                else:
-                    print(f"[HybridMod]      -> Subcategory Check: {cat.subcategory} | Sub-score: {sub_score:.2f}", file=sys.stderr)
+                    if trace.verbose:
+                        trace.debug("csv.subcategory_safe_context", subcategory=cat.subcategory,
+                                    score=sub_score, compatible=is_compatible_context)
+                elif trace.verbose:
+                    trace.debug("csv.subcategory_candidate", subcategory=cat.subcategory, score=sub_score)
             
             # Combined confidence calculation
             combined_conf = max(cat_score, sub_score)
@@ -90,81 +642,93 @@ class ContentModerationSystem:
             if cat_score > 0: matched_kw.extend(cat_matches)
             if sub_score > 0: matched_kw.extend(sub_matches)
 
-            # Update best result if this category is better
-            if combined_conf > best_csv_result.confidence:
-                print(f"[HybridMod]      -> 🌟 New Best Match: {cat.category} - {cat.subcategory} ({combined_conf:.2f})", file=sys.stderr)
+            # Update best result if this category is better (or, when rows are
+            # checked out of order, equally good and earlier in the masterdoc)
+            if combined_conf > best_csv_result.confidence or (
+                    combined_conf == best_csv_result.confidence and combined_conf > 0 and row < best_row):
+                if trace.verbose:
+                    trace.debug("csv.best_match", category=cat.category, subcategory=cat.subcategory,
+                                confidence=combined_conf)
                 best_csv_result = CSVAnalysisResult(
                     primary_category=cat.category,
                     subcategory=cat.subcategory,
                     confidence=combined_conf,
-                    matched_keywords=list(set(matched_kw)),
-                    age_restriction=self._get_age_action(cat.age_rules, age_group)
+                    matched_keywords=list(set(matched_kw))
                 )
                 best_category_obj = cat
+                best_row = row
 
-        if best_csv_result.primary_category:
-             print(f"[HybridMod] ✅ CSV Analysis Complete. Top Category: {best_csv_result.primary_category} ({best_csv_result.confidence:.2f})", file=sys.stderr)
-             print(f"[HybridMod]    Matched Keywords: {best_csv_result.matched_keywords}", file=sys.stderr)
-        else:
-             print("[HybridMod] ℹ️ CSV Analysis: No significant keyword matches found.", file=sys.stderr)
+        return best_csv_result, best_category_obj, rows_skipped
 
-        # 2. Vector Semantic Validation
-        print("[HybridMod] Step 2: Running Vector Semantic Analysis...", file=sys.stderr)
-        vector_result = self.vector_client.semantic_analyze(
-            text, 
-            [c.category for c in self.categories] # Pass distinct categories
+    def _with_age_restriction(self, csv_result: CSVAnalysisResult, category: Optional[ModerationCategory],
+                              age_group: str) -> CSVAnalysisResult:
+        if category is None:
+            return csv_result
+        return replace(csv_result, age_restriction=self._get_age_action(category.age_rules, age_group))
+
+    def _decide(self, state: ModelState, content_id: str, best_csv_result: CSVAnalysisResult, vector_result: VectorAnalysisResult,
+                age_group: str, start_time: float, trace: Trace = NULL_TRACE) -> ModerationResult:
+        decision_start = time.perf_counter_ns()
+        final_decision = self._final_decision(best_csv_result, vector_result, age_group)
+        
+        end_time = time.time()
+        STAGE_SECONDS.observe(time.perf_counter_ns() - decision_start, "decision")
+        DECISIONS.inc(final_decision.decision)
+        if best_csv_result.primary_category:
+            MATCHED_CATEGORIES.inc(best_csv_result.primary_category)
+        if trace:
+            trace.info("moderation.decision", age_group=age_group, decision=final_decision.decision,
+                       action=final_decision.action_required, weighted_score=final_decision.weighted_score,
+                       csv_confidence=best_csv_result.confidence,
+                       vector_confidence=vector_result.confidence, category=best_csv_result.primary_category,
+                       age_restriction=best_csv_result.age_restriction,
+                       processing_time_ms=int((end_time - start_time) * 1000))
+        
+        return ModerationResult(
+            content_id=content_id,
+            csv_analysis=best_csv_result,
+            vector_analysis=vector_result,
+            final_decision=final_decision,
+            metadata={
+                "processing_time_ms": int((end_time - start_time) * 1000),
+                "timestamp": datetime.datetime.now().isoformat(),
+                "masterdoc_version": state.version[:12],
+            }
         )
-        print(f"[HybridMod]    Vector Semantic Category: {vector_result.semantic_category}", file=sys.stderr)
-        print(f"[HybridMod]    Vector Confidence: {vector_result.confidence:.2f}", file=sys.stderr)
 
+    def _final_decision(self, best_csv_result: CSVAnalysisResult, vector_result: VectorAnalysisResult,
+                        age_group: str) -> FinalDecision:
+        """The decision rules alone, without metrics or tracing (the shadow uses them too)."""
         # 3. Scoring Algorithm
-        print("[HybridMod] Step 3: Calculating Weighted Hybrid Score...", file=sys.stderr)
         final_score = (best_csv_result.confidence * CSV_WEIGHT) + (vector_result.confidence * VECTOR_WEIGHT)
-        print(f"[HybridMod]    Calculation: ({best_csv_result.confidence:.2f} * {CSV_WEIGHT}) + ({vector_result.confidence:.2f} * {VECTOR_WEIGHT}) = {final_score:.4f}", file=sys.stderr)
 
         # 4. Decision Logic
-        print("[HybridMod] Step 4: Decision Engine & Age Rules...", file=sys.stderr)
         decision = "PASS"
         action = "Allow with monitoring"
         reasoning = "Content appears safe."
 
         # Age enforcement override
-        print(f"[HybridMod]    Checking Age Rule for group '{age_group}': {best_csv_result.age_restriction}", file=sys.stderr)
         
         # Only apply hard blocking if we have sufficient confidence in the CSV match
-        if best_csv_result.age_restriction == "Block" and best_csv_result.confidence > 0.4:
-            print(f"[HybridMod] ⛔ AGE RESTRICTION APPLIED: Force-blocking content.", file=sys.stderr)
+        if best_csv_result.age_restriction == "Block" and best_csv_result.confidence > AGE_BLOCK_MIN_CONFIDENCE:
             decision = "FLAG"
             action = "Blocked by Age Rule"
             reasoning = f"Content blocked for age group {age_group}."
             final_score = 1.0 # Force max score for blocking
-        elif final_score >= 0.9:
+        elif final_score >= FINAL_SCORE_FLAG_THRESHOLD:
             decision = "FLAG"
             action = "Block/Review Required"
             reasoning = "High confidence of inappropriate content."
-        elif final_score >= 0.7:
+        elif final_score >= FINAL_SCORE_REVIEW_THRESHOLD:
             decision = "REVIEW_QUEUE"
             action = "Manual verification needed"
             reasoning = "Moderate confidence, requires review."
-        
-        print(f"[HybridMod] 🏁 FINAL DECISION: {decision} | Action: {action}", file=sys.stderr)
-        
-        end_time = time.time()
-        
-        return ModerationResult(
-            content_id=content_id,
-            csv_analysis=best_csv_result,
-            vector_analysis=vector_result,
-            final_decision=FinalDecision(
-                weighted_score=round(final_score, 4),
-                decision=decision,
-                action_required=action,
-                reasoning=reasoning
-            ),
-            metadata={
-                "processing_time_ms": int((end_time - start_time) * 1000),
-                "timestamp": datetime.datetime.now().isoformat()
-            }
+
+        return FinalDecision(
+            weighted_score=round(final_score, 4),
+            decision=decision,
+            action_required=action,
+            reasoning=reasoning
         )
 
     def _get_age_action(self, rules, age_group):
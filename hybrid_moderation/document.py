@@ -0,0 +1,188 @@
+"""
+Long-document analysis in overlapping windows.
+
+A DocumentSession takes the text in chunks of any size (e.g. a streamed
+upload) and analyzes it one window at a time, so memory stays bounded by the
+window size and the time is linear in the length:
+
+    session = cms.document_session("transcript-1", "13-16")
+    for chunk in chunks:
+        session.feed(chunk)
+        if session.stopped:
+            break
+    result = session.finish()
+
+Windows are cut at whitespace, so no token is split, and consecutive
+windows overlap by the context window on the left plus the context window
+and the longest keyword on the right. Each window owns a core range; every
+keyword occurrence starts in exactly one core and lies, with its whole
+context window, inside that core's window. Merging gives what one pass over
+the full text would:
+
+- keyword hits: the union of every window's exact and fuzzy keyword ids
+  (a keyword contained anywhere counts as exact);
+- safe context: a keyword is safe if it was found and every occurrence
+  was safe in the window that owns it;
+- vector: the most confident window's result (documents are longer than
+  anything the vector stage was calibrated on, so there is no whole-text
+  embedding to reproduce).
+
+So the CSV analysis of a document read to the end equals analyze() on the
+same text.
+
+stop_on_block (off by default) is a policy override that deliberately
+departs from that: the session stops after the first window whose merged
+hits give an age-rule Block, and the document is blocked on that match.
+Read to the end, a later passage could still make another row the best
+match (a higher confidence, or a tie on an earlier row) and the decision
+could differ, so with stop_on_block a transcript with a blocked passage is
+blocked whatever follows, where analyze() might not block it. Results
+that stopped early say so in metadata["document"]["stopped_early"].
+"""
+import time
+from typing import Dict, List, Optional
+
+from .config import DOCUMENT_WINDOW_CHARS
+from .models import ModerationResult, VectorAnalysisResult
+
+# Fuzzy lookups are cached per token across windows, up to this many tokens.
+_FUZZY_CACHE_MAX = 50000
+
+
+def _lower_length(text: str) -> int:
+    # Lowercasing may change the length of non-ASCII text ('İ' -> 'i̇').
+    return len(text) if text.isascii() else len(text.lower())
+
+
+def _whitespace_before(text: str, end: int, floor: int) -> int:
+    """Position of the last whitespace character in text[floor:end], or `end` if there is none."""
+    for pos in range(end - 1, floor - 1, -1):
+        if text[pos].isspace():
+            return pos
+    return end
+
+
+class DocumentSession:
+    def __init__(self, cms, content_id: str, age_group: str, stop_on_block: bool = False,
+                 window: int = DOCUMENT_WINDOW_CHARS):
+        self.cms = cms
+        # The whole document is analyzed against one masterdoc version.
+        self.state = cms.state
+        self.content_id = content_id
+        self.age_group = age_group
+        self.stop_on_block = stop_on_block
+        self.start_time = time.time()
+
+        index = self.state.keyword_index
+        self.left = cms.context_validator.context_window
+        self.right = self.left + max((len(kw) for kw in index.keywords), default=0)
+        self.window = max(window, 4 * (self.left + self.right))
+
+        # Unprocessed text starts at the current window's start; its core
+        # starts at _core_start within it.
+        self._buffer = ""
+        self._pending: List[str] = []  # chunks not yet appended to _buffer
+        self._pending_length = 0
+        self._core_start = 0
+        self._lower_offset = 0  # lowercased length of all text before _buffer
+        self._fuzzy_cache: Dict[str, set] = {}
+
+        self.exact: set = set()
+        self.fuzzy: set = set()
+        # keyword -> [found, all occurrences safe, absolute lowercased position to resume the scan]
+        self._safety: Dict[str, List] = {}
+        self.vector_result: Optional[VectorAnalysisResult] = None
+        self.windows = 0
+        self.characters = 0
+        self.stopped = False
+
+    def feed(self, text: str):
+        """Adds the next chunk of the document, analyzing every window it completes."""
+        # Large chunks are taken a window at a time, so the buffer stays small.
+        for start in range(0, len(text), self.window):
+            if self.stopped:
+                return
+            self._feed(text[start:start + self.window] if len(text) > self.window else text)
+
+    def _feed(self, text: str):
+        self.characters += len(text)
+        self._pending.append(text)
+        self._pending_length += len(text)
+        if len(self._buffer) + self._pending_length <= self.window:
+            return
+        self._buffer += "".join(self._pending)
+        self._pending, self._pending_length = [], 0
+        while not self.stopped and len(self._buffer) > self.window:
+            buffer = self._buffer
+            # Window end: at whitespace, looking back at most a quarter window.
+            cut = _whitespace_before(buffer, self.window + 1, self.window - self.window // 4)
+            if cut > self.window:
+                cut = self.window
+            core_end = cut - self.right
+            self._analyze_window(buffer[:cut], self._core_start, core_end)
+            # The next window starts early enough to hold left context for its core.
+            start = _whitespace_before(buffer, core_end - self.left + 1, core_end - self.left - self.window // 4)
+            if start > core_end - self.left:
+                start = core_end - self.left
+            self._lower_offset += _lower_length(buffer[:start])
+            self._buffer = buffer[start:]
+            self._core_start = core_end - start
+
+    def finish(self) -> ModerationResult:
+        """Analyzes the rest of the document and returns the merged result."""
+        if not self.stopped:
+            self._buffer += "".join(self._pending)
+            if self._buffer or not self.windows:
+                self._analyze_window(self._buffer, self._core_start, len(self._buffer))
+        self._buffer, self._pending = "", []
+        cms = self.cms
+        csv_result, category, _ = self._best()
+        csv_result = cms._with_age_restriction(csv_result, category, self.age_group)
+        result = cms._decide(self.state, self.content_id, csv_result, self.vector_result or VectorAnalysisResult(),
+                             self.age_group, self.start_time)
+        result.metadata["document"] = {"windows": self.windows, "characters": self.characters,
+                                       "stopped_early": self.stopped}
+        return result
+
+    def is_safe(self, keyword: str) -> bool:
+        """Merged ContextScan.is_safe over the windows analyzed so far."""
+        entry = self._safety.get(keyword.lower())
+        return entry is not None and entry[0] and entry[1]
+
+    def _best(self):
+        row_matches = self.state.keyword_index.row_scores(self.exact, self.fuzzy - self.exact)
+        return self.cms._best_match(self.state, row_matches, self)
+
+    def _analyze_window(self, text: str, core_start: int, core_end: int):
+        state, index = self.state, self.state.keyword_index
+        self.windows += 1
+        exact, fuzzy = index.hits(text, self._fuzzy_cache)
+        if len(self._fuzzy_cache) > _FUZZY_CACHE_MAX:
+            self._fuzzy_cache.clear()
+        self.exact |= exact
+        self.fuzzy |= fuzzy
+
+        scan = None
+        lower_start, lower_end = _lower_length(text[:core_start]), _lower_length(text[:core_end])
+        for kid in exact:
+            keyword = index.keywords[kid]
+            entry = self._safety.get(keyword)
+            if entry is not None and not entry[1]:
+                continue  # one unsafe occurrence settles it
+            if scan is None:
+                scan = self.cms.context_validator.scan(text)
+            resume = lower_start if entry is None else max(lower_start, entry[2] - self._lower_offset)
+            found, safe, resume = scan.occurrences_safe(keyword, resume, lower_end)
+            if entry is None:
+                self._safety[keyword] = [found, safe, resume + self._lower_offset]
+            else:
+                entry[0], entry[1], entry[2] = entry[0] or found, safe, resume + self._lower_offset
+
+        vector_result = state.vector_client.semantic_analyze(text, state.category_names)
+        if self.vector_result is None or vector_result.confidence > self.vector_result.confidence:
+            self.vector_result = vector_result
+
+        if self.stop_on_block:
+            csv_result, category, _ = self._best()
+            if category is not None and self.cms._age_blocks(category, csv_result.confidence, self.age_group):
+                self.stopped = True
@@ -0,0 +1,326 @@
+"""
+Local semantic stage: hashed n-gram embeddings scored against category vectors.
+
+HashedNgramEmbedder maps a text to a fixed-size vector without a vocabulary
+or network access: character 3-5-grams and word uni/bigrams are hashed into
+`dim` signed buckets, term frequencies are log-scaled, weighted by an IDF
+fitted on the category documents and L2-normalized.
+
+EmbeddingSearchClient is a drop-in replacement for vector_mock's
+VectorSearchClient. `build` embeds one document per masterdoc row (its
+subcategory, Description and keyword columns); scoring a text is a single
+matrix-vector product against those row vectors (matrix-matrix for batches),
+stored as float32 or per-row int8. Optionally, labelled exemplar texts are
+searched with an IVFIndex (see ann.py) as well, and the term frequencies of
+analyzed texts are kept in a persistent FeatureCache (see feature_cache.py).
+"""
+import hashlib
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import (
+    EMBEDDING_BATCH_CHUNK, EMBEDDING_CHAR_NGRAMS, EMBEDDING_DIM, EMBEDDING_DTYPE,
+    EMBEDDING_SIMILARITY_CEIL, EMBEDDING_SIMILARITY_FLOOR, EXEMPLAR_MIN_SIMILARITY, VECTOR_MAX_CONFIDENCE
+)
+from .models import ModerationCategory, VectorAnalysisResult
+
+_NON_WORD_RE = re.compile(r'\W+')
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_PRIME = np.uint64(1000003)
+_INV_PRIME = np.uint64(pow(1000003, -1, 2 ** 64))
+_WORD_SEED = np.uint64(0x5BD1E995)
+_BIGRAM_SEED = np.uint64(0xC2B2AE35)
+
+_MAX_CHARS_PER_PASS = 1 << 20
+
+FALLBACK_CATEGORY = "General"
+
+
+class HashedNgramEmbedder:
+    """
+    Signed feature hashing of character and word n-grams. Hashes are
+    polynomial hashes over the text's code points computed with NumPy, so
+    they are stable across processes, unlike Python's salted hash().
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, char_ngrams: Sequence[int] = EMBEDDING_CHAR_NGRAMS):
+        self.dim = dim
+        self.char_ngrams = tuple(char_ngrams)
+        self.idf = np.ones(dim, dtype=np.float32)
+        # Identifies the hashing (and so the unweighted vectors); `version`
+        # additionally covers the fitted IDF.
+        self.feature_version = f"hashed-ngram-v1/{dim}/{'-'.join(map(str, self.char_ngrams))}"
+        self.version = self._version()
+
+    def _version(self) -> str:
+        return f"{self.feature_version}/{hashlib.sha256(self.idf.tobytes()).hexdigest()[:12]}"
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return ' ' + _NON_WORD_RE.sub(' ', text.lower()).strip() + ' '
+
+    def features(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (text index, bucket, +-1 sign) of every n-gram of every text, with
+        repeats. All texts are hashed in one vectorized pass over their
+        concatenation; n-grams that would straddle two texts are dropped.
+        """
+        normalized = [self.normalize(text) for text in texts]
+        codes = np.frombuffer("".join(normalized).encode("utf-32-le"), dtype=np.uint32)
+        length = len(codes)
+        owner = np.repeat(np.arange(len(texts)), [len(n) for n in normalized])
+        # Polynomial hash of codes[i:j] = sum(codes[k] * P^(j-1-k)), computed
+        # for any span from prefix sums of codes[k] * P^-k (mod 2^64).
+        powers = np.cumprod(np.full(length, _PRIME), dtype=np.uint64) * _INV_PRIME
+        prefix = np.zeros(length + 1, dtype=np.uint64)
+        np.cumsum(codes * (np.cumprod(np.full(length, _INV_PRIME), dtype=np.uint64) * _PRIME), out=prefix[1:])
+
+        hashes, rows = [], []
+        for n in self.char_ngrams:
+            if length >= n:
+                same_text = owner[:length - n + 1] == owner[n - 1:]
+                hashes.append(((prefix[n:] - prefix[:-n]) * powers[n - 1:] ^ np.uint64(n))[same_text])
+                rows.append(owner[:length - n + 1][same_text])
+        # Every normalized text starts and ends with a space, so words are the
+        # non-empty spans between consecutive spaces of the same text.
+        spaces = np.flatnonzero(codes == 32)
+        starts, ends = spaces[:-1] + 1, spaces[1:]
+        is_word = (ends > starts) & (owner[spaces[:-1]] == owner[spaces[1:]])
+        starts, ends = starts[is_word], ends[is_word]
+        words = (prefix[ends] - prefix[starts]) * powers[ends - 1] ^ _WORD_SEED
+        word_rows = owner[starts]
+        same_text = word_rows[:-1] == word_rows[1:]
+        hashes += [words, (words[:-1] * _PRIME ^ words[1:] ^ _BIGRAM_SEED)[same_text]]
+        rows += [word_rows, word_rows[:-1][same_text]]
+
+        h = np.concatenate(hashes) * _MIX
+        h ^= h >> np.uint64(29)
+        # Bucket from the high 32 bits (multiply-shift, no division), sign from bit 31.
+        buckets = ((h >> np.uint64(32)) * np.uint64(self.dim) >> np.uint64(32)).view(np.int64)
+        signs = (h >> np.uint64(31) & np.uint64(1)).astype(np.float32) * np.float32(-2) + np.float32(1)
+        return np.concatenate(rows), buckets, signs
+
+    def term_frequencies(self, texts: Sequence[str]) -> np.ndarray:
+        """(len(texts), dim) signed bucket counts."""
+        counts = np.zeros((len(texts), self.dim), dtype=np.float32)
+        # Bound the temporary arrays: hash at most ~1M characters per pass.
+        start = 0
+        while start < len(texts):
+            end, size = start, 0
+            while end < len(texts) and (end == start or size + len(texts[end]) <= _MAX_CHARS_PER_PASS):
+                size += len(texts[end])
+                end += 1
+            rows, buckets, signs = self.features(texts[start:end])
+            counts[start:end] = np.bincount(rows * self.dim + buckets, weights=signs,
+                                            minlength=(end - start) * self.dim).reshape(end - start, self.dim)
+            start = end
+        return counts
+
+    def fit(self, documents: Sequence[str]):
+        """Fits the IDF weights on a corpus (smoothed, as in scikit-learn)."""
+        self.fit_frequencies(self.term_frequencies(documents))
+
+    def fit_frequencies(self, tf: np.ndarray):
+        """Fits the IDF weights on the term frequencies of a corpus, one row per document."""
+        document_frequency = np.count_nonzero(tf, axis=0)
+        self.idf = (np.log((len(tf) + 1) / (document_frequency + 1)) + 1).astype(np.float32)
+        self.version = self._version()
+
+    @staticmethod
+    def unit_vectors(tf: np.ndarray, idf: Optional[np.ndarray] = None) -> np.ndarray:
+        """Log-scaled, optionally IDF-weighted, L2-normalized rows (all-zero rows stay zero)."""
+        vectors = np.sign(tf) * np.log1p(np.abs(tf))
+        if idf is not None:
+            vectors *= idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    def embed_batch(self, texts: Sequence[str], use_idf: bool = True) -> np.ndarray:
+        """(len(texts), dim) float32 unit vectors. Without IDF they only depend on feature_version."""
+        return self.unit_vectors(self.term_frequencies(texts), self.idf if use_idf else None)
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.embed_batch([text])[0]
+
+
+class EmbeddingSearchClient:
+    """
+    Semantic analysis against masterdoc category vectors.
+
+    Same interface as vector_mock.VectorSearchClient: `semantic_analyze`
+    returns the best-matching category, a confidence calibrated from the
+    cosine similarity (see config.EMBEDDING_SIMILARITY_*) and the raw
+    similarity as `embedding_similarity`. The `categories` argument restricts
+    the candidates to those category names.
+
+    With an exemplar index loaded, `embedding_similarity` is the similarity of
+    the nearest exemplar instead; from EXEMPLAR_MIN_SIMILARITY up (and if its
+    category is a candidate) the exemplar's category is returned, with at
+    least that similarity as confidence.
+    """
+
+    def __init__(self, embedder: Optional[HashedNgramEmbedder] = None, dtype: str = EMBEDDING_DTYPE,
+                 batch_chunk: int = EMBEDDING_BATCH_CHUNK, exemplar_path: Optional[str] = None):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"Unsupported embedding dtype: {dtype!r}")
+        self.embedder = embedder or HashedNgramEmbedder()
+        self.dtype = dtype
+        self.batch_chunk = batch_chunk
+        self.names: List[str] = []
+        # (rows, dim) category vectors; for int8, row i is vectors[i] * scales[i].
+        self.vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self.scales: Optional[np.ndarray] = None
+        self._masks: Dict[Tuple[str, ...], np.ndarray] = {}
+        self.exemplars = None
+        self._exemplar_allowed: Dict[Tuple[str, ...], np.ndarray] = {}
+        # Documents and term frequencies of the last build, reused by the next one.
+        self._documents: Dict[str, int] = {}
+        self._tf = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self.feature_cache = None  # FeatureCache for analyzed texts
+        if exemplar_path:
+            self.load_exemplars(exemplar_path)
+
+    def clone(self) -> "EmbeddingSearchClient":
+        """
+        An unbuilt client with the same settings, exemplar index and term
+        frequency cache, for rebuilding while this one keeps serving.
+        """
+        client = EmbeddingSearchClient(HashedNgramEmbedder(self.embedder.dim, self.embedder.char_ngrams),
+                                       self.dtype, self.batch_chunk)
+        client.exemplars = self.exemplars
+        client.feature_cache = self.feature_cache
+        client._documents, client._tf = self._documents, self._tf
+        return client
+
+    def load_exemplars(self, path: str):
+        """Memory-maps an exemplar index built with `python -m hybrid_moderation.ann`."""
+        from .ann import IVFIndex
+        index = IVFIndex.load(path)
+        if index.embedder_version != self.embedder.feature_version:
+            raise ValueError(f"Exemplar index {path} was built with {index.embedder_version}, "
+                             f"not {self.embedder.feature_version}")
+        self.exemplars = index
+        self._exemplar_allowed = {}
+
+    @staticmethod
+    def category_document(category: ModerationCategory) -> str:
+        return " , ".join([category.subcategory, category.description]
+                          + category.category_keywords + category.subcategory_keywords)
+
+    def build(self, categories: List[ModerationCategory]):
+        """
+        Fits the embedder and embeds one vector per masterdoc row. Only rows
+        whose document changed since the previous build are hashed again;
+        the IDF and all vectors are then recomputed from the term frequencies.
+        """
+        documents = [self.category_document(c) for c in categories]
+        fresh = [d for d in dict.fromkeys(documents) if d not in self._documents]
+        fresh_ids = {d: len(self._tf) + i for i, d in enumerate(fresh)}
+        known = np.concatenate([self._tf, self.embedder.term_frequencies(fresh)]) if fresh else self._tf
+        tf = known[[self._documents.get(d, fresh_ids.get(d)) for d in documents]] if documents \
+            else np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self._documents = {d: i for i, d in enumerate(documents)}
+        self._tf = tf
+        self.embedder.fit_frequencies(tf)
+        vectors = self.embedder.unit_vectors(tf, self.embedder.idf)
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            self.vectors = np.round(vectors / scales[:, None]).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+        else:
+            self.vectors, self.scales = vectors, None
+        self.names = [c.category for c in categories]
+        self._masks = {}
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the category vectors."""
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def similarities(self, queries: np.ndarray) -> np.ndarray:
+        """(len(queries), rows) cosine similarities of unit query vectors to every row."""
+        if self.scales is None:
+            return queries @ self.vectors.T
+        return (queries @ self.vectors.T.astype(np.float32)) * self.scales
+
+    def semantic_analyze(self, text: str, categories: List[str]) -> VectorAnalysisResult:
+        return self.semantic_analyze_batch([text], categories)[0]
+
+    def semantic_analyze_batch(self, texts: List[str], categories: List[str]) -> List[VectorAnalysisResult]:
+        """Analyzes several texts against the same category list, batch_chunk texts per product."""
+        results = []
+        for start in range(0, len(texts), self.batch_chunk):
+            results.extend(self.analyze_frequencies(self.text_frequencies(texts[start:start + self.batch_chunk]),
+                                                    categories))
+        return results
+
+    def text_frequencies(self, texts: Sequence[str]) -> np.ndarray:
+        """The texts' term frequencies, through the feature cache if there is one."""
+        if self.feature_cache is not None:
+            return self.feature_cache.term_frequencies(self.embedder, texts)
+        return self.embedder.term_frequencies(texts)
+
+    def analyze_frequencies(self, tf: np.ndarray, categories: List[str]) -> List[VectorAnalysisResult]:
+        """
+        semantic_analyze_batch for texts whose text_frequencies are known. They
+        do not depend on the masterdoc, so the frequencies computed by any
+        client with the same embedder settings (e.g. a clone) can be reused.
+        """
+        mask = self._mask(categories)
+        similarities = self.similarities(self.embedder.unit_vectors(tf, self.embedder.idf))
+        if self.exemplars is None:
+            return [self._result(row, mask) for row in similarities]
+        # Exemplars are indexed without IDF weights; reuse the same term frequencies.
+        nearest, _, labels = self.exemplars.search(self.embedder.unit_vectors(tf), k=1)
+        allowed = self._exemplar_mask(categories)
+        return [self._exemplar_result(self._result(row, mask), float(sim[0]), int(label[0]), allowed)
+                for row, sim, label in zip(similarities, nearest, labels)]
+
+    def _mask(self, categories: List[str]) -> np.ndarray:
+        key = tuple(categories)
+        mask = self._masks.get(key)
+        if mask is None:
+            allowed = set(categories)
+            mask = self._masks[key] = np.array([name in allowed for name in self.names], dtype=bool)
+        return mask
+
+    def _exemplar_mask(self, categories: List[str]) -> np.ndarray:
+        key = tuple(categories)
+        allowed = self._exemplar_allowed.get(key)
+        if allowed is None:
+            names = set(categories)
+            allowed = self._exemplar_allowed[key] = np.array(
+                [label in names for label in self.exemplars.labels], dtype=bool)
+        return allowed
+
+    def _exemplar_result(self, result: VectorAnalysisResult, similarity: float, label: int,
+                         allowed: np.ndarray) -> VectorAnalysisResult:
+        if label < 0:
+            return result
+        result.embedding_similarity = round(similarity, 4)
+        if similarity >= EXEMPLAR_MIN_SIMILARITY and allowed[label]:
+            result.semantic_category = self.exemplars.labels[label]
+            result.confidence = max(result.confidence, round(min(similarity, VECTOR_MAX_CONFIDENCE), 4))
+        return result
+
+    def _result(self, similarities: np.ndarray, mask: np.ndarray) -> VectorAnalysisResult:
+        scores = np.where(mask, similarities, -np.inf)
+        if not len(scores) or not np.isfinite(scores).any():
+            return VectorAnalysisResult(semantic_category=FALLBACK_CATEGORY)
+        row = int(np.argmax(scores))
+        similarity = float(scores[row])
+        confidence = self.calibrate(similarity)
+        return VectorAnalysisResult(
+            semantic_category=self.names[row] if confidence > 0 else FALLBACK_CATEGORY,
+            confidence=confidence,
+            embedding_similarity=round(similarity, 4),
+        )
+
+    @staticmethod
+    def calibrate(similarity: float) -> float:
+        scaled = (similarity - EMBEDDING_SIMILARITY_FLOOR) / (EMBEDDING_SIMILARITY_CEIL - EMBEDDING_SIMILARITY_FLOOR)
+        return round(min(max(scaled, 0.0), 1.0) * VECTOR_MAX_CONFIDENCE, 4)
@@ -0,0 +1,206 @@
+"""
+Persistent cache of embedding features.
+
+The embedding client's expensive step is hashing a text's n-grams into term
+frequencies (see HashedNgramEmbedder.features). Those only depend on the
+normalized text and the embedder's feature_version, not on the masterdoc or
+the fitted IDF, so they are cached on disk, where reposted or re-moderated
+texts find them after a deploy or in another worker process:
+
+    client.feature_cache = FeatureCache("features.db")
+
+Entries are keyed by sha256(feature_version, normalized text) and hold the
+non-zero buckets of the term-frequency row (float32 counts, then uint16 or
+uint32 bucket ids). The store is a SQLite file in WAL mode, safe to share
+between processes; a byte total kept in the same transactions as the
+inserts caps its size, and the least recently used entries are evicted down
+to 90% of the cap when it is exceeded. Lookups are batched (one query per
+batch of texts), and hits refresh their recency in bulk on the next write.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import FEATURE_CACHE_MAX_BYTES, FEATURE_CACHE_MIN_CHARS
+from .metrics import CACHE_LOOKUPS
+
+# Keys per SQL statement (SQLite's default variable limit is 999 on older builds).
+_KEYS_PER_QUERY = 500
+# Recency updates are deferred until the next write or this many hits.
+_MAX_PENDING_TOUCHES = 1024
+_LOW_WATERMARK = 0.9
+
+
+class FeatureCache:
+    def __init__(self, path: str, max_bytes: int = FEATURE_CACHE_MAX_BYTES,
+                 min_chars: int = FEATURE_CACHE_MIN_CHARS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.min_chars = min_chars
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reopen()
+
+    def reopen(self):
+        """Opens a new connection after close(), e.g. in a forked worker (see prefork.py)."""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock, self._transaction():
+            self._conn.execute("CREATE TABLE IF NOT EXISTS features ("
+                               "key BLOB PRIMARY KEY, data BLOB NOT NULL, used REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS features_used ON features (used)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('bytes', "
+                               "(SELECT COALESCE(SUM(LENGTH(data)), 0) FROM features))")
+        self._touched: Dict[bytes, None] = {}
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    @staticmethod
+    def key(feature_version: str, normalized: str) -> bytes:
+        return hashlib.sha256(f"{feature_version}\0{normalized}".encode("utf-8", "surrogatepass")).digest()
+
+    def get_many(self, keys: Iterable[bytes]) -> Dict[bytes, bytes]:
+        """The cached entries among `keys`, one query per _KEYS_PER_QUERY keys."""
+        keys = list(keys)
+        found: Dict[bytes, bytes] = {}
+        with self._lock:
+            for start in range(0, len(keys), _KEYS_PER_QUERY):
+                chunk = keys[start:start + _KEYS_PER_QUERY]
+                found.update(self._conn.execute(
+                    f"SELECT key, data FROM features WHERE key IN ({','.join('?' * len(chunk))})", chunk))
+            self._touched.update(dict.fromkeys(found))
+            if len(self._touched) >= _MAX_PENDING_TOUCHES:
+                with self._transaction():
+                    self._flush_touches()
+        return found
+
+    def put_many(self, entries: Dict[bytes, bytes]):
+        """Stores new entries (existing keys are kept) and evicts down to the low watermark if over the cap."""
+        now = time.time()
+        with self._lock, self._transaction():
+            self._flush_touches()
+            added = 0
+            for key, data in entries.items():
+                if self._conn.execute("INSERT OR IGNORE INTO features VALUES (?, ?, ?)", (key, data, now)).rowcount:
+                    added += len(data)
+            total = self._conn.execute("UPDATE meta SET value = value + ? WHERE name = 'bytes' RETURNING value",
+                                       (added,)).fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(total - int(self.max_bytes * _LOW_WATERMARK))
+
+    def _flush_touches(self):
+        if self._touched:
+            keys = list(self._touched)
+            self._touched = {}
+            now = time.time()
+            for start in range(0, len(keys), _KEYS_PER_QUERY):
+                chunk = keys[start:start + _KEYS_PER_QUERY]
+                self._conn.execute(f"UPDATE features SET used = ? WHERE key IN ({','.join('?' * len(chunk))})",
+                                   [now] + chunk)
+
+    def _evict(self, excess: int):
+        freed = 0
+        while freed < excess:
+            victims = self._conn.execute(
+                "SELECT key, LENGTH(data) FROM features ORDER BY used LIMIT ?", (_KEYS_PER_QUERY,)).fetchall()
+            if not victims:
+                break
+            for key, size in victims:
+                if freed >= excess:
+                    break
+                self._conn.execute("DELETE FROM features WHERE key = ?", (key,))
+                freed += size
+                self.evictions += 1
+        self._conn.execute("UPDATE meta SET value = value - ? WHERE name = 'bytes'", (freed,))
+
+    def term_frequencies(self, embedder, texts: Sequence[str]) -> np.ndarray:
+        """embedder.term_frequencies(texts), with texts of min_chars or more served from the cache."""
+        normalized = [embedder.normalize(text) for text in texts]
+        keys: List[Optional[bytes]] = [
+            self.key(embedder.feature_version, n) if len(n) >= self.min_chars else None for n in normalized]
+        if not any(keys):
+            return embedder.term_frequencies(normalized)
+        cached = self.get_many({key for key in keys if key is not None})
+        counts = np.zeros((len(texts), embedder.dim), dtype=np.float32)
+        index_dtype = np.uint16 if embedder.dim <= 1 << 16 else np.uint32
+        computed: Dict[bytes, int] = {}  # key -> row it is computed for
+        pending: List[int] = []  # rows to compute
+        repeats: List[Tuple[int, int]] = []  # (row, row computed for the same text)
+        for row, key in enumerate(keys):
+            data = cached.get(key) if key is not None else None
+            if data is not None:
+                size = len(data) // (4 + np.dtype(index_dtype).itemsize)
+                counts[row, np.frombuffer(data, index_dtype, size, 4 * size)] = np.frombuffer(data, np.float32, size)
+            elif key is None:
+                pending.append(row)
+            elif key in computed:
+                repeats.append((row, computed[key]))
+            else:
+                computed[key] = row
+                pending.append(row)
+        hits = sum(1 for key in keys if key is not None and key in cached)
+        misses = sum(1 for key in keys if key is not None) - hits
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+        if hits:
+            CACHE_LOOKUPS.inc("features", "hit", amount=hits)
+        if misses:
+            CACHE_LOOKUPS.inc("features", "miss", amount=misses)
+
+        if pending:
+            counts[pending] = embedder.term_frequencies([normalized[row] for row in pending])
+            for row, source in repeats:
+                counts[row] = counts[source]
+            entries = {}
+            for key, row in computed.items():
+                buckets = np.flatnonzero(counts[row])
+                entries[key] = counts[row, buckets].tobytes() + buckets.astype(index_dtype).tobytes()
+            if entries:
+                self.put_many(entries)
+        return counts
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM features), (SELECT value FROM meta WHERE name = 'bytes')").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._touched:
+                with self._transaction():
+                    self._flush_touches()
+            self._conn.close()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error) on an autocommit connection."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
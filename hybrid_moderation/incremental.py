@@ -0,0 +1,378 @@
+"""
+Incremental re-moderation of edited content.
+
+Posts and captions are edited often, and each version used to go through
+the full keyword and context scan. With a content store, analyze() keeps
+per-content_id state for the last version it saw:
+
+- keyword hit positions: every (possibly overlapping) start of every
+  contained keyword in the lowercased text;
+- safe-term spans, as ContextScan finds them;
+- the token multiset (KeywordMatcher.tokenize) and the fuzzy keyword hits
+  of the tokens that have any.
+
+A new version is diffed against the stored text (common prefix and suffix,
+compared in blocks), and only the changed region is re-scanned: for keyword
+hits, the region widened by the longest keyword on both sides; for safe
+terms, by the tokens a multi-word term can span; for fuzzy hits, by the
+whitespace-delimited runs it touches. Everything outside is carried over
+(positions after the edit shifted), so the keyword hits, the context checks
+and hence the result equal a fresh analysis. Per-row scores and the best
+match are recomputed from the merged hits, which costs a pass over the hits
+rather than over the text. The vector stage still embeds the whole text.
+
+States are tied to the masterdoc version (keyword ids are per index); a
+state from another version is rebuilt from scratch. Stores:
+
+- MemoryContentStore: an LRU bounded by entries and approximate bytes, per
+  process;
+- SQLiteContentStore: a database file (WAL mode), shared by worker
+  processes and kept across restarts, pruned least-recently-written first.
+"""
+import logging
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+from .cache import LRUCache
+from .config import CONTENT_STORE_MAX_BYTES, CONTENT_STORE_MAX_ENTRIES
+from .context import ContextScan, ContextValidator
+from .index import KeywordIndex
+
+logger = logging.getLogger(__name__)
+
+_WORD_CHAR = re.compile(r'\w')
+# Tokens a safe term can span ("health class" = 2).
+_TERM_TOKENS = 1 + max(len(rest) for rests in ContextValidator.SAFE_TERM_TOKENS.values() for rest in rests)
+# Block size for the prefix / suffix comparison.
+_BLOCK = 256
+
+
+class ContentState(NamedTuple):
+    """What the keyword and context stages found in one version of a text."""
+    version: str  # masterdoc content hash
+    text: str
+    occurrences: Dict[int, List[int]]  # contained keyword id -> ascending starts in text.lower()
+    spans: List[Tuple[int, int]]  # ContextValidator.safe_term_spans(text.lower())
+    tokens: Dict[str, int]  # KeywordMatcher.tokenize(text) -> count
+    token_hits: Dict[str, FrozenSet[int]]  # fuzzy keyword ids, for tokens that have any
+
+    def hits(self) -> Tuple[Set[int], Set[int]]:
+        """KeywordIndex.hits(text): (exact, fuzzy) keyword ids."""
+        exact = set(self.occurrences)
+        return exact, set().union(*self.token_hits.values()) - exact
+
+    def scan(self, validator: ContextValidator, keywords: List[str]) -> ContextScan:
+        """A ContextScan of the text that reuses the stored spans and keyword positions."""
+        return _StoredScan(validator, self, keywords)
+
+
+class _StoredScan(ContextScan):
+    def __init__(self, validator: ContextValidator, state: ContentState, keywords: List[str]):
+        super().__init__(validator, state.text, state.spans)
+        self._positions = {keywords[kid]: positions for kid, positions in state.occurrences.items()}
+
+    def _all_occurrences_safe(self, keyword: str) -> bool:
+        positions = self._positions.get(keyword)
+        if positions is None:
+            return super()._all_occurrences_safe(keyword)
+        return self.positions_safe(keyword, positions)
+
+
+def _all_starts(text: str, keyword: str, start: int, end: int) -> List[int]:
+    """Starts in [start, end) of every occurrence of keyword, overlapping ones included."""
+    starts = []
+    pos = text.find(keyword, start)
+    while pos != -1 and pos < end:
+        starts.append(pos)
+        pos = text.find(keyword, pos + 1)
+    return starts
+
+
+def build(index: KeywordIndex, validator: ContextValidator, version: str, text: str) -> ContentState:
+    """The state of `text` scanned from scratch."""
+    lower = text.lower()
+    occurrences = {kid: _all_starts(lower, index.keywords[kid], 0, len(lower))
+                   for kid in index.automaton.find_all(lower)}
+    tokens = dict(Counter(index.matcher.tokenize(text)))
+    lookups: Dict[str, Set[int]] = {}
+    index.fuzzy_hits(tokens, lookups)
+    token_hits = {token: frozenset(hits) for token, hits in lookups.items() if hits}
+    return ContentState(version, text, occurrences, validator.safe_term_spans(lower), tokens, token_hits)
+
+
+def diff_region(old: str, new: str) -> Tuple[int, int, int]:
+    """
+    (start, old_end, new_end): old[start:old_end] was replaced by
+    new[start:new_end], and everything around it is unchanged.
+    """
+    limit = min(len(old), len(new))
+    start = 0
+    while start + _BLOCK <= limit and old[start:start + _BLOCK] == new[start:start + _BLOCK]:
+        start += _BLOCK
+    while start < limit and old[start] == new[start]:
+        start += 1
+    limit -= start
+    n, m = len(old), len(new)
+    suffix = 0
+    while suffix + _BLOCK <= limit and old[n - suffix - _BLOCK:n - suffix] == new[m - suffix - _BLOCK:m - suffix]:
+        suffix += _BLOCK
+    while suffix < limit and old[n - suffix - 1] == new[m - suffix - 1]:
+        suffix += 1
+    return start, n - suffix, m - suffix
+
+
+def _whitespace_runs(text: str, start: int, end: int) -> Tuple[int, int]:
+    """[start, end) widened to whole whitespace-delimited runs."""
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+    while end < len(text) and not text[end].isspace():
+        end += 1
+    return start, end
+
+
+def _tokens_back(text: str, pos: int, count: int) -> int:
+    """Start of the count-th \\w+ token counting back from the last one starting before pos."""
+    word = _WORD_CHAR.match
+    for _ in range(count):
+        while pos > 0 and not word(text, pos - 1):
+            pos -= 1
+        while pos > 0 and word(text, pos - 1):
+            pos -= 1
+    return pos
+
+
+def _tokens_forward(text: str, pos: int, count: int) -> int:
+    """End of the count-th \\w+ token counting on from the one at pos (or the next one)."""
+    word = _WORD_CHAR.match
+    n = len(text)
+    while pos < n and word(text, pos):
+        pos += 1
+    for _ in range(count - 1):
+        while pos < n and not word(text, pos):
+            pos += 1
+        while pos < n and word(text, pos):
+            pos += 1
+    return pos
+
+
+def update(index: KeywordIndex, validator: ContextValidator, previous: ContentState,
+           text: str) -> Tuple[ContentState, int]:
+    """
+    The state of `text`, derived from the `previous` version's (built
+    against the same index), and how many characters changed.
+    """
+    if text == previous.text:
+        return previous, 0
+    keywords = index.keywords
+
+    # Fuzzy hits: re-tokenize the whitespace-delimited runs the edit touches.
+    start, old_end, new_end = diff_region(previous.text, text)
+    run_start, old_run_end = _whitespace_runs(previous.text, start, old_end)
+    new_run_end = _whitespace_runs(text, start, new_end)[1]
+    tokens = dict(previous.tokens)
+    for token in index.matcher.tokenize(text[run_start:new_run_end]):
+        tokens[token] = tokens.get(token, 0) + 1
+    for token in index.matcher.tokenize(previous.text[run_start:old_run_end]):
+        count = tokens[token] - 1
+        if count:
+            tokens[token] = count
+        else:
+            del tokens[token]
+    token_hits = {token: hits for token, hits in previous.token_hits.items() if token in tokens}
+    lookups: Dict[str, Set[int]] = {}
+    index.fuzzy_hits([token for token in tokens if token not in previous.tokens], lookups)
+    token_hits.update((token, frozenset(hits)) for token, hits in lookups.items() if hits)
+
+    # Keyword positions and safe terms, in the lowercased texts (lowercasing
+    # can change lengths, so they are diffed separately).
+    old_lower, lower = previous.text.lower(), text.lower()
+    start, old_end, new_end = diff_region(old_lower, lower)
+    shift = new_end - old_end
+    occurrences = {}
+    for kid, positions in previous.occurrences.items():
+        # Occurrences entirely before or entirely after the edit are unchanged.
+        before = bisect_right(positions, start - len(keywords[kid]))
+        after = bisect_left(positions, old_end)
+        tail = positions[after:]
+        if shift:
+            tail = [pos + shift for pos in tail]
+        kept = positions[:before] + tail
+        if kept:
+            occurrences[kid] = kept
+    longest = index.max_keyword_length
+    window = lower[max(0, start - longest + 1):new_end + longest - 1]
+    for kid in index.automaton.find_all(window):
+        keyword = keywords[kid]
+        # Occurrences that overlap the edit (or join text across a deletion).
+        found = _all_starts(lower, keyword, max(0, start - len(keyword) + 1), new_end)
+        if found:
+            kept = occurrences.get(kid, [])
+            split = bisect_left(kept, found[0])
+            occurrences[kid] = kept[:split] + found + kept[split:]
+
+    spans = [span for span in previous.spans if span[1] < start]
+    spans += [(span_start + shift, span_end + shift) for span_start, span_end in previous.spans
+              if span_start > old_end]
+    scan_start = _tokens_back(lower, start, _TERM_TOKENS)
+    scan_end = _tokens_forward(lower, new_end, _TERM_TOKENS)
+    spans += [span for span in validator.safe_term_spans(lower, scan_start, scan_end)
+              if span[1] >= start and span[0] <= new_end]
+    spans.sort()
+    return ContentState(previous.version, text, occurrences, spans, tokens, token_hits), new_end - start
+
+
+def _approximate_size(state: ContentState) -> int:
+    return (len(state.text) + 8 * sum(len(positions) for positions in state.occurrences.values())
+            + 64 * len(state.spans) + 96 * len(state.tokens) + 160 * len(state.token_hits) + 256)
+
+
+class ContentStore:
+    """Per-content_id ContentState storage; subclasses implement get and put."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0  # a state for the current masterdoc was found
+        self.misses = 0
+        self.characters = 0  # of texts analyzed incrementally
+        self.changed_characters = 0
+
+    def get(self, content_id: str) -> Optional[ContentState]:
+        raise NotImplementedError
+
+    def put(self, content_id: str, state: ContentState):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def reopen(self):
+        """Opens new connections after close(), e.g. in a forked worker (see prefork.py)."""
+
+    def refresh(self, content_id: str, text: str, version: str, index: KeywordIndex,
+                validator: ContextValidator) -> ContentState:
+        """The state of `text`, updated from the stored version when there is one, and stored."""
+        previous = self.get(content_id)
+        if previous is not None and previous.version == version:
+            state, changed = update(index, validator, previous, text)
+            with self._lock:
+                self.hits += 1
+                self.characters += len(text)
+                self.changed_characters += changed
+        else:
+            state = build(index, validator, version, text)
+            with self._lock:
+                self.misses += 1
+        if state is not previous:
+            self.put(content_id, state)
+        return state
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "changed_share": round(self.changed_characters / self.characters, 4) if self.characters else 0.0,
+            }
+
+
+class MemoryContentStore(ContentStore):
+    def __init__(self, max_entries: int = CONTENT_STORE_MAX_ENTRIES, max_bytes: int = CONTENT_STORE_MAX_BYTES):
+        super().__init__()
+        self._cache = LRUCache(max_entries, max_bytes=max_bytes, size_fn=_approximate_size)
+
+    def get(self, content_id: str) -> Optional[ContentState]:
+        return self._cache.get(content_id)
+
+    def put(self, content_id: str, state: ContentState):
+        self._cache.put(content_id, state)
+
+    def stats(self) -> dict:
+        cache = self._cache.stats()
+        return dict(super().stats(), backend="memory", entries=cache["entries"], bytes=cache["bytes"],
+                    evictions=cache["evictions"])
+
+
+class SQLiteContentStore(ContentStore):
+    """
+    States pickled into a SQLite table. Every process opens its own
+    connection; writes are serialized by SQLite. When more than max_entries
+    rows are counted, the least recently written ones are deleted (every
+    analysis writes its content's row, so that is least recently used).
+    """
+
+    def __init__(self, path: str, max_entries: int = CONTENT_STORE_MAX_ENTRIES):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        self.reopen()
+
+    def reopen(self):
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS content_state ("
+                           "content_id TEXT PRIMARY KEY, version TEXT NOT NULL, state BLOB NOT NULL, "
+                           "written REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS content_state_written ON content_state (written)")
+        self._rows = self._count()
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM content_state").fetchone()[0]
+
+    def get(self, content_id: str) -> Optional[ContentState]:
+        with self._db_lock:
+            row = self._conn.execute("SELECT state FROM content_state WHERE content_id = ?", (content_id,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return pickle.loads(row[0])
+        except Exception as e:
+            # e.g. written by an incompatible version: analyze from scratch.
+            logger.warning(f"Discarding unreadable content state for {content_id!r}: {e}")
+            return None
+
+    def put(self, content_id: str, state: ContentState):
+        blob = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._db_lock:
+            self._conn.execute("INSERT OR REPLACE INTO content_state VALUES (?, ?, ?, ?)",
+                               (content_id, state.version, blob, time.time()))
+            # Replacements also count here; the real count is taken before evicting.
+            self._rows += 1
+            if self._rows > self.max_entries:
+                self._rows = self._count()
+                excess = self._rows - self.max_entries
+                if excess > 0:
+                    self._conn.execute("DELETE FROM content_state WHERE content_id IN "
+                                       "(SELECT content_id FROM content_state ORDER BY written LIMIT ?)", (excess,))
+                    self._rows -= excess
+                    self.evictions += excess
+
+    def stats(self) -> dict:
+        with self._db_lock:
+            rows = self._count()
+        return dict(super().stats(), backend="sqlite", path=self.path, entries=rows, evictions=self.evictions)
+
+    def close(self):
+        with self._db_lock:
+            self._conn.close()
+
+
+def create_content_store(spec: str) -> Optional[ContentStore]:
+    """'' -> None, 'memory' -> MemoryContentStore, 'sqlite:<path>' -> SQLiteContentStore."""
+    if not spec:
+        return None
+    if spec == "memory":
+        return MemoryContentStore()
+    if spec.startswith("sqlite:"):
+        return SQLiteContentStore(spec[len("sqlite:"):])
+    raise ValueError(f"Unknown content store: {spec!r}")
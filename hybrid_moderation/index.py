@@ -0,0 +1,425 @@
+from array import array
+from collections import Counter, deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from .config import NEUTRAL_IDENTITY_TERMS, PREFILTER_ENABLED
+from .matcher import KeywordMatcher
+from .models import ModerationCategory
+from .prefilter import TypoPrefilter
+
+# Field selectors for keyword postings.
+CATEGORY_FIELD = 0
+SUBCATEGORY_FIELD = 1
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring automaton.
+    One pass over the text reports every pattern that occurs in it, which is
+    equivalent to running `pattern in text` for each pattern.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = patterns
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+
+        for pid, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] = self._out[state] + (pid,)
+
+        # Breadth-first failure links; outputs are merged along the links so
+        # the scan never has to follow them.
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                if self._out[self._fail[nxt]]:
+                    self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text: str) -> Set[int]:
+        """Returns the ids of all patterns contained in `text`."""
+        goto, fail, out = self._goto, self._fail, self._out
+        found: Set[int] = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class DFAAutomaton:
+    """
+    Aho-Corasick automaton flattened into a dense transition table.
+
+    Failure links are resolved ahead of time, so the scan is a single table
+    lookup per character. States are numbered so that every state with an
+    output comes after all states without one, and transitions store the
+    target's row offset (state * alphabet size), which keeps the per-character
+    work to one lookup and one comparison. The tables are flat integer
+    sequences (array.array when compiled, memoryviews over an mmap'd file
+    when loaded, see snapshot.py), so processes loading the same snapshot
+    share them. `find_all` returns the same ids as `AhoCorasick.find_all`.
+    """
+
+    def __init__(self, alphabet: str, delta: Sequence[int], first_output_state: int,
+                 out_offsets: Sequence[int], out: Sequence[int]):
+        self.alphabet = alphabet
+        self._columns = {ch: i for i, ch in enumerate(alphabet)}
+        # delta[row + column] -> row of the next state, where row = state * len(alphabet)
+        self.delta = delta
+        self.first_output_state = first_output_state
+        # out[out_offsets[i]:out_offsets[i + 1]] -> pattern ids of state first_output_state + i
+        self.out_offsets = out_offsets
+        self.out = out
+
+    @classmethod
+    def from_aho_corasick(cls, automaton: AhoCorasick) -> "DFAAutomaton":
+        goto, fail, outputs = automaton._goto, automaton._fail, automaton._out
+        alphabet = "".join(sorted({ch for edges in goto for ch in edges}))
+        width = len(alphabet)
+
+        # Root stays 0; states without outputs first, then states with outputs.
+        order = sorted(range(len(goto)), key=lambda s: (bool(outputs[s]), s))
+        number = [0] * len(goto)
+        for new, old in enumerate(order):
+            number[old] = new
+        first_output_state = sum(1 for pids in outputs if not pids)
+
+        # Resolve transitions breadth-first so a state's failure target is done first.
+        rows: List[List[int]] = [[]] * len(goto)
+        rows[0] = [goto[0].get(ch, 0) for ch in alphabet]
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            fallback = rows[fail[state]]
+            rows[state] = [goto[state].get(ch, fallback[column]) for column, ch in enumerate(alphabet)]
+            queue.extend(goto[state].values())
+
+        delta = array("I")
+        for old in order:
+            delta.extend(number[nxt] * width for nxt in rows[old])
+        out_offsets = array("I", [0])
+        out = array("I")
+        for old in order[first_output_state:]:
+            out.extend(outputs[old])
+            out_offsets.append(len(out))
+        return cls(alphabet, delta, first_output_state, out_offsets, out)
+
+    def find_all(self, text: str) -> Set[int]:
+        """Returns the ids of all patterns contained in `text`."""
+        columns, delta = self._columns, self.delta
+        width = len(self.alphabet)
+        first_output_row = self.first_output_state * width
+        hit_rows = set()
+        row = 0
+        for ch in text:
+            column = columns.get(ch)
+            if column is None:
+                # No pattern contains this character: every state falls back to the root.
+                row = 0
+                continue
+            row = delta[row + column]
+            if row >= first_output_row:
+                hit_rows.add(row)
+
+        found: Set[int] = set()
+        out_offsets, out = self.out_offsets, self.out
+        for row in hit_rows:
+            i = row // width - self.first_output_state
+            found.update(out[out_offsets[i]:out_offsets[i + 1]])
+        return found
+
+
+class FuzzyIndex:
+    """
+    Typo lookup over single-word keywords.
+
+    Returns exactly the keywords `k` with `KeywordMatcher.is_fuzzy_match(k, token)`,
+    but only runs SequenceMatcher on candidates that survive two filters which
+    can never reject a real match:
+
+    - length: ratio = 2M / (la + lb) and M <= min(la, lb);
+    - shared bigrams: the M matched characters form k non-adjacent blocks with
+      k <= (la - M) + (lb - M) + 1, and a block of size s shares s - 1 bigrams,
+      so the strings share at least 3M - (la + lb) - 1 bigrams.
+    """
+
+    def __init__(self, keywords: List[str], matcher: KeywordMatcher,
+                 tables: Optional[Tuple[Dict[int, Sequence[int]], Dict[str, Sequence[int]]]] = None):
+        self.keywords = keywords
+        self.matcher = matcher
+        # keyword length -> keyword ids; bigram -> flat (keyword id, count) pairs.
+        # Prebuilt tables (from a snapshot) may hold memoryviews instead of lists.
+        self._by_length, self._bigrams = tables or self.build_tables(keywords)
+        self._plans: Dict[int, List[Tuple[int, int]]] = {}
+
+    @classmethod
+    def build_tables(cls, keywords: List[str]) -> Tuple[Dict[int, List[int]], Dict[str, List[int]]]:
+        by_length: Dict[int, List[int]] = {}
+        bigrams: Dict[str, List[int]] = {}
+        for kid, kw in enumerate(keywords):
+            by_length.setdefault(len(kw), []).append(kid)
+            for gram, count in Counter(cls._grams(kw)).items():
+                bigrams.setdefault(gram, []).extend((kid, count))
+        return by_length, bigrams
+
+    @staticmethod
+    def _grams(word: str) -> List[str]:
+        return [word[i:i + 2] for i in range(len(word) - 1)]
+
+    @staticmethod
+    def _min_matches(total_length: int) -> int:
+        # Smallest M with 2M / total_length > 0.85 (exact integer arithmetic).
+        return 17 * total_length // 40 + 1
+
+    def _plan(self, token_length: int) -> List[Tuple[int, int]]:
+        """[(keyword length, minimum shared bigrams)] that can match a token of this length."""
+        plan = self._plans.get(token_length)
+        if plan is None:
+            plan = []
+            for length in self._by_length:
+                total = length + token_length
+                min_matches = self._min_matches(total)
+                if min(length, token_length) >= min_matches:
+                    plan.append((length, 3 * min_matches - total - 1))
+            self._plans[token_length] = plan
+        return plan
+
+    def lookup(self, token: str) -> Set[int]:
+        """Ids of keywords that fuzzily match `token`."""
+        plan = self._plan(len(token))
+        if not plan:
+            return set()
+
+        shared: Dict[int, int] = {}
+        for gram, count in Counter(self._grams(token)).items():
+            pairs = iter(self._bigrams.get(gram, ()))
+            for kid, kw_count in zip(pairs, pairs):
+                shared[kid] = shared.get(kid, 0) + min(count, kw_count)
+
+        hits = set()
+        keywords, is_fuzzy_match = self.keywords, self.matcher.is_fuzzy_match
+        for length, min_shared in plan:
+            if min_shared <= 0:
+                candidates = self._by_length[length]
+            else:
+                candidates = [kid for kid in self._by_length[length] if shared.get(kid, 0) >= min_shared]
+            for kid in candidates:
+                if is_fuzzy_match(keywords[kid], token):
+                    hits.add(kid)
+        return hits
+
+
+class PackedPostings:
+    """
+    Read-only keyword postings stored as flat (row, field, multiplicity)
+    triples, with the triples of keyword `kid` at offsets[kid]..offsets[kid + 1].
+    Indexing yields the same tuples as KeywordIndex's list-of-lists postings.
+    """
+
+    def __init__(self, offsets: Sequence[int], triples: Sequence[int]):
+        self.offsets = offsets
+        self.triples = triples
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, kid: int) -> List[Tuple[int, int, int]]:
+        flat = self.triples[3 * self.offsets[kid]:3 * self.offsets[kid + 1]]
+        return list(zip(flat[0::3], flat[1::3], flat[2::3]))
+
+
+class PrebuiltIndex(NamedTuple):
+    """KeywordIndex tables loaded from a compiled snapshot instead of built from rows."""
+    keywords: List[str]
+    postings: Sequence[Sequence[Tuple[int, int, int]]]
+    automaton: DFAAutomaton
+    fuzzy_tables: Tuple[Dict[int, Sequence[int]], Dict[str, Sequence[int]]]
+
+
+class KeywordIndex:
+    """
+    Keyword index over every category and subcategory keyword list.
+
+    Built once from the loaded categories. `match` scans the text a single
+    time and returns, per row, the same (score, matched_keywords) pairs that
+    `KeywordMatcher.calculate_match_confidence` would produce for the row's
+    category and subcategory keyword lists.
+
+    When rebuilding after a masterdoc edit, pass the `previous` index. If
+    rows were edited in place, only the rows whose keyword lists changed are
+    re-indexed, and the automaton and fuzzy tables are reused unless a new
+    keyword appeared. Keywords no longer used by any row are left without
+    postings, which does not change any score.
+
+    With PREFILTER_ENABLED, tokens go through a TypoPrefilter before the
+    fuzzy lookup, so a clean text costs one automaton pass plus a few Bloom
+    probes per token.
+    """
+
+    def __init__(self, categories: List[ModerationCategory], matcher: KeywordMatcher = None,
+                 prebuilt: Optional[PrebuiltIndex] = None, previous: Optional["KeywordIndex"] = None):
+        self.matcher = matcher or KeywordMatcher()
+        self.categories = categories
+        if prebuilt is not None:
+            # Compiled from these same rows (see snapshot.py).
+            self.keywords = prebuilt.keywords
+            self.single_word = [' ' not in kw for kw in self.keywords]
+            self.postings = prebuilt.postings
+            self.automaton = prebuilt.automaton
+        else:
+            if previous is None or not self._patch_postings(previous, categories):
+                self._build_postings(categories)
+            if previous is not None and previous.keywords == self.keywords:
+                self.automaton = previous.automaton
+            else:
+                self.automaton = AhoCorasick(self.keywords)
+        self.single_word_ids = [kid for kid, single in enumerate(self.single_word) if single]
+        self.max_keyword_length = max(map(len, self.keywords), default=0)
+        single_words = [self.keywords[kid] for kid in self.single_word_ids]
+        if prebuilt is None and previous is not None and previous.fuzzy_index.keywords == single_words:
+            self.fuzzy_index, self.prefilter = previous.fuzzy_index, previous.prefilter
+        else:
+            self.fuzzy_index = FuzzyIndex(single_words, self.matcher,
+                                          prebuilt.fuzzy_tables if prebuilt is not None else None)
+            self.prefilter = TypoPrefilter(single_words) if PREFILTER_ENABLED else None
+
+    def _build_postings(self, categories: List[ModerationCategory]):
+        self.keywords: List[str] = []
+        self.single_word: List[bool] = []
+        # keyword id -> [(row index, field, multiplicity)]
+        self.postings: List[List[Tuple[int, int, int]]] = []
+
+        keyword_ids: Dict[str, int] = {}
+        for row, cat in enumerate(categories):
+            self._index_row(row, cat, keyword_ids)
+
+    def _index_row(self, row: int, cat: ModerationCategory, keyword_ids: Dict[str, int]):
+        for field, keywords in ((CATEGORY_FIELD, cat.category_keywords),
+                                (SUBCATEGORY_FIELD, cat.subcategory_keywords)):
+            counts: Dict[int, int] = {}
+            for kw in keywords:
+                if not kw or kw.lower() in NEUTRAL_IDENTITY_TERMS:
+                    continue
+                kid = keyword_ids.get(kw)
+                if kid is None:
+                    kid = len(self.keywords)
+                    keyword_ids[kw] = kid
+                    self.keywords.append(kw)
+                    self.single_word.append(' ' not in kw)
+                    self.postings.append([])
+                counts[kid] = counts.get(kid, 0) + 1
+            for kid, count in counts.items():
+                self.postings[kid].append((row, field, count))
+
+    def _patch_postings(self, previous: "KeywordIndex", categories: List[ModerationCategory]) -> bool:
+        """
+        Derives the postings from `previous`, re-indexing only rows whose
+        keyword lists changed. Returns False (nothing done) unless the row
+        count is unchanged and `previous` was built from rows, not a snapshot.
+        """
+        old = previous.categories
+        if len(old) != len(categories) or not isinstance(previous.postings, list):
+            return False
+        changed = [row for row, (before, after) in enumerate(zip(old, categories))
+                   if before.category_keywords != after.category_keywords
+                   or before.subcategory_keywords != after.subcategory_keywords]
+        if not changed:
+            self.keywords, self.single_word, self.postings = previous.keywords, previous.single_word, previous.postings
+            return True
+
+        # Copy-on-write: previous keeps serving while this index is built.
+        self.keywords, self.single_word = list(previous.keywords), list(previous.single_word)
+        self.postings = list(previous.postings)
+        keyword_ids = {kw: kid for kid, kw in enumerate(self.keywords)}
+        rows = set(changed)
+        stale = {keyword_ids[kw] for row in changed
+                 for kw in old[row].category_keywords + old[row].subcategory_keywords if kw in keyword_ids}
+        for kid in stale:
+            self.postings[kid] = [posting for posting in self.postings[kid] if posting[0] not in rows]
+        # Lists the changed rows append to are copied too (stale ones already are).
+        added = {keyword_ids[kw] for row in changed
+                 for kw in categories[row].category_keywords + categories[row].subcategory_keywords
+                 if kw in keyword_ids} - stale
+        for kid in added:
+            self.postings[kid] = list(self.postings[kid])
+        for row in changed:
+            self._index_row(row, categories[row], keyword_ids)
+        return True
+
+    def exact_hits(self, text: str) -> Set[int]:
+        """Ids of keywords contained in the text (case-insensitive)."""
+        return self.automaton.find_all(text.lower())
+
+    def fuzzy_hits(self, tokens: Iterable[str], cache: Optional[Dict[str, Set[int]]] = None) -> Set[int]:
+        """
+        Ids of single-word keywords that fuzzily match any of the tokens.
+        `cache` maps token -> hits and can be shared by callers that look up
+        many texts (or many keyword lists) at once.
+        """
+        if cache is None:
+            cache = {}
+        hits: Set[int] = set()
+        prefilter = self.prefilter
+        for token in tokens:
+            token_hits = cache.get(token)
+            if token_hits is None:
+                if prefilter is not None and not prefilter.may_match(token):
+                    token_hits = set()
+                else:
+                    token_hits = {self.single_word_ids[fid] for fid in self.fuzzy_index.lookup(token)}
+                cache[token] = token_hits
+            hits |= token_hits
+        return hits
+
+    def match(self, text: str, fuzzy_cache: Optional[Dict[str, Set[int]]] = None) -> Dict[int, Tuple[Tuple[float, List[str]], Tuple[float, List[str]]]]:
+        """
+        Returns {row index: ((cat_score, cat_matches), (sub_score, sub_matches))}
+        for every row with at least one matching keyword.
+        """
+        return self.row_scores(*self.hits(text, fuzzy_cache))
+
+    def hits(self, text: str, fuzzy_cache: Optional[Dict[str, Set[int]]] = None) -> Tuple[Set[int], Set[int]]:
+        """(exact, fuzzy) keyword ids for the text; the fuzzy ones are not contained in it."""
+        exact = self.exact_hits(text)
+        # Exact containment takes precedence over a typo match of the same keyword.
+        return exact, self.fuzzy_hits(self.matcher.tokenize(text), fuzzy_cache) - exact
+
+    def row_scores(self, exact: Set[int], fuzzy: Set[int]) -> Dict[int, Tuple[Tuple[float, List[str]], Tuple[float, List[str]]]]:
+        """match()'s result for a text with these exact and fuzzy keyword hits."""
+        counts: Dict[Tuple[int, int], int] = {}
+        matches: Dict[Tuple[int, int], List[str]] = {}
+        for hits, weight in ((exact, 3), (fuzzy, 1)):
+            for kid in hits:
+                kw = self.keywords[kid]
+                for row, field, multiplicity in self.postings[kid]:
+                    key = (row, field)
+                    counts[key] = counts.get(key, 0) + weight * multiplicity
+                    matches.setdefault(key, []).append(kw)
+
+        no_match = (0.0, [])
+        results = {}
+        for (row, field), match_count in counts.items():
+            entry = results.setdefault(row, [no_match, no_match])
+            entry[field] = (self.matcher.score(match_count), matches[(row, field)])
+        return {row: tuple(entry) for row, entry in results.items()}
@@ -1,7 +1,8 @@
 
 import csv
+import hashlib
+import io
 import logging
-import sys
 from typing import List
 from .models import ModerationCategory, AgeRestrictionRules
 
@@ -11,13 +12,19 @@ class CSVLoader:
     def __init__(self, file_path: str):
         self.file_path = file_path
         self.categories: List[ModerationCategory] = []
+        self.content_hash = ""
 
     def load_data(self) -> List[ModerationCategory]:
         """Loads and parses the CSV file into ModerationCategory objects."""
         self.categories = []
         try:
-            print(f"[HybridMod] Loading CSV data from {self.file_path}...", file=sys.stderr)
-            with open(self.file_path, mode='r', encoding='utf-8', errors='replace') as csvfile:
+            logger.info(f"Loading CSV data from {self.file_path}...")
+            # One read: the hash describes exactly the bytes parsed, even if
+            # the file is replaced meanwhile.
+            with open(self.file_path, mode='rb') as raw:
+                data = raw.read()
+            self.content_hash = hashlib.sha256(data).hexdigest()
+            with io.StringIO(data.decode('utf-8', errors='replace'), newline=None) as csvfile:
                 reader = csv.DictReader(csvfile)
                 
                 last_category = ""
@@ -72,11 +79,11 @@ class CSVLoader:
                         subcategory=subcategory,
                         category_keywords=cat_keywords,
                         subcategory_keywords=sub_keywords,
-                        age_rules=age_rules
+                        age_rules=age_rules,
+                        description=(row.get('Description', '') or "").strip()
                     )
                     self.categories.append(category_obj)
             
-            print(f"[HybridMod] ✅ Successfully loaded {len(self.categories)} categories.", file=sys.stderr)
             logger.info(f"Loaded {len(self.categories)} categories from {self.file_path}")
             return self.categories
 
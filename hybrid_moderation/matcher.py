@@ -43,8 +43,7 @@ class KeywordMatcher:
             # Only if keyword is single word
             if ' ' not in kw:
                 for token in tokens:
-                    ratio = difflib.SequenceMatcher(None, kw, token).ratio()
-                    if ratio > 0.85: # Threshold for typo tolerance
+                    if self.is_fuzzy_match(kw, token):
                         matches.append(kw)
                         match_count += 1
                         break
@@ -52,9 +51,14 @@ class KeywordMatcher:
         if not matches:
             return 0.0, []
 
+        return self.score(match_count), list(set(matches))
+
+    def is_fuzzy_match(self, keyword: str, token: str) -> bool:
+        """Typo-tolerant comparison of a single-word keyword against a token."""
+        return difflib.SequenceMatcher(None, keyword, token).ratio() > 0.85 # Threshold for typo tolerance
+
+    def score(self, match_count: int) -> float:
         # Simple density/frequency scoring
         # Cap at 1.0
         # If we have at least 1 strong match (phrase) or 3 word matches, high confidence
-        score = min(1.0, match_count * 0.35) 
-        
-        return score, list(set(matches))
+        return min(1.0, match_count * 0.35)
@@ -0,0 +1,168 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Every thread writes to its own shard (a plain dict reached through
+threading.local), so recording a sample takes no lock and never contends with
+other request threads. Shards are only merged when /metrics is scraped. Values
+are per process; with several workers each one reports its own series.
+"""
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Latency buckets in seconds: 10us .. 10s, roughly 2.5x apart.
+DEFAULT_LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _snapshot(self) -> List[dict]:
+        with self._lock:
+            return [dict(shard) for shard in self._shards]
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.collect())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def values(self) -> Dict[LabelValues, float]:
+        totals: Dict[LabelValues, float] = {}
+        for shard in self._snapshot():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def collect(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+                for labels, value in sorted(self.values().items())]
+
+
+class Histogram(_Metric):
+    """
+    Histogram observed in native units and exposed in base units: by default
+    durations are recorded in nanoseconds (perf_counter_ns) and exposed in seconds.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS, unit_scale: float = 1e-9):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        self.unit_scale = unit_scale
+        self._bounds = [b / unit_scale for b in self.buckets]
+
+    def observe(self, value: float, *labelvalues: str):
+        """Records one sample, in the histogram's native unit (ns for latencies)."""
+        shard = self._shard()
+        counts = shard.get(labelvalues)
+        if counts is None:
+            # One slot per bucket, +Inf, then the running sum.
+            counts = shard[labelvalues] = [0] * (len(self._bounds) + 2)
+        counts[bisect_left(self._bounds, value)] += 1
+        counts[-1] += value
+
+    def values(self) -> Dict[LabelValues, List[float]]:
+        totals: Dict[LabelValues, List[float]] = {}
+        for shard in self._snapshot():
+            for labels, counts in shard.items():
+                total = totals.setdefault(labels, [0] * len(counts))
+                for i, value in enumerate(counts):
+                    total[i] += value
+        return totals
+
+    def collect(self) -> List[str]:
+        lines = []
+        for labels, counts in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {counts[-1] * self.unit_scale:.9f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), **kwargs) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, **kwargs))
+
+    def render(self, exclude: Sequence[_Metric] = ()) -> str:
+        """All metrics but `exclude` in Prometheus text exposition format (version 0.0.4)."""
+        return "\n".join(metric.render() for metric in self._metrics if metric not in exclude) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "moderation_stage_seconds", "Latency of each moderation pipeline stage.", ("stage",))
+DECISIONS = REGISTRY.counter(
+    "moderation_decisions_total", "Final moderation decisions.", ("decision",))
+MATCHED_CATEGORIES = REGISTRY.counter(
+    "moderation_matched_category_total", "Best CSV category of analyzed texts.", ("category",))
+CACHE_LOOKUPS = REGISTRY.counter(
+    "moderation_cache_lookups_total", "Result and analysis cache lookups.", ("cache", "result"))
+MASTERDOC_RELOADS = REGISTRY.counter(
+    "moderation_masterdoc_reloads_total", "Masterdoc reload attempts.", ("result",))
+
+# Recorded by the process that analyzes the texts (a pool worker in the
+# 'process' serving mode, see serving.py).
+ANALYSIS_METRICS = (STAGE_SECONDS, DECISIONS, MATCHED_CATEGORIES, CACHE_LOOKUPS)
@@ -0,0 +1,131 @@
+"""
+Typo prefilter: proves that a token cannot fuzzily match any keyword.
+
+`KeywordMatcher.is_fuzzy_match(k, t)` needs SequenceMatcher's ratio
+2M / (la + lb) > 0.85. M (the matched characters) is at most the longest
+common subsequence, so a match implies a common subsequence of length
+M_min = FuzzyIndex._min_matches(la + lb). That subsequence is reached from
+the keyword by la - M_min deletions and from the token by lb - M_min
+deletions.
+
+At load time every keyword's deletion neighbourhood (itself plus all strings
+with up to d deletions, d the most any token length can need) goes into a
+Bloom filter. A token is then screened by probing its own deletion
+neighbourhood: if no variant is in the filter, no keyword can match it. The
+filter only produces false positives (at the configured rate), which fall
+through to the exact FuzzyIndex lookup.
+
+Tokens whose neighbourhood would exceed PREFILTER_MAX_DELETIONS deletions
+(long tokens) are never screened out.
+"""
+import math
+from typing import Dict, Iterable, List, Set
+
+import numpy as np
+
+from .config import PREFILTER_FALSE_POSITIVE_RATE, PREFILTER_MAX_DELETIONS
+
+
+def min_matches(total_length: int) -> int:
+    # Smallest M with 2M / total_length > 0.85, as in FuzzyIndex.
+    return 17 * total_length // 40 + 1
+
+
+def deletions(word: str, depth: int) -> Set[str]:
+    """`word` and every string obtained from it by deleting up to `depth` characters."""
+    result = {word}
+    frontier = result
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        result |= frontier
+    return result
+
+
+class BloomFilter:
+    """
+    Bit array with k probes per item (double hashing over Python's string
+    hash). Hashes are salted per process, so a filter is only valid in the
+    process that built it; it is cheap enough to build at load time.
+    """
+
+    def __init__(self, items: Iterable[str], false_positive_rate: float = PREFILTER_FALSE_POSITIVE_RATE):
+        if not 0.0 < false_positive_rate < 1.0:
+            raise ValueError(f"false_positive_rate must be in (0, 1), got {false_positive_rate}")
+        hashes = np.fromiter((hash(item) for item in items), dtype=np.int64)
+        count = max(len(hashes), 1)
+        self.false_positive_rate = false_positive_rate
+        self.size = max(64, math.ceil(-count * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.probes = max(1, round(self.size / count * math.log(2)))
+
+        bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        h1, h2 = self._split(hashes.view(np.uint64))
+        for i in range(self.probes):
+            positions = (h1 + np.uint64(i) * h2) % np.uint64(self.size)
+            np.bitwise_or.at(bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+        self.bits = bits.tobytes()
+        self.items = len(hashes)
+
+    @staticmethod
+    def _split(hashes):
+        return hashes & np.uint64(0xFFFFFFFF), (hashes >> np.uint64(32)) | np.uint64(1)
+
+    def __contains__(self, item: str) -> bool:
+        h = hash(item) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        bits, size = self.bits, self.size
+        for i in range(self.probes):
+            position = (h1 + i * h2) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.bits)
+
+
+class TypoPrefilter:
+    """Deletion-neighbourhood Bloom filter over the single-word keywords of a KeywordIndex."""
+
+    def __init__(self, keywords: List[str], false_positive_rate: float = PREFILTER_FALSE_POSITIVE_RATE,
+                 max_deletions: int = PREFILTER_MAX_DELETIONS):
+        lengths = {len(kw) for kw in keywords}
+        # Token length -> deletions to probe; -1 = no keyword length can match,
+        # missing = too many deletions, always passed on to the lookup.
+        self.depths: Dict[int, int] = {}
+        longest = max(lengths, default=0)
+        for token_length in range(1, 2 * longest + 2):
+            needed = [token_length - min_matches(length + token_length) for length in lengths
+                      if min(length, token_length) >= min_matches(length + token_length)]
+            depth = max(needed, default=-1)
+            if depth <= max_deletions:
+                self.depths[token_length] = depth
+        self.max_length = 2 * longest + 1
+
+        # Keyword side: only the deletions needed against screened token lengths.
+        keyword_depths = {length: max([length - min_matches(length + token_length)
+                                       for token_length, depth in self.depths.items()
+                                       if depth >= 0 and min(length, token_length) >= min_matches(length + token_length)],
+                                      default=-1)
+                          for length in lengths}
+        variants = set()
+        for kw in keywords:
+            depth = keyword_depths[len(kw)]
+            if depth >= 0:
+                variants |= deletions(kw, depth)
+        self.bloom = BloomFilter(variants, false_positive_rate)
+
+    def may_match(self, token: str) -> bool:
+        """False only if no keyword can fuzzily match `token`."""
+        length = len(token)
+        if length > self.max_length:
+            return False
+        depth = self.depths.get(length)
+        if depth is None:
+            return True
+        if depth < 0:
+            return False
+        bloom = self.bloom
+        if depth == 0:
+            return token in bloom
+        return any(variant in bloom for variant in deletions(token, depth))
@@ -0,0 +1,383 @@
+"""
+Preforking production server.
+
+`uvicorn --workers N` starts N fresh interpreters that each import main.py
+and run initialize(), so startup takes N times the masterdoc load and every
+worker holds private copies of the categories and indexes. Here the master
+imports the app once (loading and indexing the masterdoc), moves everything
+it allocated into the GC's permanent generation with gc.freeze(), so the
+collector never writes to those objects' pages, and forks the workers. They
+share the pages copy-on-write and serve the master's listening socket with
+uvicorn:
+
+    python -m hybrid_moderation.prefork main:app --host 0.0.0.0 --port 8000 --workers 4
+
+Supervision: workers write a heartbeat into shared memory from their event
+loops. One that stops beating for PREFORK_HEARTBEAT_TIMEOUT_SECONDS, is not
+serving within PREFORK_STARTUP_TIMEOUT_SECONDS or exits is replaced
+(waiting PREFORK_RESPAWN_DELAY_SECONDS after a failure).
+
+Signals to the master:
+  SIGHUP           reload the masterdoc in the master if it changed, then
+                   restart the workers one at a time: each replacement serves
+                   before an old worker is asked to stop, so capacity never
+                   drops. Unchanged or failed reloads keep the current workers.
+  SIGUSR1          the same, reloading and restarting even if the masterdoc
+                   did not change (POST /admin/reload?force=true).
+  SIGTERM, SIGINT  graceful shutdown: workers finish in-flight requests for
+                   up to PREFORK_GRACEFUL_TIMEOUT_SECONDS. A second signal
+                   kills them.
+
+With MODERATION_RELOAD_WATCH set, the master polls the masterdoc and does the
+SIGHUP reload; workers do not watch it themselves, and POST /admin/reload
+forwards to the master. Metrics and caches are per worker.
+Only the 'thread' serving mode is supported (a process pool per worker would
+defeat the sharing).
+"""
+import argparse
+import asyncio
+import gc
+import importlib
+import logging
+import mmap
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from .config import (
+    PREFORK_GRACEFUL_TIMEOUT_SECONDS, PREFORK_HEARTBEAT_INTERVAL_SECONDS, PREFORK_HEARTBEAT_TIMEOUT_SECONDS,
+    PREFORK_RESPAWN_DELAY_SECONDS, PREFORK_STARTUP_TIMEOUT_SECONDS, PREFORK_WORKERS, RELOAD_WATCH_INTERVAL_SECONDS,
+    SERVING_MODE
+)
+from .core import ContentModerationSystem
+from .reload import MasterdocWatcher
+from .tracing import configure_tracing, shutdown_tracing
+
+logger = logging.getLogger(__name__)
+
+_BEAT = struct.Struct("d")
+_HANDLED_SIGNALS = (signal.SIGHUP, signal.SIGUSR1, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD)
+# Exit status of a worker whose app failed to start (as uvicorn's CLI).
+STARTUP_FAILURE = 3
+
+
+@dataclass
+class Worker:
+    pid: int
+    slot: int  # heartbeat slot in the shared memory
+    generation: int
+    started: float
+    ready: bool = False
+    retire_at: Optional[float] = None  # deadline once asked to stop
+    killed: bool = False
+
+
+class PreforkServer:
+    def __init__(self, app, cms: ContentModerationSystem, host: str = "127.0.0.1", port: int = 8000,
+                 workers: int = PREFORK_WORKERS, reload_interval: float = RELOAD_WATCH_INTERVAL_SECONDS,
+                 heartbeat_interval: float = PREFORK_HEARTBEAT_INTERVAL_SECONDS,
+                 heartbeat_timeout: float = PREFORK_HEARTBEAT_TIMEOUT_SECONDS,
+                 startup_timeout: float = PREFORK_STARTUP_TIMEOUT_SECONDS,
+                 graceful_timeout: float = PREFORK_GRACEFUL_TIMEOUT_SECONDS,
+                 respawn_delay: float = PREFORK_RESPAWN_DELAY_SECONDS, **uvicorn_options):
+        self.app = app
+        self.cms = cms
+        self.host = host
+        self.port = port
+        self.count = workers or os.cpu_count() or 1
+        self.reload_interval = reload_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.graceful_timeout = graceful_timeout
+        self.respawn_delay = respawn_delay
+        self.uvicorn_options = uvicorn_options
+        self.workers: Dict[int, Worker] = {}
+        self.generation = 0
+        self.pid = os.getpid()
+        self._socket: Optional[socket.socket] = None
+        # One slot per worker: up to `count` serving, one replacement starting
+        # and `count` retiring during a restart. Reloads during a restart
+        # retire more; _spawn then maps another segment of slots (running
+        # workers keep the segments they were forked with).
+        self._slots_per_segment = 2 * self.count + 1
+        self._beats: List[mmap.mmap] = [mmap.mmap(-1, _BEAT.size * self._slots_per_segment)]
+        self._signals: List[int] = []
+        self._wakeup = None
+        self._spawn_after = 0.0
+        self._stopping: Optional[float] = None  # shutdown deadline
+
+    # Master
+
+    def run(self) -> int:
+        """Serves until SIGTERM or SIGINT; returns the exit status."""
+        self._socket = socket.create_server((self.host, self.port), backlog=2048)
+        self._socket.setblocking(False)
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            os.set_blocking(fd, False)
+        signal.set_wakeup_fd(self._wakeup[1])
+        for signum in _HANDLED_SIGNALS:
+            signal.signal(signum, self._on_signal)
+        watcher = MasterdocWatcher(self.cms.loader.file_path, self._reload, self.reload_interval) \
+            if self.reload_interval > 0 else None
+        next_watch = time.monotonic() + self.reload_interval
+        # The master only supervises: trace records are written directly, and
+        # database connections and the trace thread must not be forked.
+        shutdown_tracing()
+        configure_tracing(use_queue=False)
+        self.cms.before_fork()
+        logger.info(f"Master {self.pid} serving http://{self.host}:{self.port} with {self.count} workers")
+        try:
+            while True:
+                self._wait(min(self.heartbeat_interval, 0.5))
+                for signum in self._take_signals():
+                    if signum in (signal.SIGHUP, signal.SIGUSR1) and self._stopping is None:
+                        force = signum == signal.SIGUSR1
+                        logger.info(f"{signal.Signals(signum).name}: reloading{' (forced)' if force else ''}")
+                        self._reload(force)
+                    elif signum in (signal.SIGTERM, signal.SIGINT):
+                        self._stop(force=self._stopping is not None)
+                self._reap()
+                if self._stopping is not None:
+                    if not self.workers:
+                        break
+                    if time.monotonic() > self._stopping:
+                        self._stop(force=True)
+                    continue
+                self._check_health()
+                if watcher is not None and time.monotonic() >= next_watch:
+                    watcher.check()
+                    next_watch = time.monotonic() + self.reload_interval
+                self._maintain()
+        finally:
+            for worker in self.workers.values():
+                self._kill(worker, signal.SIGKILL)
+            self._socket.close()
+            signal.set_wakeup_fd(-1)
+        logger.info(f"Master {self.pid} stopped")
+        return 0
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _take_signals(self) -> List[int]:
+        signals, self._signals = self._signals, []
+        return signals
+
+    def _wait(self, timeout: float):
+        """Sleeps until a signal arrives or `timeout` passes."""
+        readable, _, _ = select.select([self._wakeup[0]], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self._wakeup[0], 512):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def _reload(self, force: bool = False):
+        """Reloads the masterdoc in the master; restarts the workers if it changed (or `force`)."""
+        gc.unfreeze()
+        try:
+            summary = self.cms.reload(force)
+        except Exception as e:
+            logger.error(f"Masterdoc reload failed, keeping the current workers: {e}")
+            return
+        finally:
+            # Collect the previous state before freezing the new one.
+            gc.collect()
+            gc.freeze()
+        if summary["reloaded"]:
+            logger.info(f"Masterdoc reloaded, restarting workers: {summary}")
+            self.generation += 1
+        else:
+            logger.info(f"Masterdoc unchanged, keeping the current workers: {summary}")
+
+    def _maintain(self):
+        """Starts workers up to `count`; while restarting, swaps old workers for new ones one at a time."""
+        active = [w for w in self.workers.values() if w.retire_at is None]
+        old = [w for w in active if w.generation < self.generation]
+        if old and len(active) > self.count and all(w.ready for w in active):
+            self._retire(old[0])
+            active.remove(old[0])
+            old.pop(0)
+        target = self.count + 1 if old else self.count
+        while len(active) < target and time.monotonic() >= self._spawn_after:
+            active.append(self._spawn())
+
+    def _check_health(self):
+        now = time.monotonic()
+        for worker in list(self.workers.values()):
+            beat = _BEAT.unpack_from(*self._beat_slot(worker.slot))[0]
+            if worker.retire_at is not None:
+                if now > worker.retire_at:
+                    logger.warning(f"Worker {worker.pid} did not stop in {self.graceful_timeout}s, killing it")
+                    self._kill(worker, signal.SIGKILL)
+            elif not worker.ready:
+                if beat >= worker.started:
+                    worker.ready = True
+                    logger.info(f"Worker {worker.pid} ready in {beat - worker.started:.2f}s")
+                elif now - worker.started > self.startup_timeout:
+                    logger.warning(f"Worker {worker.pid} not serving after {self.startup_timeout}s, killing it")
+                    self._kill(worker, signal.SIGKILL)
+            elif now - beat > self.heartbeat_timeout:
+                logger.warning(f"Worker {worker.pid} missed heartbeats for {now - beat:.1f}s, killing it")
+                self._kill(worker, signal.SIGKILL)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if worker.retire_at is None and self._stopping is None:
+                logger.warning(f"Worker {pid} exited with status {code}, replacing it")
+                self._spawn_after = time.monotonic() + self.respawn_delay
+
+    def _retire(self, worker: Worker):
+        worker.retire_at = time.monotonic() + self.graceful_timeout
+        self._kill(worker, signal.SIGTERM)
+
+    def _stop(self, force: bool = False):
+        if force:
+            logger.info("Killing workers")
+            for worker in self.workers.values():
+                self._kill(worker, signal.SIGKILL)
+            self._stopping = time.monotonic()
+            return
+        logger.info("Shutting down: waiting for workers to finish their requests")
+        self._stopping = time.monotonic() + self.graceful_timeout
+        for worker in self.workers.values():
+            if worker.retire_at is None:
+                self._retire(worker)
+
+    def _kill(self, worker: Worker, signum: int):
+        if worker.killed:
+            return
+        worker.killed = signum == signal.SIGKILL
+        try:
+            os.kill(worker.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _spawn(self) -> Worker:
+        used = {w.slot for w in self.workers.values()}
+        slots = len(self._beats) * self._slots_per_segment
+        slot = next((i for i in range(slots) if i not in used), slots)
+        if slot == slots:
+            logger.info(f"{len(used)} workers running or retiring, adding {self._slots_per_segment} heartbeat slots")
+            self._beats.append(mmap.mmap(-1, _BEAT.size * self._slots_per_segment))
+        _BEAT.pack_into(*self._beat_slot(slot), 0.0)
+        started = time.monotonic()
+        gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = self._worker_main(slot)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                logger.exception("Worker failed")
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        worker = Worker(pid, slot, self.generation, started)
+        self.workers[pid] = worker
+        return worker
+
+    def _beat_slot(self, slot: int) -> Tuple[mmap.mmap, int]:
+        """The shared memory segment and offset of a heartbeat slot."""
+        segment, index = divmod(slot, self._slots_per_segment)
+        return self._beats[segment], index * _BEAT.size
+
+    # Worker
+
+    def _worker_main(self, slot: int) -> int:
+        import uvicorn
+
+        signal.set_wakeup_fd(-1)
+        for fd in self._wakeup:
+            os.close(fd)
+        for signum in _HANDLED_SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        # Reloads are the master's job (see main.py's /admin/reload).
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        os.environ["MODERATION_RELOAD_WATCH"] = "0"
+        os.environ["MODERATION_PREFORK_MASTER"] = str(self.pid)
+        gc.enable()
+        self.cms.tracer.sample_rate = configure_tracing()
+        self.cms.after_fork()
+
+        options = dict(self.uvicorn_options)
+        options.setdefault("timeout_graceful_shutdown", self.graceful_timeout)
+        server = uvicorn.Server(uvicorn.Config(self.app, host=self.host, port=self.port, **options))
+        asyncio.run(self._serve(server, slot))
+        return 0 if server.started else STARTUP_FAILURE
+
+    async def _serve(self, server, slot: int):
+        heartbeat = asyncio.create_task(self._heartbeat(server, slot))
+        try:
+            await server.serve(sockets=[self._socket])
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, server, slot: int):
+        while True:
+            if os.getppid() != self.pid:
+                logger.warning("Master exited, shutting down")
+                server.should_exit = True
+            elif server.started:
+                _BEAT.pack_into(*self._beat_slot(slot), time.monotonic())
+            # Poll quickly until started so the master sees the worker ready.
+            await asyncio.sleep(self.heartbeat_interval if server.started else 0.01)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m hybrid_moderation.prefork",
+                                     description="Serve the API from workers forked off a preloaded master.")
+    parser.add_argument("app", nargs="?", default="main:app", help="module:attribute of the ASGI app (main:app)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("MODERATION_PREFORK_WORKERS",
+                                                                           PREFORK_WORKERS)),
+                        help="worker processes (default: MODERATION_PREFORK_WORKERS, 0 = CPU count)")
+    parser.add_argument("--heartbeat-timeout", type=float, default=PREFORK_HEARTBEAT_TIMEOUT_SECONDS)
+    parser.add_argument("--graceful-timeout", type=float, default=PREFORK_GRACEFUL_TIMEOUT_SECONDS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+    if os.environ.get("MODERATION_SERVING_MODE", SERVING_MODE) != "thread":
+        parser.error("the preforking server needs MODERATION_SERVING_MODE=thread")
+
+    # Nothing the app allocates while loading needs collecting: keep the
+    # collector off until the workers are forked (they re-enable it).
+    gc.disable()
+    module_name, _, attribute = args.app.partition(":")
+    sys.path.insert(0, os.getcwd())
+    module = importlib.import_module(module_name)
+    app = getattr(module, attribute or "app")
+    cms = getattr(module, "cms", None)
+    if not isinstance(cms, ContentModerationSystem):
+        parser.error(f"{module_name} has no module-level ContentModerationSystem named 'cms'")
+    interval = float(os.environ.get("MODERATION_RELOAD_WATCH", RELOAD_WATCH_INTERVAL_SECONDS))
+    server = PreforkServer(app, cms, args.host, args.port, args.workers, reload_interval=interval,
+                           heartbeat_timeout=args.heartbeat_timeout, graceful_timeout=args.graceful_timeout,
+                           log_level=args.log_level)
+    sys.exit(server.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+Opt-in profiling of analyze calls with cProfile and tracemalloc.
+
+A Profiler runs a call under cProfile ('cpu'), tracemalloc ('memory') or
+both, and keeps the last PROFILE_BUFFER_SIZE profiles in a ring buffer.
+Calls get there two ways:
+
+- sampled: ContentModerationSystem.configure_profiling(sample_rate) wraps
+  analyze and analyze_batch so that that share of calls is profiled. At
+  rate 0 (the default) the wrappers are removed and the plain methods run,
+  so profiling costs nothing while it is off;
+- on request: analyze_profiled(), used by /analyze for admins sending the
+  x-moderation-profile header.
+
+The admin endpoints aggregate the buffer (or selected profiles) into pstats
+text, a marshalled pstats file (for `python -m pstats` or snakeviz) and
+collapsed stacks for flamegraph.pl / speedscope. CPU stacks are rebuilt from
+cProfile's caller/callee graph, splitting a function's time across its
+callers in proportion to the time each caller spent in it; memory stacks are
+tracemalloc's tracebacks of the blocks still allocated when the call ended.
+
+Profiles are per process. cProfile profiles the calling thread only, but
+tracemalloc traces every thread: a memory profile also counts allocations of
+requests running concurrently, and only one memory profile runs at a time
+(others proceed without one).
+"""
+import cProfile
+import itertools
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from io import StringIO
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from .config import (
+    PROFILE_BUFFER_SIZE, PROFILE_MODE, PROFILE_SAMPLE_RATE, PROFILE_TOP_ALLOCATIONS, PROFILE_TRACEMALLOC_FRAMES
+)
+from .metrics import REGISTRY
+
+PROFILE_MODES = ("cpu", "memory", "both")
+
+PROFILES = REGISTRY.counter("moderation_profiles_total", "Profiled calls, by what was captured.", ("captured",))
+
+# cProfile's raw stats: function -> (primitive calls, calls, inline time,
+# cumulative time, callers: {function: (same four, for that caller)}).
+Function = Tuple[str, int, str]
+RawStats = Dict[Function, tuple]
+# (frames root first as (filename, lineno), bytes, blocks)
+Allocation = Tuple[Tuple[Tuple[str, int], ...], int, int]
+
+
+class Profile(NamedTuple):
+    id: int
+    label: str  # content_id, or the batch size
+    started: float  # epoch seconds
+    duration_ms: float
+    cpu: Optional[RawStats]
+    allocations: Optional[List[Allocation]]
+    peak_bytes: Optional[int]  # traced memory peak during the call
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "label": self.label,
+            "started": self.started,
+            "duration_ms": round(self.duration_ms, 3),
+            "cpu": self.cpu is not None,
+            "memory": self.allocations is not None,
+            "peak_bytes": self.peak_bytes,
+        }
+
+
+class _RawStats:
+    """Lets pstats.Stats load stats that are already in memory."""
+
+    def __init__(self, stats: RawStats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class Profiler:
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, mode: str = PROFILE_MODE,
+                 capacity: int = PROFILE_BUFFER_SIZE, frames: int = PROFILE_TRACEMALLOC_FRAMES,
+                 top_allocations: int = PROFILE_TOP_ALLOCATIONS):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode!r}")
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.frames = frames
+        self.top_allocations = top_allocations
+        self._profiles: deque = deque(maxlen=capacity)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._memory_lock = threading.Lock()
+
+    def sampled(self, fn: Callable) -> Callable:
+        """fn, profiled for sample_rate of its calls."""
+
+        def wrapper(*args, **kwargs):
+            if random.random() < self.sample_rate:
+                return self.profile(self.mode, fn, *args, **kwargs)
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    def profile(self, mode: str, fn: Callable, *args, **kwargs):
+        """
+        Calls fn under cProfile and/or tracemalloc, records the profile and
+        returns fn's result; a ModerationResult (or each of a list of them)
+        gets the profile's id in metadata["profile_id"].
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode!r}")
+        profiler = cProfile.Profile() if mode != "memory" else None
+        traced = mode != "cpu" and self._memory_lock.acquire(blocking=False)
+        started, start = time.time(), time.perf_counter()
+        try:
+            if traced:
+                was_tracing = tracemalloc.is_tracing()
+                if not was_tracing:
+                    tracemalloc.start(self.frames)
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.take_snapshot() if was_tracing else None
+            if profiler is not None:
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # Another profiler is active in this thread.
+                    profiler = None
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                duration_ms = (time.perf_counter() - start) * 1000
+                allocations = peak = None
+                if traced:
+                    snapshot = tracemalloc.take_snapshot()
+                    peak = tracemalloc.get_traced_memory()[1]
+                    if not was_tracing:
+                        tracemalloc.stop()
+                    allocations = self._allocations(snapshot, baseline)
+        finally:
+            if traced:
+                self._memory_lock.release()
+
+        cpu = None
+        if profiler is not None:
+            profiler.create_stats()
+            cpu = profiler.stats
+        label = f"batch of {len(result)}" if isinstance(result, list) else str(getattr(result, "content_id", ""))
+        record = Profile(next(self._ids), label, started, duration_ms, cpu, allocations, peak)
+        with self._lock:
+            self._profiles.append(record)
+        PROFILES.inc("+".join(kind for kind, data in (("cpu", cpu), ("memory", allocations)) if data is not None)
+                     or "none")
+        for item in result if isinstance(result, list) else [result]:
+            metadata = getattr(item, "metadata", None)
+            if metadata is not None:
+                metadata["profile_id"] = record.id
+        return result
+
+    def _allocations(self, snapshot: tracemalloc.Snapshot,
+                     baseline: Optional[tracemalloc.Snapshot]) -> List[Allocation]:
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        if baseline is not None:
+            # tracemalloc was already on: only count what the call added.
+            stats = [s for s in snapshot.compare_to(baseline, "traceback") if s.size_diff > 0]
+            sites = [(s.traceback, s.size_diff, s.count_diff) for s in stats]
+        else:
+            sites = [(s.traceback, s.size, s.count) for s in snapshot.statistics("traceback")]
+        sites.sort(key=lambda site: site[1], reverse=True)
+        return [(_below_profiler(traceback), size, count) for traceback, size, count in sites[:self.top_allocations]]
+
+    def profiles(self, ids: Optional[Iterable[int]] = None) -> List[Profile]:
+        """The buffered profiles, oldest first; only `ids` if given."""
+        with self._lock:
+            profiles = list(self._profiles)
+        if ids is not None:
+            wanted = set(ids)
+            profiles = [p for p in profiles if p.id in wanted]
+        return profiles
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sample_rate": self.sample_rate, "mode": self.mode, "buffered": len(self._profiles),
+                    "capacity": self._profiles.maxlen}
+
+
+def _below_profiler(traceback: tracemalloc.Traceback) -> Tuple[Tuple[str, int], ...]:
+    """The frames (oldest first) under Profiler.profile's, i.e. from the profiled function down."""
+    frames = [(frame.filename, frame.lineno) for frame in traceback]
+    for i in range(len(frames) - 1, -1, -1):
+        if frames[i][0] == __file__:
+            return tuple(frames[i + 1:])
+    return tuple(frames)
+
+
+def merged_stats(profiles: Iterable[Profile]) -> Optional[pstats.Stats]:
+    """The CPU profiles merged into one pstats.Stats, None if there are none."""
+    merged = None
+    for profile in profiles:
+        if profile.cpu is None:
+            continue
+        if merged is None:
+            merged = pstats.Stats(_RawStats(dict(profile.cpu)))
+        else:
+            merged.add(_RawStats(dict(profile.cpu)))
+    return merged
+
+
+def pstats_text(profiles: Iterable[Profile], sort: str = "cumulative", limit: int = 50) -> str:
+    stats = merged_stats(profiles)
+    if stats is None:
+        return "No CPU profiles.\n"
+    out = StringIO()
+    stats.stream = out
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+def pstats_dump(profiles: Iterable[Profile]) -> bytes:
+    """The merged CPU stats in the format of cProfile's -o files."""
+    stats = merged_stats(profiles)
+    return marshal.dumps(stats.stats if stats is not None else {})
+
+
+def _frame_label(function: Function) -> str:
+    filename, lineno, name = function
+    if filename == "~":
+        return name  # built-in
+    return f"{name} ({os.path.basename(filename)}:{lineno})"
+
+
+def collapsed_cpu(profiles: Iterable[Profile], max_depth: int = 64, min_us: int = 1) -> str:
+    """
+    Collapsed stacks ("root;...;leaf microseconds" lines) of the merged CPU
+    profiles, reconstructed from the call graph: a function's inline time
+    is attributed along each path to it in proportion to the cumulative time
+    each caller spent in it.
+    """
+    stats = merged_stats(profiles)
+    if stats is None:
+        return ""
+    raw = stats.stats
+    callees: Dict[Function, Dict[Function, float]] = defaultdict(dict)
+    for function, (_, _, _, _, callers) in raw.items():
+        for caller, edge in callers.items():
+            callees[caller][function] = edge[3]
+    roots = [f for f, entry in raw.items() if not any(caller in raw for caller in entry[4])]
+    totals: Dict[str, float] = defaultdict(float)
+
+    def walk(function: Function, path: List[str], share: float, seen: frozenset):
+        inline, cumulative = raw[function][2], raw[function][3]
+        label = ";".join(path)
+        totals[label] += inline * share
+        if len(path) >= max_depth or cumulative <= 0:
+            return
+        for callee, edge_cumulative in callees.get(function, {}).items():
+            if callee in seen or callee not in raw or raw[callee][3] <= 0:
+                continue
+            child_share = share * edge_cumulative / raw[callee][3]
+            if child_share * raw[callee][3] * 1e6 >= min_us:
+                walk(callee, path + [_frame_label(callee)], child_share, seen | {callee})
+
+    for root in roots:
+        walk(root, [_frame_label(root)], 1.0, frozenset([root]))
+    return "".join(f"{stack} {round(seconds * 1e6)}\n" for stack, seconds in sorted(totals.items())
+                   if round(seconds * 1e6) >= min_us)
+
+
+def collapsed_memory(profiles: Iterable[Profile]) -> str:
+    """Collapsed stacks of the memory profiles' allocation sites, in bytes."""
+    totals: Dict[str, int] = defaultdict(int)
+    for profile in profiles:
+        for frames, size, _ in profile.allocations or ():
+            if not frames:
+                continue  # the profiler's own bookkeeping
+            totals[";".join(f"{os.path.basename(filename)}:{lineno}" for filename, lineno in frames)] += size
+    return "".join(f"{stack} {size}\n" for stack, size in sorted(totals.items()))
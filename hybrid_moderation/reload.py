@@ -0,0 +1,71 @@
+"""
+Masterdoc file watcher for hot reloads.
+
+MasterdocWatcher polls the masterdoc path's stat() from a daemon thread and
+calls back once a change has settled, i.e. the file looked the same on two
+consecutive polls, so a sheet that is still being written is not loaded
+half-way. Replacing the file (as compile_snapshot does) and editing it in
+place are both detected. Polling needs no extra dependency and works on
+every filesystem, including bind mounts where inotify events are not
+delivered.
+"""
+import logging
+import os
+import threading
+from typing import Callable, Optional, Tuple
+
+from .config import RELOAD_WATCH_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+FileSignature = Optional[Tuple[int, int, int]]
+
+
+def file_signature(path: str) -> FileSignature:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class MasterdocWatcher:
+    def __init__(self, path: str, on_change: Callable[[], object],
+                 interval: float = RELOAD_WATCH_INTERVAL_SECONDS):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loaded = self._seen = file_signature(path)
+
+    def start(self) -> "MasterdocWatcher":
+        self._thread = threading.Thread(target=self._run, name="masterdoc-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def check(self):
+        """One poll: calls on_change if the file changed and looked the same on the previous poll."""
+        current = file_signature(self.path)
+        if current is None or current == self._loaded:
+            self._seen = current
+            return
+        if current != self._seen:
+            # Changed since the last poll: wait for it to settle.
+            self._seen = current
+            return
+        try:
+            self.on_change()
+        except Exception as e:
+            # Keep serving the current masterdoc; retry on the next edit.
+            logger.error(f"Reloading {self.path} failed: {e}")
+        self._loaded = current
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
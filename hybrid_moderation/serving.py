@@ -0,0 +1,340 @@
+"""
+Async dispatch of moderation work with admission control.
+
+The API's async handlers hand requests to a Dispatcher, which runs them off
+the event loop either on a thread pool (sharing the API process's
+ContentModerationSystem) or on a process pool where every worker process
+holds its own initialized system, so CPU-bound matching is not serialized by
+the GIL. Both bound the number of in-flight jobs: when the bound is reached
+new work is rejected immediately with Overloaded instead of queueing without
+limit, and callers stop waiting after a per-request timeout.
+
+A MicroBatcher in front of a dispatcher gathers concurrent single-text
+requests into small batches, trading a bounded wait (a few milliseconds) for
+the shared work of analyze_batch.
+
+`reload` swaps in an edited masterdoc without dropping requests: the thread
+dispatcher rebuilds the shared system's state in place (see
+ContentModerationSystem.reload), the process dispatcher starts and warms up
+a new pool and retires the old one once its queued jobs are done.
+
+In the process mode, caches and the analysis metrics (ANALYSIS_METRICS)
+live in the pool workers, out of reach of the API process: /cache/stats
+answers 501 and /metrics leaves those series out.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from .config import (
+    CSV_FILE_PATH, MICROBATCH_ENABLED, MICROBATCH_MAX_SIZE, MICROBATCH_MAX_WAIT_SECONDS,
+    SERVING_BATCH_TIMEOUT_SECONDS, SERVING_MAX_PENDING, SERVING_MODE, SERVING_TIMEOUT_SECONDS, SERVING_WORKERS
+)
+from .core import ContentModerationSystem
+from .metrics import REGISTRY
+from .models import ModerationResult
+from .snapshot import source_version
+
+ADMISSION_REJECTED = REGISTRY.counter(
+    "moderation_admission_rejected_total", "Requests rejected by the dispatcher.", ("reason",))
+IN_FLIGHT = REGISTRY.histogram(
+    "moderation_dispatch_in_flight", "Jobs in flight when a job is admitted.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024), unit_scale=1)
+MICROBATCH_SIZE = REGISTRY.histogram(
+    "moderation_microbatch_size", "Requests per dispatched micro-batch.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256), unit_scale=1)
+MICROBATCH_QUEUE_WAIT = REGISTRY.histogram(
+    "moderation_microbatch_queue_wait_seconds", "Time a request waited for its micro-batch to be dispatched.",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.003, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+
+class Overloaded(Exception):
+    """Raised when the dispatcher already has max_pending jobs in flight."""
+
+
+class Dispatcher:
+    def __init__(self, executor: Executor, max_pending: int = SERVING_MAX_PENDING,
+                 timeout: float = SERVING_TIMEOUT_SECONDS, batch_timeout: float = SERVING_BATCH_TIMEOUT_SECONDS):
+        self.executor = executor
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.batch_timeout = batch_timeout
+        # Jobs submitted and not yet finished by the executor. A job that timed
+        # out for its caller keeps its slot until the worker is done with it.
+        self.in_flight = 0
+
+    async def analyze(self, content_id: str, text: str, age_group: str) -> ModerationResult:
+        return await self._submit(self.timeout, self._analyze_fn(), content_id, text, age_group)
+
+    async def analyze_batch(self, items: List[Tuple[str, str, str]],
+                            timeout: Optional[float] = None) -> List[ModerationResult]:
+        return await self._submit(timeout or self.batch_timeout, self._analyze_batch_fn(), items)
+
+    async def analyze_requests(self, items: List[Tuple[str, str, str]],
+                               timeout: Optional[float] = None) -> List[ModerationResult]:
+        """Several single requests at once, see ContentModerationSystem.analyze_requests."""
+        return await self._submit(timeout or self.batch_timeout, self._analyze_requests_fn(), items)
+
+    def _analyze_fn(self) -> Callable:
+        raise NotImplementedError
+
+    def _analyze_batch_fn(self) -> Callable:
+        raise NotImplementedError
+
+    def _analyze_requests_fn(self) -> Callable:
+        raise NotImplementedError
+
+    async def _submit(self, timeout: float, fn: Callable, *args):
+        if self.in_flight >= self.max_pending:
+            ADMISSION_REJECTED.inc("overloaded")
+            raise Overloaded(f"{self.in_flight} jobs in flight")
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        IN_FLIGHT.observe(self.in_flight)
+        future: Future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            ADMISSION_REJECTED.inc("timeout")
+            raise
+
+    async def run_admitted(self, call: Awaitable, timeout: Optional[float] = None):
+        """
+        Awaits `call`, work the caller runs itself (a streamed document is
+        analyzed window by window in the API process), under the same
+        admission bound as submitted jobs and the batch timeout by default.
+        """
+        if self.in_flight >= self.max_pending:
+            ADMISSION_REJECTED.inc("overloaded")
+            call.close()
+            raise Overloaded(f"{self.in_flight} jobs in flight")
+        self.in_flight += 1
+        IN_FLIGHT.observe(self.in_flight)
+        try:
+            return await asyncio.wait_for(call, timeout or self.batch_timeout)
+        except asyncio.TimeoutError:
+            ADMISSION_REJECTED.inc("timeout")
+            raise
+        finally:
+            self._release()
+
+    def _release(self):
+        self.in_flight -= 1
+
+    def reload(self, force: bool = False) -> dict:
+        """Picks up masterdoc changes; blocking, call it off the event loop."""
+        raise NotImplementedError
+
+    def shutdown(self, wait: bool = False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class ThreadDispatcher(Dispatcher):
+    """Runs work on threads against a shared, already initialized system."""
+
+    def __init__(self, cms: ContentModerationSystem, workers: int = 0, **kwargs):
+        super().__init__(ThreadPoolExecutor(workers or min(32, (os.cpu_count() or 1) + 4)), **kwargs)
+        self.cms = cms
+
+    def _analyze_fn(self) -> Callable:
+        return self.cms.analyze
+
+    def _analyze_batch_fn(self) -> Callable:
+        return self.cms.analyze_batch
+
+    def _analyze_requests_fn(self) -> Callable:
+        return self.cms.analyze_requests
+
+    async def analyze_profiled(self, content_id: str, text: str, age_group: str, mode: str) -> ModerationResult:
+        """analyze() under the system's profiler (see profiling.py)."""
+        return await self._submit(self.timeout, self.cms.analyze_profiled, content_id, text, age_group, mode)
+
+    def reload(self, force: bool = False) -> dict:
+        return self.cms.reload(force)
+
+
+_worker_cms: Optional[ContentModerationSystem] = None
+
+
+def _init_worker(csv_path: str):
+    global _worker_cms
+    _worker_cms = ContentModerationSystem(csv_path=csv_path)
+    _worker_cms.initialize()
+
+
+def _worker_analyze(content_id: str, text: str, age_group: str) -> ModerationResult:
+    return _worker_cms.analyze(content_id, text, age_group)
+
+
+def _worker_analyze_batch(items: List[Tuple[str, str, str]]) -> List[ModerationResult]:
+    return _worker_cms.analyze_batch(items)
+
+
+def _worker_analyze_requests(items: List[Tuple[str, str, str]]) -> List[ModerationResult]:
+    return _worker_cms.analyze_requests(items)
+
+
+def _worker_ready(_=None) -> int:
+    return os.getpid()
+
+
+class ProcessDispatcher(Dispatcher):
+    """Runs work on a process pool; each worker initializes its own system once."""
+
+    def __init__(self, csv_path: str = CSV_FILE_PATH, workers: int = 0, **kwargs):
+        self.csv_path = csv_path
+        self.workers = workers or os.cpu_count() or 1
+        self.version = source_version(csv_path)
+        self._reload_lock = threading.Lock()
+        super().__init__(self._new_pool(), **kwargs)
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.csv_path,))
+
+    def warm_up(self, executor: Optional[Executor] = None) -> List[int]:
+        """Starts the workers and waits for their initialize() before traffic arrives."""
+        return sorted(set((executor or self.executor).map(_worker_ready, range(self.workers))))
+
+    def reload(self, force: bool = False) -> dict:
+        with self._reload_lock:
+            version = source_version(self.csv_path)
+            if version == self.version and not force:
+                return {"reloaded": False, "version": version[:12]}
+            pool = self._new_pool()
+            try:
+                pids = self.warm_up(pool)
+            except Exception:
+                # e.g. the edited masterdoc does not parse: keep the current pool.
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            retired, self.executor = self.executor, pool
+            previous, self.version = self.version, version
+            # Jobs already queued on the old pool still run there.
+            retired.shutdown(wait=False)
+        return {"reloaded": True, "version": version[:12], "previous_version": previous[:12], "workers": len(pids)}
+
+    def _analyze_fn(self) -> Callable:
+        return _worker_analyze
+
+    def _analyze_batch_fn(self) -> Callable:
+        return _worker_analyze_batch
+
+    def _analyze_requests_fn(self) -> Callable:
+        return _worker_analyze_requests
+
+
+class MicroBatcher:
+    """
+    Gathers concurrent analyze() calls into micro-batches for a dispatcher.
+
+    The first request of a batch waits at most max_wait seconds for others to
+    join it (so an idle server adds up to max_wait to every request); a
+    batch is dispatched at once when max_size requests are waiting. Each batch takes one dispatcher slot and runs through
+    analyze_requests: each request is looked up in (and stored to) the
+    result cache and goes to the content store as with analyze(), and the
+    others share one analyze_batch, so identical texts are analyzed once,
+    fuzzy lookups are shared and the vector stage embeds the texts together.
+    The results fan back out to the waiting callers; their metadata has
+    queue_wait_ms, and processing_time_ms is the request's own (queue wait
+    plus the batch's time), not the batch's.
+
+    Admission is per request: with the dispatcher's max_pending requests
+    waiting or in flight, new ones are rejected with Overloaded. A failed
+    batch (overloaded, timed out, error) fails all of its requests.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, max_size: int = MICROBATCH_MAX_SIZE,
+                 max_wait: float = MICROBATCH_MAX_WAIT_SECONDS):
+        self.dispatcher = dispatcher
+        self.max_size = max_size
+        self.max_wait = max_wait
+        # (item, caller's future, perf_counter_ns when queued) of the batch being gathered
+        self._waiting: List[Tuple[Tuple[str, str, str], asyncio.Future, int]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._batches: Set[asyncio.Task] = set()
+        # Requests waiting or in a dispatched batch that has not finished.
+        self.pending = 0
+
+    async def analyze(self, content_id: str, text: str, age_group: str) -> ModerationResult:
+        if self.pending >= self.dispatcher.max_pending:
+            ADMISSION_REJECTED.inc("overloaded")
+            raise Overloaded(f"{self.pending} requests pending")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending += 1
+        self._waiting.append(((content_id, text, age_group), future, time.perf_counter_ns()))
+        if len(self._waiting) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        waiting, self._waiting = self._waiting, []
+        if waiting:
+            task = asyncio.ensure_future(self._run(waiting))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run(self, waiting: List[Tuple[Tuple[str, str, str], asyncio.Future, int]]):
+        dispatched_ns = time.perf_counter_ns()
+        MICROBATCH_SIZE.observe(len(waiting))
+        for _, _, queued_ns in waiting:
+            MICROBATCH_QUEUE_WAIT.observe(dispatched_ns - queued_ns)
+        try:
+            results = await self.dispatcher.analyze_requests([item for item, _, _ in waiting], self.dispatcher.timeout)
+        except asyncio.CancelledError:
+            for _, future, _ in waiting:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future, _ in waiting:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.pending -= len(waiting)
+        done_ns = time.perf_counter_ns()
+        for (_, future, queued_ns), result in zip(waiting, results):
+            result.metadata["queue_wait_ms"] = round((dispatched_ns - queued_ns) / 1e6, 3)
+            result.metadata["processing_time_ms"] = int((done_ns - queued_ns) / 1e6)
+            if not future.done():  # the caller may have given up
+                future.set_result(result)
+
+
+def create_dispatcher(cms: ContentModerationSystem, mode: Optional[str] = None,
+                      workers: Optional[int] = None) -> Dispatcher:
+    """
+    Builds the dispatcher for MODERATION_SERVING_MODE ('thread' or 'process',
+    default from config). MODERATION_SERVING_WORKERS overrides the pool size.
+    """
+    mode = mode or os.environ.get("MODERATION_SERVING_MODE", SERVING_MODE)
+    if workers is None:
+        workers = int(os.environ.get("MODERATION_SERVING_WORKERS", SERVING_WORKERS))
+    if mode == "process":
+        return ProcessDispatcher(cms.loader.file_path, workers)
+    if mode == "thread":
+        return ThreadDispatcher(cms, workers)
+    raise ValueError(f"Unknown serving mode: {mode!r}")
+
+
+def create_microbatcher(dispatcher: Dispatcher, enabled: Optional[bool] = None) -> Optional[MicroBatcher]:
+    """
+    A MicroBatcher over `dispatcher` if MODERATION_MICROBATCH=1 (default from
+    config), else None. MODERATION_MICROBATCH_MAX_SIZE and
+    MODERATION_MICROBATCH_MAX_WAIT (seconds) override the limits.
+    """
+    if enabled is None:
+        enabled = os.environ.get("MODERATION_MICROBATCH", "1" if MICROBATCH_ENABLED else "0") == "1"
+    if not enabled:
+        return None
+    return MicroBatcher(dispatcher,
+                        int(os.environ.get("MODERATION_MICROBATCH_MAX_SIZE", MICROBATCH_MAX_SIZE)),
+                        float(os.environ.get("MODERATION_MICROBATCH_MAX_WAIT", MICROBATCH_MAX_WAIT_SECONDS)))
@@ -0,0 +1,453 @@
+"""
+Shadow evaluation of a candidate masterdoc against live traffic.
+
+Before an edited masterdoc is rolled out, a ShadowEvaluator decides the
+texts the live system analyzes with the candidate's rules as well and counts
+the decisions that flip, per category and age group:
+
+    cms.start_shadow("Models_Masterdoc_Candidate.csv")
+    ...
+    cms.shadow.report()
+
+or offline, replaying JSONL requests (the fields stream.py reads):
+
+    python -m hybrid_moderation.shadow candidate.csv requests.jsonl [--all-age-groups] [--flips flips.jsonl]
+
+The candidate shares the work on a text that does not depend on the
+masterdoc, which the live analysis keeps in a TextWork:
+
+- keyword hits: a hit only depends on the keyword and the text, so the live
+  index's exact and fuzzy hits are mapped onto the candidate's keyword ids
+  (KeywordDelta). Only keywords the live masterdoc lacks are searched for;
+- safe context: the text's ContextScan;
+- vector: the text's term frequencies, which the candidate's client only
+  weights and scores.
+
+Keyword matching (the fuzzy lookups above all) is most of an analysis, so
+the candidate's decision costs a fraction of a second one; candidate
+analyses are cached per text like the live ones. Work the live side did not
+do (a result cache hit, the vector stage of a batch or a stage the cascade
+skipped) is done by the shadow.
+
+In the API, analyze and analyze_batch submit sampled comparisons to a
+bounded queue drained by a background thread: a request never waits for
+the shadow, and comparisons arriving while the queue is full are dropped
+(and counted). The thread shares the GIL with the request threads, which
+bench_shadow.py measures. Shadows are per process.
+
+A flip is counted under the category of the more severe decision's CSV
+match (e.g. the row a new keyword hit for PASS -> FLAG), or the other
+side's if that one has none.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .cache import LRUCache, estimate_size, text_key
+from .config import (
+    CSV_FILE_PATH, PREFILTER_ENABLED, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_SECONDS,
+    SHADOW_QUEUE_SIZE, SHADOW_RECENT_FLIPS, SHADOW_SAMPLE_RATE
+)
+from .context import ContextScan, ContextValidator
+from .embedding import EmbeddingSearchClient
+from .index import AhoCorasick, FuzzyIndex, KeywordIndex
+from .metrics import REGISTRY, STAGE_SECONDS
+from .models import CSVAnalysisResult, ModerationResult, VectorAnalysisResult
+from .prefilter import TypoPrefilter
+from .snapshot import open_loader
+
+logger = logging.getLogger(__name__)
+
+SHADOW_COMPARISONS = REGISTRY.counter(
+    "moderation_shadow_comparisons_total", "Decisions compared with the shadow candidate masterdoc.", ("outcome",))
+
+AGE_GROUPS = ("<10", "10-13", "13-16", "16+")
+DECISION_SEVERITY = {"PASS": 0, "REVIEW_QUEUE": 1, "FLAG": 2}
+
+# Up to this many new keywords are searched with `in`, more with an automaton.
+_SUBSTRING_SEARCH_MAX = 32
+# Fuzzy lookups of new keywords are cached per token, up to this many tokens.
+_FUZZY_CACHE_MAX = 50000
+
+Hits = Tuple[Set[int], Set[int]]  # (exact, fuzzy) keyword ids, as KeywordIndex.hits
+
+
+class TextWork:
+    """
+    Masterdoc-independent work on one text, each part computed at most once
+    and shared by the live and the candidate rule sets.
+    """
+
+    __slots__ = ("text", "_lowered", "_tokens", "_hits", "_hits_index", "_scan", "_frequencies", "candidate")
+
+    def __init__(self, text: str):
+        self.text = text
+        self._lowered: Optional[str] = None
+        self._tokens: Optional[List[str]] = None
+        self._hits: Optional[Hits] = None
+        self._hits_index: Optional[KeywordIndex] = None
+        self._scan: Optional[ContextScan] = None
+        self._frequencies = None
+        self.candidate = None  # the shadow's analysis of the text
+
+    @property
+    def lowered(self) -> str:
+        if self._lowered is None:
+            self._lowered = self.text.lower()
+        return self._lowered
+
+    def tokens(self, index: KeywordIndex) -> List[str]:
+        if self._tokens is None:
+            self._tokens = index.matcher.tokenize(self.text)
+        return self._tokens
+
+    def hits(self, index: KeywordIndex, fuzzy_cache: Optional[Dict[str, Set[int]]] = None) -> Hits:
+        """index.hits(text)."""
+        if self._hits_index is not index:
+            exact = index.automaton.find_all(self.lowered)
+            self.set_hits(index, (exact, index.fuzzy_hits(self.tokens(index), fuzzy_cache) - exact))
+        return self._hits
+
+    def set_hits(self, index: KeywordIndex, hits: Hits):
+        """Records index.hits(text), found some other way (see incremental.py)."""
+        self._hits, self._hits_index = hits, index
+
+    def context(self, validator: ContextValidator) -> ContextScan:
+        if self._scan is None:
+            self._scan = validator.scan(self.text)
+        return self._scan
+
+    def frequencies(self, client: EmbeddingSearchClient):
+        """The text's term frequencies (one row), for EmbeddingSearchClient.analyze_frequencies."""
+        if self._frequencies is None:
+            self._frequencies = client.text_frequencies([self.text])
+        return self._frequencies
+
+
+class KeywordDelta:
+    """
+    Maps a live KeywordIndex's hits onto a candidate index's keyword ids.
+
+    Keywords in both indexes keep their hits; keywords only the candidate
+    has are searched for, by substring search (or their own automaton when
+    there are many) and by fuzzy lookup of the text's tokens behind a typo
+    prefilter, cached per token across texts. hits(work) equals
+    candidate.hits(work.text).
+    """
+
+    def __init__(self, live: KeywordIndex, candidate: KeywordIndex):
+        self.live = live
+        self.candidate = candidate
+        candidate_ids = {kw: kid for kid, kw in enumerate(candidate.keywords)}
+        # live keyword id -> candidate keyword id (None: removed)
+        self.mapping = [candidate_ids.get(kw) for kw in live.keywords]
+        live_keywords = set(live.keywords)
+        self.added = [kid for kid, kw in enumerate(candidate.keywords) if kw not in live_keywords]
+        # For the report: keywords some row uses (an index may keep unused ones, see KeywordIndex).
+        live_used, candidate_used = self._used(live), self._used(candidate)
+        self.keywords_added = len(candidate_used - live_used)
+        self.keywords_removed = len(live_used - candidate_used)
+        added_words = [candidate.keywords[kid] for kid in self.added]
+        self.automaton = AhoCorasick(added_words) if len(added_words) > _SUBSTRING_SEARCH_MAX else None
+        self.added_single = [kid for kid in self.added if candidate.single_word[kid]]
+        single_words = [candidate.keywords[kid] for kid in self.added_single]
+        self.fuzzy_index = FuzzyIndex(single_words, candidate.matcher) if single_words else None
+        self.prefilter = TypoPrefilter(single_words) if single_words and PREFILTER_ENABLED else None
+        self._fuzzy_cache: Dict[str, Tuple[int, ...]] = {}
+
+    @staticmethod
+    def _used(index: KeywordIndex) -> Set[str]:
+        return {kw for kid, kw in enumerate(index.keywords) if index.postings[kid]}
+
+    def hits(self, work: TextWork) -> Hits:
+        live_exact, live_fuzzy = work.hits(self.live)
+        mapping = self.mapping
+        exact = {mapping[kid] for kid in live_exact}
+        fuzzy = {mapping[kid] for kid in live_fuzzy}
+        exact.discard(None)
+        fuzzy.discard(None)
+        if self.automaton is not None:
+            exact.update(self.added[i] for i in self.automaton.find_all(work.lowered))
+        elif self.added:
+            text, keywords = work.lowered, self.candidate.keywords
+            exact.update(kid for kid in self.added if keywords[kid] in text)
+        if self.fuzzy_index is not None:
+            cache = self._fuzzy_cache
+            if len(cache) > _FUZZY_CACHE_MAX:
+                cache.clear()
+            for token in set(work.tokens(self.candidate)):
+                token_hits = cache.get(token)
+                if token_hits is None:
+                    token_hits = ()
+                    if self.prefilter is None or self.prefilter.may_match(token):
+                        token_hits = tuple(self.added_single[i] for i in self.fuzzy_index.lookup(token))
+                    cache[token] = token_hits
+                fuzzy.update(token_hits)
+        return exact, fuzzy - exact
+
+
+class ShadowEvaluator:
+    def __init__(self, cms, candidate_path: str, sample_rate: float = SHADOW_SAMPLE_RATE,
+                 queue_size: int = SHADOW_QUEUE_SIZE, recent_flips: int = SHADOW_RECENT_FLIPS,
+                 background: bool = True):
+        self.cms = cms
+        self.path = candidate_path
+        # Built from scratch: nothing of the live index is shared or patched.
+        self.candidate = cms._build_state(open_loader(candidate_path), cms.state, reuse=False)
+        self.sample_rate = sample_rate
+        # Without a background thread, submit() compares in the calling thread (offline replay).
+        self.background = background
+        self.on_flip: Optional[Callable[[dict], None]] = None
+        self.analysis_cache = None
+        if cms.analysis_cache is not None:
+            self.analysis_cache = LRUCache(
+                RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_BYTES,
+                size_fn=lambda a: estimate_size(a.csv_result) + estimate_size(a.vector_result))
+        self._delta = KeywordDelta(cms.state.keyword_index, self.candidate.keyword_index)
+        self._queue_size = queue_size
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stopping = False
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # (category, age group) -> [compared, flipped, Counter of "live->candidate"]
+        self._cells: Dict[Tuple[str, str], list] = {}
+        self._recent_flips: deque = deque(maxlen=recent_flips)
+        self._dropped = 0
+        self._failed = 0
+        self._shadow_ns = 0
+
+    def sampled(self) -> bool:
+        """Whether to compare the next text."""
+        return not self._stopping and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+
+    def submit(self, state, work: TextWork, age_group: str, result: ModerationResult):
+        """Hands a live decision on `state` over for comparison; never blocks."""
+        if not self.background:
+            self._compare(state, work, age_group, result)
+            return
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait((state, work, age_group, result))
+        except queue.Full:
+            SHADOW_COMPARISONS.inc("dropped")
+            with self._lock:
+                self._dropped += 1
+
+    def _start(self):
+        # Threads do not survive a fork: each (preforked) process starts its own.
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self._queue_size)
+            self._thread = threading.Thread(target=self._run, args=(self._queue,), name="moderation-shadow",
+                                            daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self, comparisons: queue.Queue):
+        while True:
+            item = comparisons.get()
+            if item is None:
+                return
+            try:
+                self._compare(*item)
+            except Exception:
+                SHADOW_COMPARISONS.inc("failed")
+                with self._lock:
+                    self._failed += 1
+                    first = self._failed == 1
+                if first:
+                    logger.exception("Shadow comparison failed")
+
+    def stop(self, timeout: float = 5.0):
+        """Stops the background thread; comparisons still queued are discarded."""
+        self._stopping = True
+        if self._thread is None or self._pid != os.getpid():
+            return
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _analysis(self, state, work: TextWork, age_group: str):
+        """The candidate's age-independent analysis of the text, with the vector stage if `age_group` needs it."""
+        from .core import TextAnalysis  # core imports this module
+
+        cms, candidate = self.cms, self.candidate
+        analysis = work.candidate
+        if analysis is None and self.analysis_cache is not None:
+            analysis = self.analysis_cache.get(text_key(work.text))
+        changed = analysis is None
+        if analysis is None:
+            if self._delta.live is not state.keyword_index:
+                # The live masterdoc was reloaded since.
+                self._delta = KeywordDelta(state.keyword_index, candidate.keyword_index)
+            row_matches = candidate.keyword_index.row_scores(*self._delta.hits(work))
+            if row_matches:
+                csv_result, category, rows_skipped = cms._best_match(candidate, row_matches,
+                                                                     work.context(cms.context_validator))
+                analysis = TextAnalysis(csv_result, category, None, rows_skipped)
+            else:
+                analysis = TextAnalysis(CSVAnalysisResult(), None, None, 0)
+        if analysis.vector_result is None and cms._vector_skip(analysis, age_group) is None:
+            client = candidate.vector_client
+            if isinstance(client, EmbeddingSearchClient):
+                vector_result = client.analyze_frequencies(work.frequencies(client), candidate.category_names)[0]
+            else:
+                vector_result = client.semantic_analyze(work.text, candidate.category_names)
+            analysis = analysis._replace(vector_result=vector_result)
+            changed = True
+        work.candidate = analysis
+        if changed and self.analysis_cache is not None:
+            self.analysis_cache.put(text_key(work.text), analysis)
+        return analysis
+
+    def _compare(self, state, work: TextWork, age_group: str, result: ModerationResult):
+        start = time.perf_counter_ns()
+        cms = self.cms
+        analysis = self._analysis(state, work, age_group)
+        csv_result = cms._with_age_restriction(analysis.csv_result, analysis.category, age_group)
+        decision = cms._final_decision(csv_result, analysis.vector_result or VectorAnalysisResult(), age_group)
+        elapsed = time.perf_counter_ns() - start
+        STAGE_SECONDS.observe(elapsed, "shadow")
+
+        live, candidate = result.final_decision.decision, decision.decision
+        live_category = result.csv_analysis.primary_category
+        candidate_category = csv_result.primary_category
+        if DECISION_SEVERITY.get(candidate, 0) > DECISION_SEVERITY.get(live, 0):
+            category = candidate_category or live_category
+        else:
+            category = live_category or candidate_category
+        category = category or "none"
+        flipped = live != candidate
+        SHADOW_COMPARISONS.inc("flipped" if flipped else "agreed")
+        flip = None
+        if flipped:
+            flip = {
+                "content_id": result.content_id,
+                "age_group": age_group,
+                "category": category,
+                "live": {"decision": live, "weighted_score": result.final_decision.weighted_score,
+                         "category": live_category},
+                "candidate": {"decision": candidate, "weighted_score": decision.weighted_score,
+                              "category": candidate_category},
+            }
+        with self._lock:
+            self._shadow_ns += elapsed
+            cell = self._cells.get((category, age_group))
+            if cell is None:
+                cell = self._cells[(category, age_group)] = [0, 0, Counter()]
+            cell[0] += 1
+            if flipped:
+                cell[1] += 1
+                cell[2][f"{live}->{candidate}"] += 1
+                self._recent_flips.append(flip)
+        if flip is not None and self.on_flip is not None:
+            self.on_flip(flip)
+
+    def report(self) -> dict:
+        with self._lock:
+            cells = {key: (compared, flipped, dict(transitions))
+                     for key, (compared, flipped, transitions) in self._cells.items()}
+            recent_flips = list(self._recent_flips)
+            dropped, failed, shadow_ns = self._dropped, self._failed, self._shadow_ns
+        compared = sum(c[0] for c in cells.values())
+        flipped = sum(c[1] for c in cells.values())
+        transitions = Counter()
+        by_category: Dict[str, Dict[str, dict]] = {}
+        for (category, age_group), (cell_compared, cell_flipped, cell_transitions) in sorted(cells.items()):
+            transitions.update(cell_transitions)
+            by_category.setdefault(category, {})[age_group] = {
+                "compared": cell_compared, "flipped": cell_flipped, "transitions": cell_transitions}
+        delta = self._delta
+        return {
+            "candidate": self.path,
+            "candidate_version": self.candidate.version[:12],
+            "live_version": self.cms.version[:12],
+            "rows": len(self.candidate.categories),
+            "keywords_added": delta.keywords_added,
+            "keywords_removed": delta.keywords_removed,
+            "sample_rate": self.sample_rate,
+            "running": not self._stopping,
+            "compared": compared,
+            "flipped": flipped,
+            "flip_rate": round(flipped / compared, 4) if compared else 0.0,
+            "dropped": dropped,
+            "failed": failed,
+            "pending": self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0,
+            "shadow_ms_mean": round(shadow_ns / compared / 1e6, 4) if compared else 0.0,
+            "transitions": dict(transitions.most_common()),
+            "by_category": by_category,
+            "recent_flips": recent_flips,
+        }
+
+
+def main(argv: Optional[List[str]] = None):
+    from .core import ContentModerationSystem
+    from .stream import chunked, parse_request, read_records
+
+    parser = argparse.ArgumentParser(
+        prog="python -m hybrid_moderation.shadow",
+        description="Replay JSONL requests against the live and a candidate masterdoc and report decision flips.")
+    parser.add_argument("candidate", help="candidate masterdoc CSV (or snapshot)")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL requests ('-' for stdin)")
+    parser.add_argument("--csv", default=CSV_FILE_PATH, help="live masterdoc CSV (or snapshot)")
+    parser.add_argument("--all-age-groups", action="store_true",
+                        help="compare every request in every age group, not just its own")
+    parser.add_argument("--flips", help="write every flip to this JSONL file")
+    parser.add_argument("--chunk-size", type=int, default=256, help="requests analyzed per batch")
+    parser.add_argument("--id-field", default="content_id")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--age-field", default="age_group")
+    parser.add_argument("--default-age-group", default="13-16")
+    args = parser.parse_args(argv)
+
+    fields = (args.id_field, args.text_field, args.age_field, args.default_age_group)
+    cms = ContentModerationSystem(csv_path=args.csv)
+    cms.initialize()
+    cms.start_shadow(args.candidate, sample_rate=1.0, background=False)
+    flips = open(args.flips, "w", encoding="utf-8") if args.flips else None
+    if flips is not None:
+        cms.shadow.on_flip = lambda flip: flips.write(json.dumps(flip, ensure_ascii=False) + "\n")
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8", errors="replace")
+    skipped = 0
+    start = time.perf_counter()
+    try:
+        for chunk in chunked(read_records(source), max(1, args.chunk_size)):
+            items = []
+            for number, line in chunk:
+                try:
+                    items.append(parse_request(number, line, fields))
+                except Exception:
+                    skipped += 1
+            if args.all_age_groups:
+                items = [(content_id, text, age_group) for content_id, text, _ in items for age_group in AGE_GROUPS]
+            if items:
+                cms.analyze_batch(items)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if flips is not None:
+            flips.close()
+    report = cms.stop_shadow()
+    report["skipped_records"] = skipped
+    report["replay_seconds"] = round(time.perf_counter() - start, 3)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
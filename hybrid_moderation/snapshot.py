@@ -0,0 +1,320 @@
+"""
+Precompiled masterdoc snapshots.
+
+`compile` turns the masterdoc CSV into a compact binary file that holds only
+what the pipeline uses: interned strings (names, descriptions, keywords),
+per-row keyword lists as string ids, age rules as one-byte enums, and the
+KeywordIndex tables: keyword postings, the fuzzy index's length and bigram
+postings and the keyword automaton as a flat transition table. Workers mmap
+the file, so those tables are shared by every process loading the same
+snapshot instead of being parsed and rebuilt per process:
+
+    python -m hybrid_moderation.snapshot compile Models_Masterdoc_Test.csv -o Models_Masterdoc_Test.snap
+    python -m hybrid_moderation.snapshot info Models_Masterdoc_Test.snap
+
+Layout: MAGIC, a little-endian uint32 header length, a JSON header (format,
+source hash, size and mtime, section table), then 8-byte aligned sections of fixed-width
+integers. ContentModerationSystem accepts either a CSV or a snapshot path
+(see open_loader); the snapshot's content_hash is the source CSV's, so cache
+versions do not change when switching between the two. It is also what
+reloads compare: a server loading a snapshot only picks up masterdoc edits
+once the snapshot is recompiled.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from .index import DFAAutomaton, FuzzyIndex, KeywordIndex, PackedPostings, PrebuiltIndex
+from .loader import CSVLoader
+from .models import AgeRestrictionRules, ModerationCategory
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"HMSNAP\x00\x01"
+FORMAT_VERSION = 2
+_ALIGN = 8
+_AGE_FIELDS = ("rules_below_10", "rules_10_13", "rules_13_16", "rules_16_18")
+
+
+def is_snapshot(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def open_loader(path: str) -> Union[CSVLoader, "SnapshotLoader"]:
+    """Returns the loader for a masterdoc path: snapshot if it has the magic, CSV otherwise."""
+    return SnapshotLoader(path) if is_snapshot(path) else CSVLoader(path)
+
+
+def source_version(path: str) -> str:
+    """The content_hash a loader for `path` would report, without loading it."""
+    if is_snapshot(path):
+        return read_header(path)[0]["source_sha256"]
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class _StringTable:
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.blob = bytearray()
+        self.offsets = array("I", [0])
+
+    def intern(self, value: str) -> int:
+        sid = self.ids.get(value)
+        if sid is None:
+            sid = self.ids[value] = len(self.ids)
+            self.blob += value.encode("utf-8", "surrogatepass")
+            self.offsets.append(len(self.blob))
+        return sid
+
+
+def compile_snapshot(csv_path: str, out_path: str) -> dict:
+    """Compiles a masterdoc CSV into a snapshot file (written atomically). Returns its header."""
+    # Taken before reading: an edit while compiling shows up as a changed mtime.
+    source_stat = os.stat(csv_path)
+    loader = CSVLoader(csv_path)
+    categories = loader.load_data()
+    index = KeywordIndex(categories)
+    dfa = DFAAutomaton.from_aho_corasick(index.automaton)
+
+    strings = _StringTable()
+    age_actions: List[str] = []
+    row_category, row_subcategory, row_description, row_age = array("I"), array("I"), array("I"), array("B")
+    keyword_lists = {"cat": (array("I", [0]), array("I")), "sub": (array("I", [0]), array("I"))}
+    for cat in categories:
+        row_category.append(strings.intern(cat.category))
+        row_subcategory.append(strings.intern(cat.subcategory))
+        row_description.append(strings.intern(cat.description))
+        for field in _AGE_FIELDS:
+            action = getattr(cat.age_rules, field)
+            if action not in age_actions:
+                age_actions.append(action)
+            row_age.append(age_actions.index(action))
+        for name, keywords in (("cat", cat.category_keywords), ("sub", cat.subcategory_keywords)):
+            offsets, ids = keyword_lists[name]
+            ids.extend(strings.intern(kw) for kw in keywords)
+            offsets.append(len(ids))
+    index_keywords = array("I", (strings.intern(kw) for kw in index.keywords))
+    posting_offsets, posting_triples = array("I", [0]), array("I")
+    for postings in index.postings:
+        for triple in postings:
+            posting_triples.extend(triple)
+        posting_offsets.append(len(posting_triples) // 3)
+
+    by_length, bigrams = FuzzyIndex.build_tables([index.keywords[kid] for kid in index.single_word_ids])
+    fuzzy_lengths, fuzzy_length_offsets, fuzzy_length_ids = array("I"), array("I", [0]), array("I")
+    for length, kids in sorted(by_length.items()):
+        fuzzy_lengths.append(length)
+        fuzzy_length_ids.extend(kids)
+        fuzzy_length_offsets.append(len(fuzzy_length_ids))
+    fuzzy_grams, fuzzy_gram_offsets, fuzzy_gram_pairs = array("I"), array("I", [0]), array("I")
+    for gram, pairs in bigrams.items():
+        fuzzy_grams.append(strings.intern(gram))
+        fuzzy_gram_pairs.extend(pairs)
+        fuzzy_gram_offsets.append(len(fuzzy_gram_pairs))
+
+    sections: List[Tuple[str, Union[array, bytes]]] = [
+        ("strings", bytes(strings.blob)),
+        ("string_offsets", strings.offsets),
+        ("row_category", row_category),
+        ("row_subcategory", row_subcategory),
+        ("row_description", row_description),
+        ("row_age", row_age),
+        ("row_cat_keyword_offsets", keyword_lists["cat"][0]),
+        ("row_cat_keywords", keyword_lists["cat"][1]),
+        ("row_sub_keyword_offsets", keyword_lists["sub"][0]),
+        ("row_sub_keywords", keyword_lists["sub"][1]),
+        ("index_keywords", index_keywords),
+        ("posting_offsets", posting_offsets),
+        ("posting_triples", posting_triples),
+        ("fuzzy_lengths", fuzzy_lengths),
+        ("fuzzy_length_offsets", fuzzy_length_offsets),
+        ("fuzzy_length_ids", fuzzy_length_ids),
+        ("fuzzy_grams", fuzzy_grams),
+        ("fuzzy_gram_offsets", fuzzy_gram_offsets),
+        ("fuzzy_gram_pairs", fuzzy_gram_pairs),
+        ("dfa_delta", dfa.delta),
+        ("dfa_out_offsets", dfa.out_offsets),
+        ("dfa_out", dfa.out),
+    ]
+    header = {
+        "format": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "source": os.path.abspath(csv_path),
+        "source_sha256": loader.content_hash,
+        "source_size": source_stat.st_size,
+        "source_mtime_ns": source_stat.st_mtime_ns,
+        "rows": len(categories),
+        "keywords": len(index.keywords),
+        "age_actions": age_actions,
+        "alphabet": dfa.alphabet,
+        "first_output_state": dfa.first_output_state,
+        "sections": {},
+    }
+
+    # Section offsets are relative to the first 8-byte boundary after the header.
+    position = 0
+    for name, data in sections:
+        typecode = data.typecode if isinstance(data, array) else "B"
+        header["sections"][name] = [position, typecode, len(data)]
+        position += _padded(len(data) * (data.itemsize if isinstance(data, array) else 1))
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = _padded(len(MAGIC) + 4 + len(header_bytes))
+
+    tmp_path = f"{out_path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes)
+        f.write(b"\0" * (data_start - f.tell()))
+        for name, data in sections:
+            raw = data.tobytes() if isinstance(data, array) else data
+            f.write(raw + b"\0" * (_padded(len(raw)) - len(raw)))
+    os.replace(tmp_path, out_path)
+    logger.info(f"Compiled {len(categories)} rows, {len(index.keywords)} keywords, "
+                f"{dfa.first_output_state + len(dfa.out_offsets) - 1} automaton states into {out_path}")
+    return header
+
+
+def _padded(size: int) -> int:
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def read_header(path: str) -> Tuple[dict, int]:
+    """Returns (header, offset of the first section)."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a masterdoc snapshot")
+        (length,) = struct.unpack("<I", f.read(4))
+        return json.loads(f.read(length).decode("utf-8")), _padded(len(MAGIC) + 4 + length)
+
+
+class SnapshotLoader:
+    """
+    Loads a compiled snapshot. Mirrors CSVLoader (file_path, categories,
+    content_hash, load_data) and additionally provides the prebuilt
+    KeywordIndex tables, backed by the mapped file.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.categories: List[ModerationCategory] = []
+        self.content_hash = ""
+        self.header: dict = {}
+        self.prebuilt: Optional[PrebuiltIndex] = None
+        self._mmap: Optional[mmap.mmap] = None
+
+    def load_data(self) -> List[ModerationCategory]:
+        logger.info(f"Loading masterdoc snapshot from {self.file_path}...")
+        header, data_start = read_header(self.file_path)
+        if header.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format {header.get('format')} (expected {FORMAT_VERSION}); "
+                             f"recompile {self.file_path}")
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"Snapshot was compiled on a {header['byteorder']}-endian machine")
+
+        with open(self.file_path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+
+        def section(name: str) -> Sequence[int]:
+            offset, typecode, length = header["sections"][name]
+            start = data_start + offset
+            return view[start:start + length * array(typecode).itemsize].cast(typecode)
+
+        blob, string_offsets = section("strings"), section("string_offsets")
+        strings = [bytes(blob[string_offsets[i]:string_offsets[i + 1]]).decode("utf-8", "surrogatepass")
+                   for i in range(len(string_offsets) - 1)]
+
+        def keyword_list(offsets: Sequence[int], ids: Sequence[int], row: int) -> List[str]:
+            return [strings[sid] for sid in ids[offsets[row]:offsets[row + 1]]]
+
+        row_category, row_subcategory, row_age = section("row_category"), section("row_subcategory"), section("row_age")
+        row_description = section("row_description")
+        cat_offsets, cat_ids = section("row_cat_keyword_offsets"), section("row_cat_keywords")
+        sub_offsets, sub_ids = section("row_sub_keyword_offsets"), section("row_sub_keywords")
+        actions = header["age_actions"]
+        categories = []
+        for row in range(header["rows"]):
+            categories.append(ModerationCategory(
+                category=strings[row_category[row]],
+                subcategory=strings[row_subcategory[row]],
+                category_keywords=keyword_list(cat_offsets, cat_ids, row),
+                subcategory_keywords=keyword_list(sub_offsets, sub_ids, row),
+                age_rules=AgeRestrictionRules(*(actions[a] for a in row_age[4 * row:4 * row + 4])),
+                description=strings[row_description[row]],
+            ))
+
+        length_offsets, length_ids = section("fuzzy_length_offsets"), section("fuzzy_length_ids")
+        by_length = {length: length_ids[length_offsets[i]:length_offsets[i + 1]]
+                     for i, length in enumerate(section("fuzzy_lengths"))}
+        gram_offsets, gram_pairs = section("fuzzy_gram_offsets"), section("fuzzy_gram_pairs")
+        bigrams = {strings[sid]: gram_pairs[gram_offsets[i]:gram_offsets[i + 1]]
+                   for i, sid in enumerate(section("fuzzy_grams"))}
+        self.prebuilt = PrebuiltIndex(
+            keywords=[strings[sid] for sid in section("index_keywords")],
+            postings=PackedPostings(section("posting_offsets"), section("posting_triples")),
+            automaton=DFAAutomaton(header["alphabet"], section("dfa_delta"), header["first_output_state"],
+                                   section("dfa_out_offsets"), section("dfa_out")),
+            fuzzy_tables=(by_length, bigrams),
+        )
+        self.header = header
+        self.content_hash = header["source_sha256"]
+        self.categories = categories
+        # Keep the mapping alive for the index's views; a previous one is
+        # released when its views are garbage collected.
+        self._mmap = mapped
+        self._warn_if_stale()
+        logger.info(f"Loaded {len(categories)} categories from {self.file_path}")
+        return categories
+
+    def _warn_if_stale(self):
+        """Hashes the source CSV only when its size or mtime differ from the compiled one's."""
+        source = self.header.get("source")
+        if not source:
+            return
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return
+        if (stat.st_size, stat.st_mtime_ns) == (self.header.get("source_size"), self.header.get("source_mtime_ns")):
+            return
+        with open(source, "rb") as f:
+            if hashlib.sha256(f.read()).hexdigest() != self.content_hash:
+                logger.warning(f"Snapshot {self.file_path} is older than {source}; recompile it")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m hybrid_moderation.snapshot",
+                                     description="Compile or inspect masterdoc snapshots.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compile_parser = commands.add_parser("compile", help="compile a masterdoc CSV into a snapshot")
+    compile_parser.add_argument("csv", help="masterdoc CSV")
+    compile_parser.add_argument("-o", "--output", help="snapshot path (default: CSV path with .snap)")
+    info_parser = commands.add_parser("info", help="print a snapshot's header")
+    info_parser.add_argument("snapshot")
+    args = parser.parse_args(argv)
+
+    if args.command == "compile":
+        output = args.output or os.path.splitext(args.csv)[0] + ".snap"
+        header = compile_snapshot(args.csv, output)
+        print(f"[HybridMod] Wrote {output} ({os.path.getsize(output)} bytes, {header['rows']} rows, "
+              f"{header['keywords']} keywords, source sha256 {header['source_sha256'][:12]})", file=sys.stderr)
+    else:
+        header, _ = read_header(args.snapshot)
+        header["sections"] = {name: {"offset": offset, "type": typecode, "length": length}
+                              for name, (offset, typecode, length) in header["sections"].items()}
+        print(json.dumps(header, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
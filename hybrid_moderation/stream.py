@@ -0,0 +1,170 @@
+"""
+Streaming JSONL moderation for offline backfills.
+
+Reads one JSON request per line from a file or stdin, moderates them in
+bounded chunks across a process pool and writes one JSON ModerationResult
+per input record to stdout, in input order:
+
+    python -m hybrid_moderation.stream posts.jsonl > results.jsonl
+    cat posts.jsonl | python -m hybrid_moderation.stream --workers 8 > results.jsonl
+
+Every input record produces exactly one output line (records that fail to
+parse or analyze produce an {"error": ...} line), so an interrupted run can
+be resumed with `--offset $(wc -l < results.jsonl) >> results.jsonl`.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+from collections import deque
+from dataclasses import asdict
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from .config import CSV_FILE_PATH
+from .core import ContentModerationSystem
+
+# (record number, raw line)
+Record = Tuple[int, str]
+
+_worker_cms: Optional[ContentModerationSystem] = None
+_worker_fields: Tuple[str, str, str, str] = ("content_id", "text", "age_group", "13-16")
+
+
+def read_records(lines: Iterable[str], offset: int = 0) -> Iterator[Record]:
+    """Yields (record number, line) for non-blank lines, skipping the first `offset` records."""
+    records = ((n, line) for n, line in enumerate(line for line in lines if line.strip()))
+    return itertools.islice(records, offset, None)
+
+
+def chunked(records: Iterable[Record], size: int) -> Iterator[List[Record]]:
+    it = iter(records)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _init_worker(csv_path: str, fields: Tuple[str, str, str, str]):
+    global _worker_cms, _worker_fields
+    # Texts rarely repeat across a one-pass stream (analyze_batch already
+    # analyzes a chunk's duplicates once): the result caches would only hold memory.
+    _worker_cms = ContentModerationSystem(csv_path=csv_path, enable_cache=False)
+    _worker_cms.initialize()
+    _worker_fields = fields
+
+
+def _parse(number: int, line: str) -> Tuple[str, str, str]:
+    return parse_request(number, line, _worker_fields)
+
+
+def parse_request(number: int, line: str, fields: Tuple[str, str, str, str]) -> Tuple[str, str, str]:
+    """(content_id, text, age_group) of a JSONL request; `fields` as for run()."""
+    id_field, text_field, age_field, default_age = fields
+    request = json.loads(line)
+    if not isinstance(request, dict):
+        raise ValueError("request is not a JSON object")
+    text = request.get(text_field)
+    if not isinstance(text, str) or not text:
+        raise ValueError(f"missing '{text_field}'")
+    content_id = str(request.get(id_field) or f"record-{number}")
+    return content_id, text, request.get(age_field) or default_age
+
+
+def _error_line(number: int, error: Exception) -> str:
+    return json.dumps({"record": number, "error": f"{type(error).__name__}: {error}"})
+
+
+def analyze_chunk(chunk: List[Record]) -> List[str]:
+    """Moderates one chunk in the current (worker) process and returns JSON lines."""
+    out: List[Optional[str]] = [None] * len(chunk)
+    items, positions = [], []
+    for i, (number, line) in enumerate(chunk):
+        try:
+            items.append(_parse(number, line))
+            positions.append(i)
+        except Exception as e:
+            out[i] = _error_line(number, e)
+
+    if items:
+        try:
+            results = _worker_cms.analyze_batch(items)
+            for i, result in zip(positions, results):
+                out[i] = json.dumps(asdict(result), ensure_ascii=False)
+        except Exception:
+            # Isolate the failing record(s) instead of losing the chunk.
+            for i, item in zip(positions, items):
+                try:
+                    out[i] = json.dumps(asdict(_worker_cms.analyze(*item)), ensure_ascii=False)
+                except Exception as e:
+                    out[i] = _error_line(chunk[i][0], e)
+    return out
+
+
+def run(lines: Iterable[str], out: TextIO, csv_path: str = CSV_FILE_PATH, workers: int = 0,
+        chunk_size: int = 256, offset: int = 0,
+        fields: Tuple[str, str, str, str] = _worker_fields) -> int:
+    """
+    Moderates every record and writes results to `out` in input order.
+    At most 2 * workers chunks are in flight, so memory stays bounded no matter
+    how large the input is. `workers=0` runs in-process. Returns the number of
+    records written.
+    """
+    chunks = chunked(read_records(lines, offset), chunk_size)
+    written = 0
+
+    def emit(result_lines: List[str]):
+        nonlocal written
+        out.write("\n".join(result_lines) + "\n")
+        out.flush()
+        written += len(result_lines)
+
+    if workers <= 0:
+        _init_worker(csv_path, fields)
+        for chunk in chunks:
+            emit(analyze_chunk(chunk))
+        return written
+
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(csv_path, fields)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(analyze_chunk, (chunk,)))
+            if len(pending) >= 2 * workers:
+                emit(pending.popleft().get())
+        while pending:
+            emit(pending.popleft().get())
+    return written
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m hybrid_moderation.stream",
+        description="Moderate JSONL requests and write JSONL ModerationResults to stdout.")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL file to read ('-' for stdin)")
+    parser.add_argument("--csv", default=CSV_FILE_PATH, help="moderation masterdoc CSV")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (0 = run in this process)")
+    parser.add_argument("--chunk-size", type=int, default=256, help="records per worker task")
+    parser.add_argument("--offset", type=int, default=0, help="number of input records to skip (resume)")
+    parser.add_argument("--id-field", default="content_id")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--age-field", default="age_group")
+    parser.add_argument("--default-age-group", default="13-16")
+    args = parser.parse_args(argv)
+
+    fields = (args.id_field, args.text_field, args.age_field, args.default_age_group)
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8", errors="replace")
+    try:
+        written = run(source, sys.stdout, csv_path=args.csv, workers=args.workers,
+                      chunk_size=max(1, args.chunk_size), offset=args.offset, fields=fields)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    print(f"[HybridMod] Stream complete: {written} records written (resume with --offset {args.offset + written})",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Structured, leveled and sampled tracing for the moderation pipeline.
+
+Call sites ask the tracer for a per-request Trace and guard every event with
+it, so a request that is not traced does no formatting or dict building:
+
+    trace = tracer.start(content_id)
+    if trace.verbose:
+        trace.debug("csv.candidate", category=cat.category, score=cat_score)
+    if trace:
+        trace.info("moderation.decision", decision=decision)
+
+Events are emitted as log records on the `hybrid_moderation.trace` logger with
+their fields in `record.trace`; StructuredFormatter renders them as one JSON
+object per line. configure_tracing() can move the formatting and I/O to a
+background thread via a bounded, drop-on-full queue.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from typing import Optional, TextIO
+
+from .config import TRACE_LEVEL, TRACE_QUEUE_HANDLER, TRACE_QUEUE_SIZE, TRACE_SAMPLE_RATE
+
+logger = logging.getLogger("hybrid_moderation.trace")
+
+
+class Trace:
+    """Events for one sampled request (or batch)."""
+
+    __slots__ = ("content_id", "verbose")
+
+    def __init__(self, content_id: str, verbose: bool):
+        self.content_id = content_id
+        self.verbose = verbose
+
+    def __bool__(self) -> bool:
+        return True
+
+    def debug(self, event: str, **fields):
+        self._emit(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields):
+        self._emit(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields):
+        self._emit(logging.WARNING, event, fields)
+
+    def _emit(self, level: int, event: str, fields: dict):
+        fields["content_id"] = self.content_id
+        logger.log(level, event, extra={"trace": fields})
+
+
+class _NullTrace(Trace):
+    """Trace of an unsampled request; falsy so guarded call sites skip all work."""
+
+    def __bool__(self) -> bool:
+        return False
+
+    def _emit(self, level: int, event: str, fields: dict):
+        pass
+
+
+NULL_TRACE = _NullTrace("", False)
+
+
+class Tracer:
+    """Decides per request whether to trace, based on logger level and sample rate."""
+
+    def __init__(self, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+
+    def start(self, content_id: str) -> Trace:
+        if not logger.isEnabledFor(logging.INFO):
+            return NULL_TRACE
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return NULL_TRACE
+        return Trace(content_id, logger.isEnabledFor(logging.DEBUG))
+
+
+class StructuredFormatter(logging.Formatter):
+    """Renders a record as a single JSON line: time, level, event and trace fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        fields = getattr(record, "trace", None)
+        if fields:
+            payload.update(fields)
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records unformatted and never blocks: when the queue is full the
+    record is dropped and counted instead.
+    """
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_tracing(level: Optional[str] = None, sample_rate: Optional[float] = None,
+                      use_queue: Optional[bool] = None, stream: Optional[TextIO] = None) -> float:
+    """
+    Installs the structured handler on the trace logger. Arguments default to
+    the MODERATION_TRACE_LEVEL / MODERATION_TRACE_SAMPLE_RATE /
+    MODERATION_TRACE_QUEUE environment variables, then to config.py.
+    Returns the effective sample rate for Tracer.
+    """
+    global _listener
+    level = (level or os.environ.get("MODERATION_TRACE_LEVEL") or TRACE_LEVEL).upper()
+    if sample_rate is None:
+        sample_rate = float(os.environ.get("MODERATION_TRACE_SAMPLE_RATE", TRACE_SAMPLE_RATE))
+    if use_queue is None:
+        use_queue = os.environ.get("MODERATION_TRACE_QUEUE", str(int(TRACE_QUEUE_HANDLER))) not in ("0", "false", "False")
+
+    shutdown_tracing()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    stream_handler = logging.StreamHandler(stream or sys.stderr)
+    stream_handler.setFormatter(StructuredFormatter())
+    if use_queue:
+        q = queue.Queue(TRACE_QUEUE_SIZE)
+        logger.addHandler(_DroppingQueueHandler(q))
+        _listener = logging.handlers.QueueListener(q, stream_handler)
+        _listener.start()
+    else:
+        logger.addHandler(stream_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    return sample_rate
+
+
+def shutdown_tracing():
+    """Flushes and stops the background listener, if any."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_tracing)
+logger.setLevel(TRACE_LEVEL)
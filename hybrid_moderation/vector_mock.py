@@ -1,7 +1,7 @@
 
 import random
 from typing import Dict, List, Tuple
-from .models import VectorAnalysisResult
+from .models import ModerationCategory, VectorAnalysisResult
 
 class VectorSearchClient:
     """
@@ -11,6 +11,12 @@ class VectorSearchClient:
     def __init__(self):
         pass
 
+    def build(self, categories: List[ModerationCategory]):
+        """Nothing to index; the mock ignores the masterdoc."""
+
+    def clone(self) -> "VectorSearchClient":
+        return VectorSearchClient()
+
     def semantic_analyze(self, text: str, categories: List[str]) -> VectorAnalysisResult:
         """
         Simulates semantic analysis.
@@ -45,3 +51,7 @@ class VectorSearchClient:
             confidence=0.2,
             embedding_similarity=0.15
         )
+
+    def semantic_analyze_batch(self, texts: List[str], categories: List[str]) -> List[VectorAnalysisResult]:
+        """Analyzes several texts against the same category list."""
+        return [self.semantic_analyze(text, categories) for text in texts]
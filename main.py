@@ -1,9 +1,15 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import codecs
+import hmac
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Literal, Optional
 import uvicorn
 import logging
+import signal
 import sys
 
 # Add current directory to path so we can import hybrid_moderation
@@ -12,23 +18,45 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from hybrid_moderation.core import ContentModerationSystem
 from hybrid_moderation.models import ModerationResult
-from hybrid_moderation.config import SYSTEM_PROMPT
+from hybrid_moderation.config import (
+    SYSTEM_PROMPT, MAX_BATCH_SIZE, RELOAD_WATCH_INTERVAL_SECONDS, DOCUMENT_MAX_BYTES, SHADOW_CANDIDATE_DIR
+)
+from hybrid_moderation.tracing import configure_tracing
+from hybrid_moderation.metrics import ANALYSIS_METRICS, REGISTRY
+from hybrid_moderation.serving import Overloaded, ProcessDispatcher, ThreadDispatcher, create_dispatcher, create_microbatcher
+from hybrid_moderation.profiling import collapsed_cpu, collapsed_memory, pstats_dump, pstats_text
+from hybrid_moderation.reload import MasterdocWatcher
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("moderation-api")
 
-app = FastAPI(title="Komal Hybrid Moderation API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if isinstance(dispatcher, ProcessDispatcher):
+        pids = await asyncio.get_running_loop().run_in_executor(None, dispatcher.warm_up)
+        logger.info(f"Process pool ready: {len(pids)} workers")
+    # MODERATION_RELOAD_WATCH: seconds between masterdoc checks (0 = off)
+    interval = float(os.environ.get("MODERATION_RELOAD_WATCH", RELOAD_WATCH_INTERVAL_SECONDS))
+    watcher = MasterdocWatcher(cms.loader.file_path, reload_masterdoc, interval).start() if interval > 0 else None
+    yield
+    if watcher is not None:
+        watcher.stop()
+    dispatcher.shutdown()
+
+app = FastAPI(title="Komal Hybrid Moderation API", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
-    allow_methods=["POST", "GET", "OPTIONS"],
+    allow_methods=["POST", "GET", "DELETE", "OPTIONS"],
+    # x-moderation-profile is left out: browsers cannot send it cross-origin.
     allow_headers=["Content-Type", "x-api-key"],
 )
 app.state.system_prompt = SYSTEM_PROMPT
 
-# Initialize CMS
-cms = ContentModerationSystem(csv_path="Models_Masterdoc_Test.csv")
+# Initialize CMS (MODERATION_MASTERDOC may point at a compiled snapshot, see snapshot.py)
+cms = ContentModerationSystem(csv_path=os.environ.get("MODERATION_MASTERDOC", "Models_Masterdoc_Test.csv"))
+cms.tracer.sample_rate = configure_tracing()
 try:
     cms.initialize()
     logger.info("Content Moderation System initialized successfully")
@@ -36,27 +64,279 @@ except Exception as e:
     logger.error(f"Failed to initialize CMS: {e}")
     sys.exit(1)
 
+# Runs analysis off the event loop with bounded admission (see serving.py)
+dispatcher = create_dispatcher(cms)
+# MODERATION_MICROBATCH=1: concurrent /analyze requests are analyzed in micro-batches
+batcher = create_microbatcher(dispatcher)
+
+def reload_masterdoc(force: bool = False) -> dict:
+    summary = dispatcher.reload(force)
+    if isinstance(dispatcher, ProcessDispatcher):
+        # Documents are analyzed in this process (see /analyze/document).
+        cms.reload(force)
+    if summary["reloaded"]:
+        logger.info(f"Masterdoc reloaded: {summary}")
+    return summary
+
+# /admin routes require MODERATION_ADMIN_TOKEN in the x-api-key header; without
+# a token configured they are refused.
+ADMIN_TOKEN = os.environ.get("MODERATION_ADMIN_TOKEN")
+
+def require_admin(x_api_key: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin routes are disabled (MODERATION_ADMIN_TOKEN is not set)")
+    if x_api_key is None or not hmac.compare_digest(x_api_key.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+async def dispatch(call):
+    try:
+        return await call
+    except Overloaded:
+        raise HTTPException(status_code=429, detail="Server overloaded, retry later", headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Analysis timed out")
+
+# ?view=compact returns only content_id and final_decision's decision and
+# weighted_score; results are serialized by ModerationResult.to_json, not by
+# FastAPI's generic encoder.
+ResultView = Literal["compact", "full"]
+
+def result_response(results, view: str) -> Response:
+    if isinstance(results, ModerationResult):
+        body = results.to_json(view)
+    else:
+        body = "[" + ",".join(result.to_json(view) for result in results) + "]"
+    return Response(body, media_type="application/json")
+
 class AnalysisRequest(BaseModel):
     text: str
     age_group: str = '13-16'
     content_id: str = 'api-request'
 
+class BatchAnalysisRequest(BaseModel):
+    items: List[AnalysisRequest]
+
 @app.get("/")
 def health_check():
     return {"status": "healthy", "service": "komal-moderation"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    if isinstance(dispatcher, ProcessDispatcher):
+        # The pool workers' series cannot be reached from here: export only
+        # what this process records, and say so.
+        names = ", ".join(metric.name for metric in ANALYSIS_METRICS)
+        body = (f"# {names} are recorded in the worker processes and not available with "
+                f"MODERATION_SERVING_MODE=process\n" + REGISTRY.render(exclude=ANALYSIS_METRICS))
+    else:
+        body = REGISTRY.render()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def cache_stats():
+    if isinstance(dispatcher, ProcessDispatcher):
+        raise HTTPException(status_code=501, detail="Caches are per worker process with MODERATION_SERVING_MODE=process; "
+                                                    "their stats are not available")
+    return cms.cache_stats()
+
+@app.post("/admin/reload")
+async def admin_reload(force: bool = False, x_api_key: Optional[str] = Header(default=None)):
+    require_admin(x_api_key)
+    master = os.environ.get("MODERATION_PREFORK_MASTER")
+    if master:
+        # Preforked worker (see hybrid_moderation/prefork.py): the master
+        # reloads, and restarts every worker if the masterdoc changed (or force).
+        os.kill(int(master), signal.SIGUSR1 if force else signal.SIGHUP)
+        return {"reloaded": None, "reload_requested": True, "force": force, "master": int(master)}
+    try:
+        # Rebuilds run off the event loop; requests keep being served meanwhile.
+        return await asyncio.get_running_loop().run_in_executor(None, reload_masterdoc, force)
+    except Exception as e:
+        logger.error(f"Masterdoc reload failed: {e}")
+        raise HTTPException(status_code=422, detail=f"Reload failed, still serving the previous masterdoc: {e}")
+
+ProfileMode = Literal["cpu", "memory", "both"]
+
+def profile_ids(ids: Optional[str]) -> Optional[List[int]]:
+    try:
+        return [int(i) for i in ids.split(",")] if ids else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma-separated profile ids")
+
+@app.get("/admin/profile")
+def admin_profiles(x_api_key: Optional[str] = Header(default=None)):
+    require_admin(x_api_key)
+    return {"profiler": cms.profiler.stats(), "profiles": [p.summary() for p in cms.profiler.profiles()]}
+
+@app.post("/admin/profile")
+def admin_configure_profiling(sample_rate: Optional[float] = None, mode: Optional[ProfileMode] = None,
+                              clear: bool = False, x_api_key: Optional[str] = Header(default=None)):
+    """Sets the share of analyses profiled (0 turns sampling off) and what is captured."""
+    require_admin(x_api_key)
+    if sample_rate is not None and not 0 <= sample_rate <= 1:
+        raise HTTPException(status_code=400, detail="sample_rate must be between 0 and 1")
+    cms.configure_profiling(sample_rate, mode)
+    if clear:
+        cms.profiler.clear()
+    return cms.profiler.stats()
+
+@app.get("/admin/profile/pstats")
+def admin_profile_pstats(ids: Optional[str] = None, sort: str = "cumulative", limit: int = 50, raw: bool = False,
+                         x_api_key: Optional[str] = Header(default=None)):
+    """
+    The buffered CPU profiles (or `ids`) merged: pstats text, or with raw=true
+    a file for `python -m pstats` / snakeviz.
+    """
+    require_admin(x_api_key)
+    profiles = cms.profiler.profiles(profile_ids(ids))
+    if raw:
+        return Response(pstats_dump(profiles), media_type="application/octet-stream",
+                        headers={"Content-Disposition": 'attachment; filename="moderation.pstats"'})
+    try:
+        return PlainTextResponse(pstats_text(profiles, sort, limit))
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown sort key: {sort}")
+
+@app.get("/admin/profile/collapsed", response_class=PlainTextResponse)
+def admin_profile_collapsed(kind: Literal["cpu", "memory"] = "cpu", ids: Optional[str] = None,
+                            x_api_key: Optional[str] = Header(default=None)):
+    """Collapsed stacks for flamegraph.pl / speedscope: CPU microseconds or allocated bytes."""
+    require_admin(x_api_key)
+    profiles = cms.profiler.profiles(profile_ids(ids))
+    return PlainTextResponse(collapsed_cpu(profiles) if kind == "cpu" else collapsed_memory(profiles))
+
+@app.get("/admin/shadow")
+def admin_shadow(x_api_key: Optional[str] = Header(default=None)):
+    """Decision flips of the shadow candidate masterdoc so far, per category and age group."""
+    require_admin(x_api_key)
+    return cms.shadow.report() if cms.shadow is not None else {"running": False}
+
+# Candidate masterdocs for POST /admin/shadow are only loaded from this directory
+SHADOW_DIR = os.path.realpath(os.environ.get("MODERATION_SHADOW_DIR") or SHADOW_CANDIDATE_DIR
+                              or os.path.dirname(os.path.abspath(cms.loader.file_path)))
+
+@app.post("/admin/shadow")
+async def admin_start_shadow(path: str, sample_rate: Optional[float] = None,
+                             x_api_key: Optional[str] = Header(default=None)):
+    """
+    Starts evaluating the candidate masterdoc `path` (relative to the
+    candidates directory, MODERATION_SHADOW_DIR) next to the live one (see
+    hybrid_moderation/shadow.py), replacing a running shadow. With preforked
+    workers, each worker process has its own shadow; set
+    MODERATION_SHADOW_MASTERDOC to start one in every worker.
+    """
+    require_admin(x_api_key)
+    if sample_rate is not None and not 0 <= sample_rate <= 1:
+        raise HTTPException(status_code=400, detail="sample_rate must be between 0 and 1")
+    if not isinstance(dispatcher, ThreadDispatcher):
+        raise HTTPException(status_code=400, detail="Shadow evaluation needs MODERATION_SERVING_MODE=thread")
+    candidate = os.path.realpath(os.path.join(SHADOW_DIR, path))
+    if os.path.commonpath([candidate, SHADOW_DIR]) != SHADOW_DIR:
+        raise HTTPException(status_code=400, detail="Candidates must be in the candidates directory")
+    try:
+        # Building the candidate's indexes runs off the event loop.
+        return await asyncio.get_running_loop().run_in_executor(None, cms.start_shadow, candidate, sample_rate)
+    except Exception as e:
+        logger.error(f"Shadow candidate {candidate} failed to load: {e}")
+        raise HTTPException(status_code=422, detail="Candidate failed to load (see the server log)")
+
+@app.delete("/admin/shadow")
+def admin_stop_shadow(x_api_key: Optional[str] = Header(default=None)):
+    """Stops the shadow evaluation and returns its final report."""
+    require_admin(x_api_key)
+    report = cms.stop_shadow()
+    if report is None:
+        raise HTTPException(status_code=404, detail="No shadow evaluation running")
+    return report
+
 @app.post("/analyze")
-def analyze_content(request: AnalysisRequest):
+async def analyze_content(request: AnalysisRequest, view: ResultView = "full",
+                          x_moderation_profile: Optional[ProfileMode] = Header(default=None),
+                          x_api_key: Optional[str] = Header(default=None)):
     if not request.text:
         raise HTTPException(status_code=400, detail="Text content is required")
     
     try:
         logger.info(f"Analyzing content ID: {request.content_id}, Age: {request.age_group}")
-        result = cms.analyze(request.content_id, request.text, request.age_group)
-        return result
+        if x_moderation_profile:
+            # Admins can profile a single request (see /admin/profile).
+            require_admin(x_api_key)
+            if not isinstance(dispatcher, ThreadDispatcher):
+                raise HTTPException(status_code=400, detail="Profiling needs MODERATION_SERVING_MODE=thread")
+            result = await dispatch(dispatcher.analyze_profiled(request.content_id, request.text, request.age_group,
+                                                                x_moderation_profile))
+        else:
+            result = await dispatch((batcher or dispatcher).analyze(request.content_id, request.text,
+                                                                    request.age_group))
+        return result_response(result, view)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Analysis failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze/batch")
+async def analyze_batch(request: BatchAnalysisRequest, view: ResultView = "full"):
+    if not request.items:
+        raise HTTPException(status_code=400, detail="At least one item is required")
+    if len(request.items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_SIZE} items")
+    missing = [i for i, item in enumerate(request.items) if not item.text]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Text content is required (items {missing[:10]})")
+
+    try:
+        logger.info(f"Analyzing batch of {len(request.items)} items")
+        items = [(item.content_id, item.text, item.age_group) for item in request.items]
+        return result_response(await dispatch(dispatcher.analyze_batch(items)), view)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch analysis failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/analyze/document")
+async def analyze_document(request: Request, age_group: str = '13-16', content_id: str = 'api-request',
+                           view: ResultView = "full", stop_on_block: bool = False):
+    """
+    Long documents and transcripts: the raw UTF-8 body is analyzed window by
+    window as it arrives (see hybrid_moderation/document.py). With
+    stop_on_block=true reading stops at the first age-rule Block and the
+    document is blocked, even where /analyze on the whole text would not be.
+    """
+    loop = asyncio.get_running_loop()
+    session = cms.document_session(content_id, age_group, stop_on_block)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    async def analyze_stream():
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > DOCUMENT_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Document exceeds {DOCUMENT_MAX_BYTES} bytes")
+            text = decoder.decode(chunk)
+            if text:
+                await loop.run_in_executor(None, session.feed, text)
+            if session.stopped:
+                break
+        else:
+            session.feed(decoder.decode(b"", final=True))
+        if not session.characters:
+            raise HTTPException(status_code=400, detail="Text content is required")
+        return await loop.run_in_executor(None, session.finish)
+
+    try:
+        logger.info(f"Analyzing document ID: {content_id}, Age: {age_group}")
+        # The session runs in this process, but takes a dispatcher slot (and
+        # its batch timeout) like /analyze/batch.
+        return result_response(await dispatch(dispatcher.run_admitted(analyze_stream())), view)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Document analysis failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Development server; in production run `python -m hybrid_moderation.prefork`
+# (see the Dockerfile), which loads the masterdoc once for all workers.
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)